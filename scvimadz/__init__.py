@@ -1,15 +1,6 @@
+import importlib
+import importlib.metadata as importlib_metadata
 import logging
-from rich.console import Console
-from rich.logging import RichHandler
-
-from . import reference, storage
-
-# https://github.com/python-poetry/poetry/pull/2366#issuecomment-652418094
-# https://github.com/python-poetry/poetry/issues/144#issuecomment-623927302
-try:
-    import importlib.metadata as importlib_metadata
-except ModuleNotFoundError:
-    import importlib_metadata
 
 package_name = "scvi-model-zoo"
 __version__ = importlib_metadata.version(package_name)
@@ -18,14 +9,41 @@ logger = logging.getLogger(__name__)
 # set the default logging level
 logger.setLevel(logging.INFO)
 
-# nice logging outputs
-console = Console(force_terminal=True)
-if console.is_jupyter:
-    console.is_jupyter = False
-ch = RichHandler(show_path=False, console=console)
+
+class _LazyRichHandler(logging.Handler):
+    """Logging handler that defers building the rich console until the first record is emitted."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._handler = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._handler is None:
+            from rich.console import Console
+            from rich.logging import RichHandler
+
+            # nice logging outputs
+            console = Console(force_terminal=True)
+            if console.is_jupyter:
+                console.is_jupyter = False
+            self._handler = RichHandler(show_path=False, console=console)
+        self._handler.handle(record)
+
+
+ch = _LazyRichHandler()
 logger.addHandler(ch)
 
 # this prevents double outputs
 logger.propagate = False
 
-__all__ = ["reference", "storage"]
+# submodules are imported on first access so that `import scvimadz` stays cheap
+_submodules = ["instrumentation", "reference", "serving", "storage"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["instrumentation", "reference", "storage"]
@@ -0,0 +1,120 @@
+"""
+Private scvi-tools APIs used by scvimadz.
+
+scvi-tools makes no promise about these across versions, so they are only accessed through the
+helpers below, which first check that the installed scvi-tools is one they were written for.
+"""
+import functools
+import re
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import torch
+    from anndata import AnnData
+    from scvi.model.base import BaseModelClass
+
+# range of the scvi-tools versions supported, as (major, minor), the upper bound excluded.
+# Keep in sync with the scvi-tools dependency in pyproject.toml.
+_SUPPORTED_VERSIONS = ((0, 15), (0, 16))
+
+
+@functools.lru_cache(maxsize=None)
+def check_scvi_version() -> str:
+    """
+    Raises an error if the installed scvi-tools is not supported.
+
+    Returns
+    -------
+    The installed version of scvi-tools.
+    """
+    import scvi
+
+    version = scvi.__version__
+    numbers = tuple(int(n) for n in re.findall(r"\d+", version)[:2])
+    low, high = _SUPPORTED_VERSIONS
+    if not low <= numbers < high:
+        raise ValueError(
+            f"scvi-tools {version} is not supported, scvimadz requires scvi-tools "
+            f">={'.'.join(map(str, low))},<{'.'.join(map(str, high))}."
+        )
+    return version
+
+
+def load_saved_files(
+    dir_path: str, prefix: Optional[str] = None
+) -> Tuple[dict, List[str], Dict[str, "torch.Tensor"]]:
+    """Returns the attributes, var_names and state dict of a model saved in `dir_path`, on the CPU."""
+    check_scvi_version()
+    from scvi.model.base._utils import _load_saved_files
+
+    attr_dict, var_names, model_state_dict, _ = _load_saved_files(
+        dir_path, load_adata=False, prefix=prefix, map_location="cpu"
+    )
+    return attr_dict, var_names, model_state_dict
+
+
+def parse_device(use_gpu: Optional[Union[str, int, bool]]) -> "torch.device":
+    """Returns the device to load a model on, see :meth:`~scvi.model.base.BaseModelClass.load`."""
+    check_scvi_version()
+    from scvi.model._utils import parse_use_gpu_arg
+
+    _, device = parse_use_gpu_arg(use_gpu)
+    return device
+
+
+def validate_var_names(adata: "AnnData", var_names: List[str]) -> None:
+    """Checks that `adata` has the genes a model was trained with, in the same order."""
+    check_scvi_version()
+    from scvi.model.base._utils import _validate_var_names
+
+    _validate_var_names(adata, var_names)
+
+
+def initialize_model(
+    model_cls: "BaseModelClass", adata: "AnnData", attr_dict: dict
+) -> "BaseModelClass":
+    """
+    Sets up `adata` with the registry in the saved attributes of a model, and creates the model.
+
+    The attributes are those returned by :func:`load_saved_files`, holding either a registry
+    or, for legacy models, a setup dict. The weights of the returned model are not loaded.
+    """
+    check_scvi_version()
+    from scvi.data._compat import manager_from_setup_dict
+    from scvi.data._constants import _MODEL_NAME_KEY, _SETUP_ARGS_KEY
+    from scvi.model.base._utils import _initialize_model
+
+    if "scvi_setup_dict_" in attr_dict:
+        # legacy setup dict format
+        model_cls.register_manager(
+            manager_from_setup_dict(
+                model_cls,
+                adata,
+                attr_dict.pop("scvi_setup_dict_"),
+                unlabeled_category=attr_dict.get("unlabeled_category_", None),
+            )
+        )
+    else:
+        registry = attr_dict.pop("registry_")
+        if registry.get(_MODEL_NAME_KEY, model_cls.__name__) != model_cls.__name__:
+            raise ValueError(
+                "It appears you are loading a model from a different class."
+            )
+        model_cls.setup_anndata(
+            adata, source_registry=registry, **registry[_SETUP_ARGS_KEY]
+        )
+    return _initialize_model(model_cls, adata, attr_dict)
+
+
+def validate_anndata(model: "BaseModelClass", adata: "AnnData") -> None:
+    """Sets up `adata` for `model` with the registry the model was trained with."""
+    check_scvi_version()
+    model._validate_anndata(adata)
+
+
+def release_anndata_manager(model: "BaseModelClass", adata: "AnnData") -> None:
+    """Makes `model` forget the manager of `adata`, which it otherwise keeps for its lifetime."""
+    check_scvi_version()
+    manager = model.get_anndata_manager(adata)
+    if manager is not None:
+        model._per_instance_manager_store[model.id].pop(manager.adata_uuid, None)
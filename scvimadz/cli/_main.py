@@ -0,0 +1,350 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from scvimadz.reference import GenericReference, TabulaSapiensReference
+from scvimadz.reference.base import BaseReference
+from scvimadz.storage import (
+    ContentStore,
+    FederatedStorage,
+    ZenodoStorage,
+    cache_size,
+    prune_cache,
+)
+from scvimadz.storage.base import BaseStorage
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def _parse_size(value: str) -> int:
+    """Parses sizes such as ``"500M"`` or ``"2G"`` into a number of bytes."""
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1] if value and value[-1] in _SIZE_UNITS else ""
+    number = value[: len(value) - len(unit)]
+    try:
+        return int(float(number) * _SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {value}")
+
+
+def _format_size(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _make_store(records: str, args: argparse.Namespace) -> BaseStorage:
+    offline = True if args.offline else None
+    content_store = ContentStore(args.content_store) if args.content_store else None
+    record_ids = [record_id.strip() for record_id in records.split(",")]
+    if len(record_ids) > 1:
+        return FederatedStorage.from_zenodo_records(
+            record_ids, args.data_dir, offline=offline, content_store=content_store
+        )
+    return ZenodoStorage(
+        record_ids[0], args.data_dir, offline=offline, content_store=content_store
+    )
+
+
+def _make_reference(args: argparse.Namespace) -> BaseReference:
+    if args.model_record is None and args.data_record is None:
+        return TabulaSapiensReference(
+            args.data_dir,
+            offline=True if args.offline else None,
+            content_store=ContentStore(args.content_store)
+            if args.content_store
+            else None,
+        )
+    if args.model_record is None or args.data_record is None:
+        raise ValueError("--model-record and --data-record must be provided together.")
+    return GenericReference(
+        model_store=_make_store(args.model_record, args),
+        data_store=_make_store(args.data_record, args),
+    )
+
+
+def _list(args: argparse.Namespace) -> int:
+    reference = _make_reference(args)
+    if args.obj_type == "models":
+        df = reference.get_models_df(pretty_print=args.pretty, page_size=args.page_size)
+    else:
+        df = reference.get_datasets_df(
+            pretty_print=args.pretty, page_size=args.page_size
+        )
+    if not args.pretty:
+        print(df.to_string())
+    return 0
+
+
+def _prefetch(args: argparse.Namespace) -> int:
+    reference = _make_reference(args)
+    if args.obj_type == "models":
+        store = reference.model_store
+        ids = reference.get_models_df().index.to_list() if args.all else args.ids
+    else:
+        store = reference.data_store
+        ids = reference.get_datasets_df().index.to_list() if args.all else args.ids
+    if not ids:
+        raise ValueError("Provide the ids to prefetch or use --all.")
+
+    def fetch(key):
+        path = store.download_file(key)
+        print(f"Fetched {key} -> {path}")
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        # list() to propagate any exception raised in the workers
+        list(executor.map(fetch, ids))
+    return 0
+
+
+def _verify(args: argparse.Namespace) -> int:
+    reference = _make_reference(args)
+    reports = reference.verify_local_files(repair=args.repair, max_workers=args.jobs)
+    if reports["datasets"] is reports["models"]:
+        del reports["datasets"]
+    n_checked = n_bad = 0
+    for report in reports.values():
+        for key in report.verified:
+            print(f"{'MISMATCH' if key in report.corrupted else 'OK'}\t{key}")
+        for key in report.repaired:
+            print(f"REPAIRED\t{key}")
+        n_checked += len(report.verified)
+        n_bad += len(report.failed)
+    n_corrupted = sum(len(r.corrupted) for r in reports.values())
+    # each record of a federated storage quarantines files in its own data_dir
+    quarantine_dirs = sorted(
+        {os.path.dirname(path) for r in reports.values() for path in r.quarantined}
+    )
+    print(
+        f"Verified {n_checked} files, {n_corrupted} mismatched, "
+        f"{n_corrupted - n_bad} repaired. Mismatched files were moved to "
+        f"{', '.join(quarantine_dirs)}."
+        if n_corrupted
+        else f"Verified {n_checked} files, 0 mismatched."
+    )
+    return 1 if n_bad else 0
+
+
+def _cache_size(args: argparse.Namespace) -> int:
+    print(_format_size(cache_size(args.data_dir)))
+    return 0
+
+
+def _prune(args: argparse.Namespace) -> int:
+    max_age = args.max_age_days * 24 * 3600 if args.max_age_days is not None else None
+    content_store = (
+        ContentStore(args.content_store)
+        if args.content_store
+        else ContentStore.from_env()
+    )
+    removed = prune_cache(
+        args.data_dir,
+        args.max_size,
+        max_age,
+        dry_run=args.dry_run,
+        content_store=content_store,
+    )
+    for path in removed:
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {path}")
+    print(f"Cache size is now {_format_size(cache_size(args.data_dir))}.")
+    return 0
+
+
+def _serve(args: argparse.Namespace) -> int:
+    from scvimadz.serving import ModelServer, make_http_server
+
+    reference = _make_reference(args)
+    server = ModelServer(
+        reference,
+        model_ids=args.models or None,
+        batch_window=args.batch_window_ms / 1000,
+        max_batch_size=args.max_batch_size,
+        max_concurrency=args.max_concurrency,
+        labels_key=args.labels_key,
+        n_threads=args.threads,
+    )
+    http_server = make_http_server(
+        server, host=args.host, port=args.port, socket_path=args.socket
+    )
+    where = args.socket or "http://{}:{}".format(*http_server.server_address[:2])
+    print(f"Serving {len(server.model_ids)} models on {where}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        server.close()
+    return 0
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="scvimadz",
+        description="List, prefetch and manage the local cache of scvi model zoo objects.",
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--data-dir", required=True, help="Directory that files are downloaded to."
+    )
+    remote = argparse.ArgumentParser(add_help=False)
+    remote.add_argument(
+        "--model-record",
+        help="Zenodo record id of the model store, or comma-separated ids of several records "
+        "to federate. Defaults to the Tabula Sapiens reference.",
+    )
+    remote.add_argument(
+        "--data-record",
+        help="Zenodo record id of the data store, or comma-separated ids of several records "
+        "to federate. Defaults to the Tabula Sapiens reference.",
+    )
+    remote.add_argument(
+        "--offline",
+        action="store_true",
+        help="Operate from the local record snapshot only, without network calls.",
+    )
+    remote.add_argument(
+        "--content-store",
+        help="Directory of a content store shared with other data directories, that files "
+        "are linked from instead of being downloaded again. Defaults to the "
+        "SCVIMADZ_CONTENT_STORE environment variable.",
+    )
+    jobs = argparse.ArgumentParser(add_help=False)
+    jobs.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Number of parallel workers."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser(
+        "list", parents=[common, remote], help="List models or datasets."
+    )
+    list_parser.add_argument("obj_type", choices=["models", "datasets"])
+    list_parser.add_argument("--pretty", action="store_true")
+    list_parser.add_argument(
+        "--page-size",
+        type=int,
+        default=50,
+        help="Number of rows per page with --pretty.",
+    )
+    list_parser.set_defaults(func=_list)
+
+    prefetch_parser = subparsers.add_parser(
+        "prefetch",
+        parents=[common, remote, jobs],
+        help="Download models or datasets to the data directory.",
+    )
+    prefetch_parser.add_argument("obj_type", choices=["models", "datasets"])
+    prefetch_parser.add_argument("ids", nargs="*", help="Ids of the objects to fetch.")
+    prefetch_parser.add_argument(
+        "--all", action="store_true", help="Fetch all objects of the given type."
+    )
+    prefetch_parser.set_defaults(func=_prefetch)
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        parents=[common, remote, jobs],
+        help="Verify the checksums of the local copies against the remote stores.",
+    )
+    verify_parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Download the mismatched files again.",
+    )
+    verify_parser.set_defaults(func=_verify)
+
+    size_parser = subparsers.add_parser(
+        "cache-size", parents=[common], help="Report the size of the data directory."
+    )
+    size_parser.set_defaults(func=_cache_size)
+
+    prune_parser = subparsers.add_parser(
+        "prune",
+        parents=[common],
+        help="Remove least recently used files from the data directory, then the files "
+        "of the content store that are not linked anymore.",
+    )
+    prune_parser.add_argument(
+        "--content-store",
+        help="Directory of the content store that files were linked from. Defaults to the "
+        "SCVIMADZ_CONTENT_STORE environment variable.",
+    )
+    prune_parser.add_argument(
+        "--max-size",
+        type=_parse_size,
+        help="Remove least recently used files until the cache is at most this size, e.g. 50G.",
+    )
+    prune_parser.add_argument(
+        "--max-age-days",
+        type=float,
+        help="Remove files that were not used in this many days.",
+    )
+    prune_parser.add_argument("--dry-run", action="store_true")
+    prune_parser.set_defaults(func=_prune)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        parents=[common, remote],
+        help="Keep models warm and serve queries over a local HTTP API.",
+    )
+    serve_parser.add_argument(
+        "--models",
+        nargs="*",
+        help="Ids of the models to serve. Defaults to all models.",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument(
+        "--socket", help="Listen on this Unix socket instead of --host and --port."
+    )
+    serve_parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=5.0,
+        help="Time to wait for more queries to merge into a batch.",
+    )
+    serve_parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=8192,
+        help="Number of cells after which a batch is closed.",
+    )
+    serve_parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=1,
+        help="Number of batches run at the same time for each model.",
+    )
+    serve_parser.add_argument(
+        "--labels-key",
+        help="obs column of the training data with the labels to transfer to queries.",
+    )
+    serve_parser.add_argument(
+        "--threads", type=int, help="Number of threads used by torch."
+    )
+    serve_parser.set_defaults(func=_serve)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point of the ``scvimadz`` command line tool.
+
+    Parameters
+    ----------
+    argv
+        Command line arguments. Defaults to ``sys.argv[1:]``.
+
+    Returns
+    -------
+    The exit code.
+    """
+    args = _build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
@@ -0,0 +1,19 @@
+from ._hooks import (
+    InstrumentationCallback,
+    LoggingCallback,
+    add_callback,
+    count,
+    is_enabled,
+    remove_callback,
+    span,
+)
+
+__all__ = [
+    "InstrumentationCallback",
+    "LoggingCallback",
+    "add_callback",
+    "remove_callback",
+    "is_enabled",
+    "span",
+    "count",
+]
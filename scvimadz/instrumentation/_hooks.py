@@ -0,0 +1,160 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationCallback:
+    """
+    Base class for instrumentation callbacks.
+
+    Subclass this and override :meth:`on_span` and/or :meth:`on_counter` to forward the
+    timings and counters emitted by the storage and reference layers to a metrics backend
+    (e.g. statsd, Prometheus or an OpenTelemetry tracer).
+    """
+
+    def on_span(self, name: str, duration: float, attributes: Dict[str, Any]) -> None:
+        """
+        Called when a timed span ends.
+
+        Parameters
+        ----------
+        name
+            Name of the span, e.g. ``"zenodo.download_file"``
+        duration
+            Wall-clock duration of the span in seconds
+        attributes
+            Additional attributes attached to the span (e.g. the key being downloaded).
+            Contains an ``"error"`` entry with the exception type name if the span raised.
+        """
+        pass
+
+    def on_counter(self, name: str, value: float, attributes: Dict[str, Any]) -> None:
+        """
+        Called when a counter is incremented.
+
+        Parameters
+        ----------
+        name
+            Name of the counter, e.g. ``"zenodo.bytes_downloaded"``
+        value
+            Amount by which the counter is incremented
+        attributes
+            Additional attributes attached to the counter
+        """
+        pass
+
+
+class LoggingCallback(InstrumentationCallback):
+    """
+    Instrumentation callback that reports spans and counters through the standard logging module.
+
+    Parameters
+    ----------
+    level
+        Logging level to use for the records.
+    """
+
+    def __init__(self, level: int = logging.DEBUG) -> None:
+        self._level = level
+
+    def on_span(self, name: str, duration: float, attributes: Dict[str, Any]) -> None:
+        logger.log(self._level, "span %s took %.4fs %s", name, duration, attributes)
+
+    def on_counter(self, name: str, value: float, attributes: Dict[str, Any]) -> None:
+        logger.log(self._level, "counter %s += %s %s", name, value, attributes)
+
+
+_callbacks: List[InstrumentationCallback] = []
+
+
+def add_callback(callback: InstrumentationCallback) -> None:
+    """
+    Registers the given callback to receive all spans and counters.
+
+    Parameters
+    ----------
+    callback
+        The callback to register
+    """
+    if callback not in _callbacks:
+        _callbacks.append(callback)
+
+
+def remove_callback(callback: InstrumentationCallback) -> None:
+    """
+    Unregisters the given callback, if registered.
+
+    Parameters
+    ----------
+    callback
+        The callback to unregister
+    """
+    if callback in _callbacks:
+        _callbacks.remove(callback)
+
+
+def is_enabled() -> bool:
+    """Returns whether any instrumentation callback is registered."""
+    return bool(_callbacks)
+
+
+@contextmanager
+def _timed_span(name: str, attributes: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        for callback in list(_callbacks):
+            callback.on_span(name, duration, attributes)
+
+
+@contextmanager
+def _noop_span() -> Iterator[Dict[str, Any]]:
+    # attributes set on a disabled span are simply dropped
+    yield {}
+
+
+def span(name: str, **attributes: Any):
+    """
+    Context manager that times the enclosed block and reports it to all registered callbacks.
+
+    The context manager yields the span's attributes dict, so that attributes only known at the end
+    of the block (e.g. the number of bytes downloaded) can be attached to it. When no callback is
+    registered this does not read the clock at all.
+
+    Parameters
+    ----------
+    name
+        Name of the span
+    attributes
+        Attributes to attach to the span
+    """
+    if not _callbacks:
+        return _noop_span()
+    return _timed_span(name, attributes)
+
+
+def count(name: str, value: float = 1, **attributes: Any) -> None:
+    """
+    Increments the given counter on all registered callbacks.
+
+    Parameters
+    ----------
+    name
+        Name of the counter
+    value
+        Amount by which to increment the counter
+    attributes
+        Attributes to attach to the counter
+    """
+    if not _callbacks:
+        return
+    for callback in list(_callbacks):
+        callback.on_counter(name, value, attributes)
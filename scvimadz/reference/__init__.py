@@ -1,10 +1,25 @@
 from ._generic_reference import GenericReference
 from ._tabula_sapiens import TabulaSapiensReference
-from .base import DatasetMetadata, ModelMetadata
+from .base import (
+    CatalogSelection,
+    DatasetMetadata,
+    H5adDataset,
+    MinibatchIterator,
+    ModelMetadata,
+    ZarrDataset,
+    pack_model,
+    read_model_package_header,
+)
 
 __all__ = [
     "TabulaSapiensReference",
     "GenericReference",
+    "CatalogSelection",
     "DatasetMetadata",
+    "H5adDataset",
+    "MinibatchIterator",
     "ModelMetadata",
+    "ZarrDataset",
+    "pack_model",
+    "read_model_package_header",
 ]
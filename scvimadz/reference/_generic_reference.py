@@ -15,15 +15,22 @@ class GenericReference(BaseReference):
         BaseStorage for the model store
     data_store
         BaseStorage for the data store
+    verify_integrity
+        Whether to verify the files already downloaded from the stores against their checksums,
+        and download the corrupted ones again, see :meth:`verify_local_files`.
     """
 
     def __init__(
         self,
         model_store: Type[BaseStorage],
         data_store: Type[BaseStorage],
+        verify_integrity: bool = False,
     ):
+        super().__init__()
         self._model_store = model_store
         self._data_store = data_store
+        if verify_integrity:
+            self.verify_local_files()
 
     @property
     def model_store(self) -> Type[BaseStorage]:
@@ -1,6 +1,6 @@
-from typing import Type
+from typing import Optional, Type
 
-from scvimadz.storage import ZenodoStorage
+from scvimadz.storage import ContentStore, ZenodoStorage
 from scvimadz.storage.base import BaseStorage
 
 from .base import BaseReference
@@ -14,11 +14,31 @@ class TabulaSapiensReference(BaseReference):
     ----------
     data_dir
         Absolute path to the directory that will be used to download data to.
+    offline
+        Whether to operate from the local snapshot in `data_dir` only, see :class:`~scvimadz.storage.ZenodoStorage`.
+    verify_integrity
+        Whether to verify the files already downloaded to `data_dir` against their checksums,
+        and download the corrupted ones again, see :meth:`verify_local_files`.
+    content_store
+        Content store shared with other references, see :class:`~scvimadz.storage.ContentStore`.
     """
 
-    def __init__(self, data_dir: str):
-        self._model_store = ZenodoStorage("6513320", data_dir)
-        self._data_store = ZenodoStorage("6513306", data_dir)
+    def __init__(
+        self,
+        data_dir: str,
+        offline: Optional[bool] = None,
+        verify_integrity: bool = False,
+        content_store: Optional[ContentStore] = None,
+    ):
+        super().__init__()
+        self._model_store = ZenodoStorage(
+            "6513320", data_dir, offline=offline, content_store=content_store
+        )
+        self._data_store = ZenodoStorage(
+            "6513306", data_dir, offline=offline, content_store=content_store
+        )
+        if verify_integrity:
+            self.verify_local_files()
 
     @property
     def model_store(self) -> Type[BaseStorage]:
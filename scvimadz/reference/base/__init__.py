@@ -1,3 +1,17 @@
 from ._base_reference import BaseReference, DatasetMetadata, ModelMetadata
+from ._catalog import CatalogSelection
+from ._model_package import pack_model, read_model_package_header
+from ._streaming import H5adDataset, MinibatchIterator
+from ._zarr import ZarrDataset
 
-__all__ = ["BaseReference", "DatasetMetadata", "ModelMetadata"]
+__all__ = [
+    "BaseReference",
+    "CatalogSelection",
+    "DatasetMetadata",
+    "H5adDataset",
+    "MinibatchIterator",
+    "ModelMetadata",
+    "ZarrDataset",
+    "pack_model",
+    "read_model_package_header",
+]
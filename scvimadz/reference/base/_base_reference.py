@@ -1,20 +1,88 @@
 import importlib
 import io
+import json
+import multiprocessing
 import os
 import shutil
+import tempfile
+import threading
+import time
 import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
-from typing import List, Optional, Type, Union
-
-import anndata
-import pandas as pd
-import rich_dataframe
-from anndata import AnnData
-from scvi.model.base import BaseModelClass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
+from scvimadz import instrumentation
+from scvimadz.storage import IntegrityReport, verify_local_files
 from scvimadz.storage.base import BaseStorage, FileToUpload
 
+from ._catalog import (
+    DATASETS_SCHEMA,
+    MODELS_SCHEMA,
+    CatalogSelection,
+    predicate_mask,
+    typed_catalog,
+)
+from ._gene_index import (
+    gene_index,
+    genes_key,
+    is_genes_key,
+    model_var_names,
+    rank_by_gene_overlap,
+)
+from ._loading import estimate_footprint, read_dataset, stored_nnz
+from ._model_package import (
+    MODEL_PACKAGE_SUFFIX,
+    is_model_package,
+    load_model_package,
+    pack_model,
+)
+from ._parallel import evaluate_model, init_worker, latent_representation, share_anndata
+from ._pretty import DEFAULT_PAGE_SIZE, print_catalog
+from ._sharding import (
+    SHARD_MANIFEST_SUFFIX,
+    concat_shards,
+    is_shard_key,
+    is_sharded_dataset,
+    read_manifest,
+    select_shards,
+    write_shards,
+)
+from ._streaming import H5adDataset, MinibatchIterator
+from ._summary import (
+    SUMMARY_COLUMNS,
+    is_summary_key,
+    summarize_dataset,
+    summary_columns,
+    summary_key,
+)
+from ._zarr import (
+    ZARR_ZIP_SUFFIX,
+    ZarrDataset,
+    is_zarr_dataset,
+    read_zarr,
+    write_zarr_zip,
+)
+
+# anndata, pandas, rich and scvi (torch) are slow to import, so they are only
+# imported by the methods that need them
+if TYPE_CHECKING:
+    import pandas as pd
+    from anndata import AnnData
+    from scvi.model.base import BaseModelClass
+
 
 class _Obj_Type(Enum):
     MODEL = "model"
@@ -26,6 +94,41 @@ class _Metadata_File(Enum):
     DATASETS_METADATA_FILE = "datasets_metadata.csv"
 
 
+# number of metadata delta files past which publishing folds them into the base metadata file
+METADATA_COMPACTION_THRESHOLD = 32
+
+
+def _metadata_delta_prefix(metadata_fn: _Metadata_File) -> str:
+    # e.g. models_metadata.delta.<model_id>.csv
+    return f"{metadata_fn.value[:-len('.csv')]}.delta."
+
+
+def _metadata_base_prefix(metadata_fn: _Metadata_File) -> str:
+    # e.g. models_metadata.base.<time_ns>.<uuid>.csv, written by compactions
+    return f"{metadata_fn.value[:-len('.csv')]}.base."
+
+
+def _metadata_keys(keys: List[str], metadata_fn: _Metadata_File) -> List[str]:
+    """Returns the keys the metadata is read from, in the order their rows are merged."""
+    bases = sorted(
+        key for key in keys if key.startswith(_metadata_base_prefix(metadata_fn))
+    )
+    deltas = sorted(
+        key for key in keys if key.startswith(_metadata_delta_prefix(metadata_fn))
+    )
+    legacy = [metadata_fn.value] if metadata_fn.value in keys else []
+    return legacy + bases + deltas
+
+
+def _is_metadata_key(key: str) -> bool:
+    return any(
+        key == fn.value
+        or key.startswith(_metadata_delta_prefix(fn))
+        or key.startswith(_metadata_base_prefix(fn))
+        for fn in _Metadata_File
+    )
+
+
 class DatasetMetadata:
     def __init__(
         self, tissue: str, is_cite: bool, has_latent_embedding: bool, is_annotated: bool
@@ -109,6 +212,10 @@ class ModelMetadata:
 
 
 class BaseReference(ABC):
+    def __init__(self) -> None:
+        # merged metadata of each store, with the ETag of the store it was read at
+        self._metadata_cache = {}
+
     @property
     @abstractmethod
     def model_store(self) -> Type[BaseStorage]:
@@ -130,12 +237,56 @@ class BaseReference(ABC):
         self, obj_type: _Obj_Type, all_keys: bool = False
     ) -> List[str]:
         store = self._get_store_for_object(obj_type)
-        keys = [
+        return self._filter_object_keys(store.list_keys(), all_keys)
+
+    @staticmethod
+    def _filter_object_keys(keys: List[str], all_keys: bool = False) -> List[str]:
+        return [
             key
-            for key in store.list_keys()
-            if all_keys or not key.endswith("_metadata.csv")
+            for key in keys
+            if all_keys
+            or not (
+                _is_metadata_key(key)
+                or is_shard_key(key)
+                or is_summary_key(key)
+                or is_genes_key(key)
+            )
         ]
-        return keys
+
+    def _read_metadata(
+        self, store: BaseStorage, keys: List[str], metadata_fn: _Metadata_File
+    ) -> "pd.DataFrame":
+        """
+        Reads the metadata of all objects in the given store.
+
+        The metadata is the base metadata files merged with the append-only log of per-object
+        delta files written by :meth:`_metadata_delta`. Deltas written concurrently by different
+        publishers have different keys, so none of them is lost; if several rows exist for the
+        same object, the last one wins. Base files are written by compactions, see
+        :meth:`_metadata_files`.
+
+        If the store has an ETag (e.g. the one of its Zenodo record), the merged metadata is
+        cached until it changes.
+        """
+        import pandas as pd
+
+        to_read = _metadata_keys(keys, metadata_fn)
+        if not to_read:
+            raise ValueError(f"Metadata file {metadata_fn.value} not found.")
+        etag = getattr(store, "etag", None)
+        version = (etag, tuple(to_read)) if etag is not None else None
+        cache = self._metadata_cache
+        cached = cache.get((id(store), metadata_fn))
+        if version is not None and cached is not None and cached[0] == version:
+            instrumentation.count("reference.metadata_cache_hits")
+            return cached[1].copy()
+        with ThreadPoolExecutor(max_workers=min(len(to_read), 8)) as executor:
+            paths = list(executor.map(store.download_file, to_read))
+        df = pd.concat([pd.read_csv(path, index_col="key") for path in paths])
+        df = df[~df.index.duplicated(keep="last")]
+        if version is not None:
+            cache[(id(store), metadata_fn)] = (version, df.copy())
+        return df
 
     def _list_objects(
         self,
@@ -143,49 +294,327 @@ class BaseReference(ABC):
         metadata_fn: _Metadata_File,
         pretty_print: bool = False,
         all_keys: bool = False,
-    ) -> pd.DataFrame:
-        keys = self._get_object_keys(obj_type, all_keys)
-        metadata_file = self._get_store_for_object(obj_type).download_file(
-            metadata_fn.value
-        )
-        df = pd.read_csv(metadata_file, index_col="key")
-        df = df.loc[keys] if not all_keys else df
+        include_summary: bool = False,
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ) -> "pd.DataFrame":
+        with instrumentation.span("reference.list_objects", obj_type=obj_type.value):
+            store = self._get_store_for_object(obj_type)
+            store_keys = store.list_keys()
+            df = self._read_metadata(store, store_keys, metadata_fn)
+            if not all_keys:
+                df = df.loc[self._filter_object_keys(store_keys)]
+            if include_summary:
+                df = self._join_summaries(store, store_keys, df)
         if pretty_print:
-            rich_dataframe.prettify(
-                df,
-                row_limit=len(df),
-                col_limit=len(df.columns),
-                clear_console=False,
-            )
+            print_catalog(df, page_size=page_size, title=f"{obj_type.value}s")
         return df
 
-    def get_models_df(self, pretty_print: bool = False) -> pd.DataFrame:
-        """Lists all available models associated with this reference."""
+    def get_models_df(
+        self, pretty_print: bool = False, page_size: int = DEFAULT_PAGE_SIZE
+    ) -> "pd.DataFrame":
+        """
+        Lists all available models associated with this reference.
+
+        Parameters
+        ----------
+        pretty_print
+            Whether to print the models, one page of rows at a time. In a terminal, each page
+            after the first one is only rendered once requested.
+        page_size
+            Number of rows per printed page
+        """
         return self._list_objects(
-            _Obj_Type.MODEL, _Metadata_File.MODELS_METADATA_FILE, pretty_print
+            _Obj_Type.MODEL,
+            _Metadata_File.MODELS_METADATA_FILE,
+            pretty_print,
+            page_size=page_size,
         )
 
-    def get_datasets_df(self, pretty_print: bool = False) -> pd.DataFrame:
-        """Lists all available datasets associated with this reference."""
+    def get_datasets_df(
+        self,
+        pretty_print: bool = False,
+        include_summary: bool = False,
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ) -> "pd.DataFrame":
+        """
+        Lists all available datasets associated with this reference.
+
+        Parameters
+        ----------
+        pretty_print
+            Whether to print the datasets, one page of rows at a time. In a terminal, each page
+            after the first one is only rendered once requested.
+        include_summary
+            Whether to add the scalar fields of the dataset summaries (sparsity, sizes, var names
+            hash, cell type and batch keys) as columns. Only the small summary files are
+            downloaded. Datasets saved without a summary have missing values.
+        page_size
+            Number of rows per printed page
+        """
         return self._list_objects(
-            _Obj_Type.DATASET, _Metadata_File.DATASETS_METADATA_FILE, pretty_print
+            _Obj_Type.DATASET,
+            _Metadata_File.DATASETS_METADATA_FILE,
+            pretty_print,
+            include_summary=include_summary,
+            page_size=page_size,
+        )
+
+    def _select(
+        self,
+        obj_type: _Obj_Type,
+        metadata_fn: _Metadata_File,
+        schema: Dict[str, str],
+        predicates: Dict[str, Any],
+    ) -> CatalogSelection:
+        df = typed_catalog(self._list_objects(obj_type, metadata_fn), schema)
+        with instrumentation.span(
+            "reference.select", obj_type=obj_type.value, n_objects=len(df)
+        ):
+            df = df[predicate_mask(df, predicates)]
+        return CatalogSelection(self, obj_type.value, df)
+
+    def select_models(self, **predicates) -> CatalogSelection:
+        """
+        Selects the models whose metadata matches all the given predicates.
+
+        The predicates are evaluated over the whole catalog at once, on metadata columns cast
+        to their types (e.g. integers for ``n_latent``, booleans for ``use_observed_lib_size``).
+
+        Parameters
+        ----------
+        **predicates
+            For each column to filter on, either a value it must equal, a list or set of
+            accepted values, a ``(min, max)`` tuple of inclusive bounds (either may be None), or
+            a function returning a boolean mask from the column, e.g.
+            ``select_models(class_name="scvi.model.SCVI", n_latent=(10, 30))``.
+
+        Returns
+        -------
+        The selected models, which can be prefetched or loaded together.
+        """
+        return self._select(
+            _Obj_Type.MODEL,
+            _Metadata_File.MODELS_METADATA_FILE,
+            MODELS_SCHEMA,
+            predicates,
+        )
+
+    def select_datasets(self, **predicates) -> CatalogSelection:
+        """
+        Selects the datasets whose metadata matches all the given predicates.
+
+        The predicates are evaluated over the whole catalog at once, on metadata columns cast
+        to their types (e.g. integers for ``cell_count``, booleans for ``is_annotated``).
+
+        Parameters
+        ----------
+        **predicates
+            See :meth:`select_models`, e.g.
+            ``select_datasets(tissue=["Lung", "Blood"], is_annotated=True)``.
+
+        Returns
+        -------
+        The selected datasets, which can be prefetched or loaded together.
+        """
+        return self._select(
+            _Obj_Type.DATASET,
+            _Metadata_File.DATASETS_METADATA_FILE,
+            DATASETS_SCHEMA,
+            predicates,
+        )
+
+    @staticmethod
+    def _download_json_files(store: BaseStorage, keys: List[str]) -> List[dict]:
+        """Downloads and parses the given small JSON side files (e.g. summaries) in parallel."""
+        with ThreadPoolExecutor(max_workers=max(min(len(keys), 8), 1)) as executor:
+            paths = list(executor.map(store.download_file, keys))
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(json.load(f))
+        return contents
+
+    def _join_summaries(
+        self, store: BaseStorage, keys: List[str], df: "pd.DataFrame"
+    ) -> "pd.DataFrame":
+        import pandas as pd
+
+        keys = set(keys)
+        with_summary = [key for key in df.index if summary_key(key) in keys]
+        summaries = self._download_json_files(
+            store, [summary_key(key) for key in with_summary]
+        )
+        rows = {
+            key: summary_columns(summary)
+            for key, summary in zip(with_summary, summaries)
+        }
+        return df.join(
+            pd.DataFrame.from_dict(rows, orient="index", columns=SUMMARY_COLUMNS)
         )
 
-    def _augment_objects_df(
-        self, obj_type: _Obj_Type, metadata_fn: _Metadata_File, new: dict
-    ) -> pd.DataFrame:
-        """Add the given record to the datasets or models dataframe and return the updated dataframe."""
-        metadata_df = self._list_objects(obj_type, metadata_fn, all_keys=True)
-        new_df = pd.DataFrame(new)
-        metadata_df = metadata_df.reset_index().append(new_df).set_index("key")
-        return metadata_df
+    def get_dataset_summary(self, dataset_id: str) -> dict:
+        """
+        Returns the summary of the dataset with the given id, without downloading the dataset.
+
+        The summary is computed when the dataset is saved, and holds the per-gene means and
+        detection rates, the cell type counts, the batch keys and their number of batches, the
+        sparsity, the sizes on disk and in memory, and the hash of the var names.
+
+        Parameters
+        ----------
+        dataset_id
+            id of the dataset
+
+        Returns
+        -------
+        The summary of the dataset.
+        """
+        key = summary_key(dataset_id)
+        if key not in self.data_store.list_keys():
+            raise ValueError(f"No summary found for dataset {dataset_id}.")
+        with open(self.data_store.download_file(key)) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _metadata_delta(metadata_fn: _Metadata_File, new: dict) -> FileToUpload:
+        """Returns the delta file that adds the given record to the datasets or models metadata."""
+        import pandas as pd
+
+        key = new["key"][0]
+        delta = io.StringIO(pd.DataFrame(new).set_index("key").to_csv())
+        return FileToUpload(delta, f"{_metadata_delta_prefix(metadata_fn)}{key}.csv")
+
+    def _metadata_files(
+        self, store: BaseStorage, metadata_fn: _Metadata_File, new: dict
+    ) -> Tuple[List[FileToUpload], List[str]]:
+        """
+        Returns the metadata files to upload to add the given record, and the keys to delete.
+
+        That is the delta file of the record, unless the store already has
+        ``METADATA_COMPACTION_THRESHOLD`` delta files. Then, all the metadata files and the
+        record are folded into a new base file and exactly the files that were read are deleted,
+        so that the number of files to read the metadata from does not grow without bounds.
+
+        Each base file has a unique key, so concurrent compactions never overwrite each other:
+        each of them deletes only the files it folded, and the base files they write are merged
+        by the next read. Deltas added since the store was listed are kept.
+        """
+        import pandas as pd
+
+        delta = self._metadata_delta(metadata_fn, new)
+        keys = store.list_keys()
+        to_read = _metadata_keys(keys, metadata_fn)
+        n_deltas = sum(
+            key.startswith(_metadata_delta_prefix(metadata_fn)) for key in to_read
+        )
+        if n_deltas < METADATA_COMPACTION_THRESHOLD:
+            return [delta], []
+        df = self._read_metadata(store, to_read, metadata_fn)
+        row = pd.DataFrame(new).set_index("key")
+        df = pd.concat([df[~df.index.isin(row.index)], row])
+        instrumentation.count(
+            "reference.metadata_compactions", n_deltas, file=metadata_fn.value
+        )
+        base_key = (
+            f"{_metadata_base_prefix(metadata_fn)}{time.time_ns()}.{uuid.uuid4()}.csv"
+        )
+        return [FileToUpload(io.StringIO(df.to_csv()), base_key)], to_read
+
+    def rank_models_by_gene_overlap(
+        self,
+        query: Union["AnnData", Sequence[str]],
+        model_ids: Optional[Sequence[str]] = None,
+    ) -> "pd.DataFrame":
+        """
+        Ranks models by the overlap of their genes with the given query, without loading them.
+
+        Only the small gene lists stored alongside the models are downloaded.
+
+        Parameters
+        ----------
+        query
+            The query dataset, or its var names
+        model_ids
+            ids of the models to rank. If None, ranks all models of this reference.
+
+        Returns
+        -------
+        A dataframe indexed by model id and sorted by decreasing overlap, with columns: n_genes
+        (number of genes of the model), n_overlap (number of genes of the model in the query),
+        overlap (fraction of the genes of the model in the query), query_coverage (fraction of
+        the query genes used by the model), and exact_match (whether the query has exactly the
+        var names of the model, in order). Models saved without a gene list have missing values.
+        """
+        import pandas as pd
+
+        if model_ids is None:
+            model_ids = self.get_models_df().index.to_list()
+        query_genes = (
+            pd.Index(query.var_names).astype(str).to_list()
+            if hasattr(query, "var_names")
+            else [str(g) for g in query]
+        )
+        store_keys = set(self.model_store.list_keys())
+        indexed = [m for m in model_ids if genes_key(m) in store_keys]
+        indices = dict.fromkeys(model_ids)
+        indices.update(
+            zip(
+                indexed,
+                self._download_json_files(
+                    self.model_store, [genes_key(m) for m in indexed]
+                ),
+            )
+        )
+        return rank_by_gene_overlap(indices, query_genes)
+
+    def verify_local_files(
+        self, repair: bool = True, max_workers: int = 4
+    ) -> Dict[str, IntegrityReport]:
+        """
+        Verifies the files downloaded from the model and data stores against their checksums.
+
+        Corrupted files are quarantined and, if `repair`, downloaded again. See
+        :func:`~scvimadz.storage.verify_local_files`.
+
+        Parameters
+        ----------
+        repair
+            Whether to download the corrupted files again
+        max_workers
+            Number of files hashed or downloaded in parallel
+
+        Returns
+        -------
+        The outcome of the verification of each store, under "models" and "datasets".
+        """
+        with instrumentation.span("reference.verify_local_files"):
+            reports = {
+                "models": verify_local_files(
+                    self.model_store, repair=repair, max_workers=max_workers
+                )
+            }
+            # the models and datasets may share a store
+            reports["datasets"] = (
+                reports["models"]
+                if self.data_store is self.model_store
+                else verify_local_files(
+                    self.data_store, repair=repair, max_workers=max_workers
+                )
+            )
+        for name, report in reports.items():
+            if report.corrupted:
+                print(
+                    f"Found {len(report.corrupted)} corrupted {name} files, "
+                    f"repaired {len(report.repaired)}."
+                )
+        return reports
 
     def load_model(
         self,
         model_id: str,
-        adata: Optional[AnnData] = None,
+        adata: Optional["AnnData"] = None,
         use_gpu: Optional[Union[str, int, bool]] = None,
-    ) -> Type[BaseModelClass]:
+    ) -> Type["BaseModelClass"]:
         """
         Loads the model with the given id if it exists, else raises an error.
 
@@ -204,29 +633,115 @@ class BaseReference(ABC):
         -------
         An instance of :class:`~scvi.model.base.BaseModelClass` associated with the given model id.
         """
+        with instrumentation.span("reference.load_model", model_id=model_id):
+            return self._load_model(model_id, adata, use_gpu)
+
+    def _load_model(
+        self,
+        model_id: str,
+        adata: Optional["AnnData"],
+        use_gpu: Optional[Union[str, int, bool]],
+    ) -> Type["BaseModelClass"]:
         models = self.get_models_df()
         # get the cell that contains the class name for this model, it will be like: scvi.model.TOTALVI
         model_cls_name = models.loc[model_id, "class_name"]
-        cls = model_cls_name.split(".")[-1]
-        module = ".".join(model_cls_name.split(".")[:-1])
         # We must have an anndata object to load the model with. If no adata is provided, then use
         # the model's metadata to determine where to fetch its associated train dataset from, and
-        # use that to load the model
-        if adata is None:
-            model_adata = models.loc[model_id, "train_dataset"]
-            adata = self.load_dataset(model_adata)
-        model_cls = getattr(importlib.import_module(module), cls)
+        # use that to load the model. The dataset is fetched and read in the background, while
+        # the model is fetched and unpacked and its class imported.
+        executor = ThreadPoolExecutor(max_workers=1)
+        adata_future = None
+        try:
+            if adata is None:
+                model_adata = models.loc[model_id, "train_dataset"]
+                adata_future = executor.submit(self.load_dataset, model_adata)
+            model_cls, model_path = self._fetch_model(model_id, model_cls_name)
+        except BaseException:
+            # raise right away, instead of waiting for the dataset to be fetched
+            if adata_future is not None:
+                adata_future.cancel()
+            executor.shutdown(wait=False)
+            raise
+        try:
+            if adata_future is not None:
+                adata = adata_future.result()
+        finally:
+            executor.shutdown()
+        with instrumentation.span("reference.construct_model", model_id=model_id):
+            if is_model_package(model_path):
+                return load_model_package(model_cls, model_path, adata, use_gpu)
+            return model_cls.load(model_path, adata=adata, use_gpu=use_gpu)
+
+    def _fetch_model(
+        self, model_id: str, model_cls_name: str
+    ) -> Tuple[Type["BaseModelClass"], str]:
+        """Imports the class of the given model, and downloads and unpacks the model."""
+        cls = model_cls_name.split(".")[-1]
+        module = ".".join(model_cls_name.split(".")[:-1])
+        with instrumentation.span(
+            "reference.import_model_class", class_name=model_cls_name
+        ):
+            model_cls = getattr(importlib.import_module(module), cls)
         model_path = self.model_store.download_file(model_id)
-        if model_path.endswith(".zip"):
-            shutil.unpack_archive(model_path, f"{os.path.dirname(model_path)}")
-            model_path = model_path[:-4]  # strip the .zip
-        else:
-            new_file = os.path.join(os.path.dirname(model_path), "model.pt")
-            shutil.move(model_path, new_file)
-            model_path = os.path.dirname(model_path)
-        return model_cls.load(model_path, adata=adata, use_gpu=use_gpu)
+        if is_model_package(model_path):
+            return model_cls, model_path
+        # each model is unpacked into its own directory, named after it, so that concurrent
+        # loads (e.g. the workers of evaluate_models) never write to the same files
+        model_dir = os.path.splitext(model_path)[0]
+        if os.path.isdir(model_dir) and os.path.getmtime(model_dir) >= os.path.getmtime(
+            model_path
+        ):
+            return model_cls, model_dir
+        tmp_dir = f"{model_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with instrumentation.span("reference.unpack_model", model_id=model_id):
+            if model_path.endswith(".zip"):
+                shutil.unpack_archive(model_path, tmp_dir)
+                entries = os.listdir(tmp_dir)
+                unpacked = tmp_dir
+                if len(entries) == 1 and os.path.isdir(
+                    os.path.join(tmp_dir, entries[0])
+                ):
+                    unpacked = os.path.join(tmp_dir, entries[0])
+            else:
+                # the downloaded file is left in place, so that it is not downloaded again,
+                # and linked rather than copied, so that it is not stored twice
+                os.makedirs(tmp_dir)
+                try:
+                    os.link(model_path, os.path.join(tmp_dir, "model.pt"))
+                except OSError:
+                    shutil.copyfile(model_path, os.path.join(tmp_dir, "model.pt"))
+                unpacked = tmp_dir
+            stale_dir = None
+            if os.path.isdir(model_dir):
+                # unpacked from a previous version of the model. It is renamed aside rather
+                # than removed in place, so that loaders never see it partially removed.
+                stale_dir = f"{tmp_dir}.stale"
+                try:
+                    os.replace(model_dir, stale_dir)
+                except FileNotFoundError:
+                    # another process renamed it aside first
+                    stale_dir = None
+            try:
+                os.replace(unpacked, model_dir)
+            except OSError:
+                # another process unpacked the model first, its directory is complete
+                if not os.path.isdir(model_dir):
+                    raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if stale_dir is not None:
+                shutil.rmtree(stale_dir, ignore_errors=True)
+        return model_cls, model_dir
 
-    def load_dataset(self, dataset_id: str) -> AnnData:
+    def load_dataset(
+        self,
+        dataset_id: str,
+        shards: Optional[Sequence[Union[int, str]]] = None,
+        memory_budget: Optional[int] = None,
+        layers: Optional[Sequence[str]] = None,
+        obsm: Optional[Sequence[str]] = None,
+        sparse: bool = False,
+        dtype: Optional[str] = None,
+    ) -> "AnnData":
         """
         Loads the dataset with the given id if it exists.
 
@@ -234,13 +749,262 @@ class BaseReference(ABC):
         ----------
         dataset_id
             id of the dataset to load
+        shards
+            Only applicable to sharded datasets. Values of the column the dataset was sharded by
+            (e.g. tissues), or indices of the shards if it was sharded into blocks of cells.
+            Only the selected shards are downloaded. If None, loads all shards.
+        memory_budget
+            Maximum memory the loaded dataset may use, in bytes. If provided, the footprint of
+            the dataset is estimated (see :meth:`estimate_dataset_memory`) and printed before
+            loading it, and an error is raised if it exceeds the budget.
+        layers
+            Names of the layers to load. If None, loads all layers.
+        obsm
+            Names of the ``obsm`` entries to load. If None, loads all entries.
+        sparse
+            Whether to convert X and the layers to CSR matrices. Dense matrices are converted in
+            chunks of cells while reading them.
+        dtype
+            dtype to convert X and the layers to, e.g. "float32", or "int32" for integer counts.
 
         Returns
         -------
         An instance of :class:`~anndata.AnnData` associated with the given dataset id.
         """
+        options = {"layers": layers, "obsm": obsm, "sparse": sparse, "dtype": dtype}
+        if is_sharded_dataset(dataset_id):
+            return self._load_sharded_dataset(
+                dataset_id, shards, memory_budget, options
+            )
+        if shards is not None:
+            raise ValueError(f"Dataset {dataset_id} is not sharded.")
+        if memory_budget is not None:
+            self._check_memory_budget(dataset_id, None, memory_budget, options)
         data_file_path = self.data_store.download_file(dataset_id)
-        return anndata.read_h5ad(data_file_path)
+        return self._read_dataset_file(dataset_id, data_file_path, options)
+
+    @staticmethod
+    def _read_dataset_file(key: str, path: str, options: dict) -> "AnnData":
+        import anndata
+
+        with instrumentation.span("reference.read_dataset", dataset_id=key):
+            if any(options.values()):
+                return read_dataset(path, **options)
+            if is_zarr_dataset(key):
+                return read_zarr(path)
+            return anndata.read_h5ad(path)
+
+    def estimate_dataset_memory(
+        self,
+        dataset_id: str,
+        shards: Optional[Sequence[Union[int, str]]] = None,
+        layers: Optional[Sequence[str]] = None,
+        obsm: Optional[Sequence[str]] = None,
+        sparse: bool = False,
+        dtype: Optional[str] = None,
+    ) -> "pd.Series":
+        """
+        Estimates the memory the dataset with the given id would use once loaded, without loading it.
+
+        The dataset is downloaded, but only the metadata of its arrays is read (and the first
+        cells of dense matrices converted to sparse, to estimate their density).
+
+        Parameters
+        ----------
+        dataset_id
+            id of the dataset
+        shards, layers, obsm, sparse, dtype
+            The loading options, see :meth:`load_dataset`
+
+        Returns
+        -------
+        The estimated size of each element of the dataset (e.g. "X", "layers/counts", "obs"),
+        in bytes. Sharded datasets also count the largest shard, which is held in memory while
+        it is copied into the concatenated dataset.
+        """
+        import pandas as pd
+
+        options = {"layers": layers, "obsm": obsm, "sparse": sparse, "dtype": dtype}
+        if is_sharded_dataset(dataset_id):
+            manifest = read_manifest(self.data_store.download_file(dataset_id))
+            keys = select_shards(manifest, shards)
+        elif shards is not None:
+            raise ValueError(f"Dataset {dataset_id} is not sharded.")
+        else:
+            keys = [dataset_id]
+        sizes = pd.Series(dtype="int64")
+        largest_shard = 0
+        for key in keys:
+            path = self.data_store.download_file(key)
+            shard_sizes = pd.Series(estimate_footprint(path, **options))
+            sizes = sizes.add(shard_sizes, fill_value=0)
+            largest_shard = max(largest_shard, int(shard_sizes.sum()))
+        sizes = sizes.astype("int64")
+        if len(keys) > 1:
+            sizes["concat"] = largest_shard
+        return sizes
+
+    def _check_memory_budget(
+        self,
+        dataset_id: str,
+        shards: Optional[Sequence[Union[int, str]]],
+        memory_budget: int,
+        options: dict,
+    ) -> None:
+        total = int(self.estimate_dataset_memory(dataset_id, shards, **options).sum())
+        print(
+            f"Estimated memory footprint of dataset {dataset_id}: "
+            f"{total / 1024 ** 2:.1f} MB (budget: {memory_budget / 1024 ** 2:.1f} MB)."
+        )
+        if total > memory_budget:
+            raise ValueError(
+                f"Loading dataset {dataset_id} would use about {total} bytes, which exceeds "
+                f"the memory budget of {memory_budget} bytes. Consider loading fewer layers, "
+                "shards or obsm entries, or converting the matrices with sparse/dtype."
+            )
+
+    def open_zarr_dataset(self, dataset_id: str) -> ZarrDataset:
+        """
+        Opens the zarr dataset with the given id for chunked reads, without loading it into memory.
+
+        Parameters
+        ----------
+        dataset_id
+            id of the zarr dataset to open
+
+        Returns
+        -------
+        A :class:`~scvimadz.reference.ZarrDataset` that reads blocks of cells or genes in parallel.
+        """
+        if not is_zarr_dataset(dataset_id):
+            raise ValueError(f"Dataset {dataset_id} is not a zarr dataset.")
+        return ZarrDataset(self.data_store.download_file(dataset_id))
+
+    def iter_minibatches(
+        self,
+        dataset_id: str,
+        batch_size: int = 128,
+        shuffle: bool = True,
+        shards: Optional[Sequence[Union[int, str]]] = None,
+        layer: Optional[str] = None,
+        obs_keys: Optional[Sequence[str]] = None,
+        buffer_size: int = 16384,
+        n_workers: int = 2,
+        drop_last: bool = False,
+        seed: Optional[int] = None,
+    ) -> MinibatchIterator:
+        """
+        Streams minibatches of cells from the dataset with the given id, without loading it into memory.
+
+        The dataset is downloaded, then cells are read from the file in blocks that are
+        prefetched in background threads, so that memory is bounded by the shuffle buffer, e.g.
+        to fine-tune a model on a dataset that does not fit in memory.
+
+        Parameters
+        ----------
+        dataset_id
+            id of the dataset
+        batch_size
+            Number of cells per minibatch
+        shuffle
+            Whether to shuffle the cells, within a buffer of `buffer_size` cells read from
+            randomly ordered blocks
+        shards
+            Only applicable to sharded datasets, the shards to stream (see :meth:`load_dataset`).
+            If None, streams all shards.
+        layer
+            Layer to read from. If None, reads from X.
+        obs_keys
+            Columns of ``obs`` to include in the minibatches, e.g. batch or labels
+        buffer_size
+            Number of cells shuffled together
+        n_workers
+            Number of threads reading from the dataset
+        drop_last
+            Whether to drop the last minibatch if it has less than `batch_size` cells
+        seed
+            Seed of the shuffling
+
+        Returns
+        -------
+        A :class:`~scvimadz.reference.MinibatchIterator`, each iteration over which is an epoch.
+        """
+        if is_sharded_dataset(dataset_id):
+            manifest = read_manifest(self.data_store.download_file(dataset_id))
+            keys = select_shards(manifest, shards)
+        elif shards is not None:
+            raise ValueError(f"Dataset {dataset_id} is not sharded.")
+        else:
+            keys = [dataset_id]
+        datasets = [
+            ZarrDataset(path) if is_zarr_dataset(key) else H5adDataset(path)
+            for key, path in zip(keys, map(self.data_store.download_file, keys))
+        ]
+        return MinibatchIterator(
+            datasets,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            buffer_size=buffer_size,
+            layer=layer,
+            obs_keys=obs_keys,
+            n_workers=n_workers,
+            drop_last=drop_last,
+            seed=seed,
+        )
+
+    def get_dataset_shards(self, dataset_id: str) -> "pd.DataFrame":
+        """
+        Lists the shards of the given sharded dataset.
+
+        Parameters
+        ----------
+        dataset_id
+            id of the sharded dataset
+
+        Returns
+        -------
+        A dataframe with the key, value of the column the dataset was sharded by (if any) and
+        number of cells of each shard.
+        """
+        import pandas as pd
+
+        if not is_sharded_dataset(dataset_id):
+            raise ValueError(f"Dataset {dataset_id} is not sharded.")
+        manifest = read_manifest(self.data_store.download_file(dataset_id))
+        return pd.DataFrame(manifest["shards"])
+
+    def _load_sharded_dataset(
+        self,
+        dataset_id: str,
+        shards: Optional[Sequence[Union[int, str]]],
+        memory_budget: Optional[int],
+        options: dict,
+    ) -> "AnnData":
+        if memory_budget is not None:
+            self._check_memory_budget(dataset_id, shards, memory_budget, options)
+        manifest = read_manifest(self.data_store.download_file(dataset_id))
+        keys = select_shards(manifest, shards)
+        if len(keys) == 1:
+            path = self.data_store.download_file(keys[0])
+            return self._read_dataset_file(keys[0], path, options)
+        n_obs = {shard["key"]: shard["n_obs"] for shard in manifest["shards"]}
+
+        with ThreadPoolExecutor(max_workers=min(len(keys), 4)) as executor:
+            # shards are downloaded concurrently, but read one at a time, so that only one
+            # is held in memory besides the concatenated dataset
+            paths = [executor.submit(self.data_store.download_file, k) for k in keys]
+            nnz = {}
+            for key, path in zip(keys, paths):
+                shard_nnz = stored_nnz(
+                    path.result(), options["layers"], options["obsm"]
+                )
+                for name, value in shard_nnz.items():
+                    nnz[name] = nnz.get(name, 0) + value
+            shards = (
+                self._read_dataset_file(key, path.result(), options)
+                for key, path in zip(keys, paths)
+            )
+            return concat_shards(shards, sum(n_obs[key] for key in keys), nnz)
 
     def save_dataset(
         self,
@@ -248,6 +1012,11 @@ class BaseReference(ABC):
         token: Optional[str],
         ok_to_reversion_datastore: Optional[bool],
         metadata: DatasetMetadata,
+        shard_by: Optional[str] = None,
+        shard_size: Optional[int] = None,
+        file_format: str = "h5ad",
+        cell_type_key: Optional[str] = None,
+        batch_keys: Optional[Sequence[str]] = None,
     ) -> str:
         """
         Saves the dataset at the given path and returns its corresponding dataset id.
@@ -267,39 +1036,166 @@ class BaseReference(ABC):
             not applicable to your storage backend.
         metadata
             Required metadata for this dataset
+        shard_by
+            If provided, the dataset is stored as one shard per value of this column of
+            ``adata.obs`` (e.g. tissue), so that shards can be loaded separately.
+        shard_size
+            If provided, the dataset is stored as shards of this many cells.
+        file_format
+            Format to store the dataset (or its shards) in, one of "h5ad" or "zarr". Zarr
+            datasets are stored as zipped, chunked zarr stores, which can be read in blocks
+            in parallel with :meth:`open_zarr_dataset`.
+        cell_type_key
+            Column of ``adata.obs`` with the cell types, counted in the dataset summary (see
+            :meth:`get_dataset_summary`). If None, looks for common cell type columns.
+        batch_keys
+            Columns of ``adata.obs`` with the batches, recorded in the dataset summary. If None,
+            looks for common batch columns.
 
         Returns
         -------
         The corresponding dataset id if the dataset was saved successfully.
         """
-        dataset_id = f"{str(uuid.uuid4())}.h5ad"
-        # Gather dataset metadata
-        adata = anndata.read_h5ad(filepath)
-        cell_count = adata.n_obs
-        gene_count = adata.n_vars
-        # Update the metadata csv file
-        new = {
-            "key": [dataset_id],
-            "cell_count": [cell_count],
-            "gene_count": [gene_count],
-            "tissue": [metadata.tissue],
-            "has_cite": [str(metadata.is_cite)],
-            "has_latent_embedding": [str(metadata.has_latent_embedding)],
-            "is_annotated": [str(metadata.is_annotated)],
-        }
-        new_metadata_df = self._augment_objects_df(
-            _Obj_Type.DATASET, _Metadata_File.DATASETS_METADATA_FILE, new
-        )
-        new_metadata = io.StringIO(new_metadata_df.to_csv())
-        # Upload both files in a single transaction
-        files = [
-            FileToUpload(filepath, dataset_id),
-            FileToUpload(new_metadata, _Metadata_File.DATASETS_METADATA_FILE.value),
-        ]
-        self.data_store.upload_files(files, token, ok_to_reversion_datastore)
+        import anndata
+
+        if file_format not in ["h5ad", "zarr"]:
+            raise ValueError(
+                f'Unrecognized file_format: {file_format}. Must be one of: "h5ad", "zarr".'
+            )
+        sharded = shard_by is not None or shard_size is not None
+        dataset_name = str(uuid.uuid4())
+        if sharded:
+            dataset_id = f"{dataset_name}{SHARD_MANIFEST_SUFFIX}"
+        elif file_format == "zarr":
+            dataset_id = f"{dataset_name}{ZARR_ZIP_SUFFIX}"
+        else:
+            dataset_id = f"{dataset_name}.h5ad"
+        # Gather dataset metadata. An h5ad file uploaded as is is only opened backed, so that the
+        # summary pass streams its matrix from disk instead of loading it in memory.
+        if is_zarr_dataset(filepath):
+            adata = read_zarr(filepath)
+        else:
+            as_is = not sharded and file_format != "zarr"
+            adata = anndata.read_h5ad(filepath, backed="r" if as_is else None)
+        try:
+            cell_count = adata.n_obs
+            gene_count = adata.n_vars
+            # Update the metadata csv file
+            new = {
+                "key": [dataset_id],
+                "cell_count": [cell_count],
+                "gene_count": [gene_count],
+                "tissue": [metadata.tissue],
+                "has_cite": [str(metadata.is_cite)],
+                "has_latent_embedding": [str(metadata.has_latent_embedding)],
+                "is_annotated": [str(metadata.is_annotated)],
+            }
+            metadata_files, delete_keys = self._metadata_files(
+                self.data_store, _Metadata_File.DATASETS_METADATA_FILE, new
+            )
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                if sharded:
+                    manifest, files = write_shards(
+                        adata, dataset_name, tmp_dir, shard_by, shard_size, file_format
+                    )
+                    files.append(
+                        FileToUpload(io.StringIO(json.dumps(manifest)), dataset_id)
+                    )
+                elif file_format == "zarr":
+                    zarr_path = os.path.join(tmp_dir, dataset_id)
+                    write_zarr_zip(adata, zarr_path)
+                    files = [FileToUpload(zarr_path, dataset_id)]
+                elif is_zarr_dataset(filepath):
+                    h5ad_path = os.path.join(tmp_dir, dataset_id)
+                    adata.write_h5ad(h5ad_path)
+                    files = [FileToUpload(h5ad_path, dataset_id)]
+                else:
+                    files = [FileToUpload(filepath, dataset_id)]
+                size_on_disk = sum(
+                    os.path.getsize(file.data)
+                    for file in files
+                    if isinstance(file.data, str)
+                )
+                summary = summarize_dataset(
+                    adata, size_on_disk, cell_type_key, batch_keys
+                )
+                files.append(
+                    FileToUpload(
+                        io.StringIO(json.dumps(summary)), summary_key(dataset_id)
+                    )
+                )
+                # Upload the dataset, its summary and the metadata file in a single transaction
+                files += metadata_files
+                # storages implementing the signature without delete_keys can still save objects
+                kwargs = {"delete_keys": delete_keys} if delete_keys else {}
+                self.data_store.upload_files(
+                    files, token, ok_to_reversion_datastore, **kwargs
+                )
+        finally:
+            if adata.isbacked:
+                adata.file.close()
         print(f"Uploaded dataset successfully. Dataset_id is: {dataset_id}.")
         return dataset_id
 
+    def evaluate_models(
+        self,
+        adata: "AnnData",
+        model_ids: Optional[Sequence[str]] = None,
+        fn: Optional[Callable[["BaseModelClass", "AnnData"], Any]] = None,
+        n_jobs: Optional[int] = None,
+        use_gpu: Optional[Union[str, int, bool]] = False,
+        tmp_dir: Optional[str] = None,
+        mp_context: str = "spawn",
+    ) -> Dict[str, Any]:
+        """
+        Evaluates many models on the given dataset in parallel worker processes.
+
+        The dataset is not pickled for each worker: its matrices are written once to
+        `tmp_dir` and memory-mapped by all workers, so they share its pages.
+
+        Parameters
+        ----------
+        adata
+            The query dataset
+        model_ids
+            ids of the models to evaluate. If None, evaluates all models of this reference.
+        fn
+            Function that is called with each loaded model and the query AnnData, and whose
+            result is returned for that model. Must be picklable (e.g. defined at module level).
+            Defaults to computing the latent representation of the query cells.
+        n_jobs
+            Number of worker processes. Defaults to the number of CPUs.
+        use_gpu
+            Passed to :meth:`load_model`. Defaults to using the CPU.
+        tmp_dir
+            Directory to write the shared dataset to. Defaults to the system's temp directory.
+        mp_context
+            Multiprocessing start method of the workers.
+
+        Returns
+        -------
+        A dictionary mapping each model id to the result of `fn` for that model.
+        """
+        if model_ids is None:
+            model_ids = self.get_models_df().index.to_list()
+        if fn is None:
+            fn = latent_representation
+        n_cpus = os.cpu_count() or 1
+        n_jobs = min(n_jobs or n_cpus, max(len(model_ids), 1))
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as shared_dir:
+            spec = share_anndata(adata, shared_dir)
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                mp_context=multiprocessing.get_context(mp_context),
+                initializer=init_worker,
+                initargs=(self, spec, max(n_cpus // n_jobs, 1)),
+            ) as executor:
+                futures = {
+                    model_id: executor.submit(evaluate_model, model_id, fn, use_gpu)
+                    for model_id in model_ids
+                }
+                return {model_id: f.result() for model_id, f in futures.items()}
+
     def save_model(
         self,
         filepath: str,
@@ -313,7 +1209,9 @@ class BaseReference(ABC):
         Parameters
         ----------
         filepath
-            The path to the model to save
+            The path to the model to save. If this is a directory a model was saved to with
+            :meth:`~scvi.model.base.BaseModelClass.save`, the model is uploaded as a zoo model
+            package, whose weights are memory-mapped when loading the model.
         token
             Some storage backends (such as Zenodo) require a token. This arg is
             required to remind users to provide an upload token if their backend
@@ -330,7 +1228,11 @@ class BaseReference(ABC):
         -------
         The corresponding model id if the model was saved successfully.
         """
-        model_id = f"{str(uuid.uuid4())}.pt"
+        model_name = str(uuid.uuid4())
+        packaged = os.path.isdir(filepath) or is_model_package(filepath)
+        model_id = (
+            f"{model_name}{MODEL_PACKAGE_SUFFIX}" if packaged else f"{model_name}.pt"
+        )
         # Update the metadata csv file
         new = {
             "key": [model_id],
@@ -342,15 +1244,27 @@ class BaseReference(ABC):
             "use_observed_lib_size": [str(metadata._use_observed_lib_size)],
             "init_params": [metadata.init_params],
         }
-        new_metadata_df = self._augment_objects_df(
-            _Obj_Type.MODEL, _Metadata_File.MODELS_METADATA_FILE, new
+        metadata_files, delete_keys = self._metadata_files(
+            self.model_store, _Metadata_File.MODELS_METADATA_FILE, new
         )
-        new_metadata = io.StringIO(new_metadata_df.to_csv())
-        # Upload both files in a single transaction
-        files = [
-            FileToUpload(filepath, model_id),
-            FileToUpload(new_metadata, _Metadata_File.MODELS_METADATA_FILE.value),
-        ]
-        self.model_store.upload_files(files, token, ok_to_reversion_datastore)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if os.path.isdir(filepath):
+                filepath = pack_model(filepath, os.path.join(tmp_dir, model_id))
+            # Upload the model, its gene list and the metadata file in a single transaction
+            files = [FileToUpload(filepath, model_id)] + metadata_files
+            var_names = model_var_names(filepath)
+            if var_names is not None:
+                genes = io.StringIO(json.dumps(gene_index(var_names)))
+                files.append(FileToUpload(genes, genes_key(model_id)))
+            else:
+                print(
+                    "Could not read the genes of the model, it will not be ranked by "
+                    "rank_models_by_gene_overlap."
+                )
+            # storages implementing the signature without delete_keys can still save objects
+            kwargs = {"delete_keys": delete_keys} if delete_keys else {}
+            self.model_store.upload_files(
+                files, token, ok_to_reversion_datastore, **kwargs
+            )
         print(f"Uploaded model successfully. Model_id is: {model_id}.")
         return model_id
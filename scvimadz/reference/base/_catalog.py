@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Mapping
+
+from scvimadz import instrumentation
+
+from ._sharding import is_sharded_dataset, read_manifest, select_shards
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from ._base_reference import BaseReference
+
+# dtypes of the metadata columns. The metadata files are CSVs written from strings, so the
+# columns are cast to these after reading them.
+MODELS_SCHEMA = {
+    "class_name": "category",
+    "train_dataset": "string",
+    "n_hidden": "Int64",
+    "n_layers": "Int64",
+    "n_latent": "Int64",
+    "use_observed_lib_size": "boolean",
+    "init_params": "string",
+}
+DATASETS_SCHEMA = {
+    "cell_count": "Int64",
+    "gene_count": "Int64",
+    "tissue": "category",
+    "has_cite": "boolean",
+    "has_latent_embedding": "boolean",
+    "is_annotated": "boolean",
+}
+
+_BOOLEANS = {"true": True, "false": False, "1": True, "0": False}
+
+
+def typed_catalog(df: "pd.DataFrame", schema: Dict[str, str]) -> "pd.DataFrame":
+    """Casts the metadata columns of the given catalog to the dtypes of `schema`, leaving other columns as they are."""
+    import pandas as pd
+
+    columns = {}
+    for column, dtype in schema.items():
+        if column not in df:
+            continue
+        values = df[column]
+        if dtype == "boolean" and not pd.api.types.is_bool_dtype(values):
+            values = values.astype("string").str.strip().str.lower().map(_BOOLEANS)
+        elif dtype == "Int64":
+            values = pd.to_numeric(values, errors="coerce")
+        columns[column] = values.astype(dtype)
+    return df.assign(**columns)
+
+
+def predicate_mask(df: "pd.DataFrame", predicates: Mapping[str, Any]) -> "pd.Series":
+    """
+    Evaluates the given predicates over all the rows of the catalog at once.
+
+    Each predicate maps a column to either a value the column must equal, a list or set of
+    accepted values, a ``(min, max)`` tuple of inclusive bounds (either may be None), or a
+    function returning a boolean mask from the column.
+    """
+    import pandas as pd
+
+    mask = pd.Series(True, index=df.index)
+    for column, predicate in predicates.items():
+        if column not in df:
+            raise ValueError(
+                f"Unknown column {column}. Must be one of: {', '.join(df.columns)}."
+            )
+        values = df[column]
+        if callable(predicate):
+            selected = predicate(values)
+        elif isinstance(predicate, tuple):
+            if len(predicate) != 2:
+                raise ValueError(f"Range of {column} must be a (min, max) tuple.")
+            low, high = predicate
+            selected = pd.Series(True, index=df.index)
+            if low is not None:
+                selected &= values >= low
+            if high is not None:
+                selected &= values <= high
+        elif isinstance(predicate, (list, set, frozenset)):
+            selected = values.isin(predicate)
+        else:
+            selected = values == predicate
+        # missing values never match
+        mask &= pd.Series(selected, index=df.index).fillna(False).astype(bool)
+    return mask
+
+
+class CatalogSelection:
+    """
+    Models or datasets of a reference selected by :meth:`~BaseReference.select_models` or :meth:`~BaseReference.select_datasets`.
+
+    Parameters
+    ----------
+    reference
+        The reference the objects belong to
+    obj_type
+        "model" or "dataset"
+    df
+        Typed metadata of the selected objects, indexed by their id
+    """
+
+    def __init__(
+        self, reference: "BaseReference", obj_type: str, df: "pd.DataFrame"
+    ) -> None:
+        self._reference = reference
+        self._obj_type = obj_type
+        self._df = df
+
+    @property
+    def ids(self) -> List[str]:
+        """ids of the selected objects."""
+        return self._df.index.to_list()
+
+    @property
+    def df(self) -> "pd.DataFrame":
+        """Typed metadata of the selected objects."""
+        return self._df
+
+    def __len__(self) -> int:
+        return len(self._df)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __repr__(self) -> str:
+        return f"CatalogSelection({self._obj_type}s={self.ids})"
+
+    def _files_to_fetch(self) -> List[tuple]:
+        """Returns the (store, key) of the files needed to load the selected objects."""
+        reference = self._reference
+        files = []
+        if self._obj_type == "model":
+            files += [(reference.model_store, key) for key in self.ids]
+            if "train_dataset" in self._df:
+                available = set(reference.data_store.list_keys())
+                datasets = self._df["train_dataset"].dropna().unique()
+                files += [
+                    (reference.data_store, key) for key in datasets if key in available
+                ]
+        else:
+            for key in self.ids:
+                files.append((reference.data_store, key))
+                if is_sharded_dataset(key):
+                    manifest = read_manifest(reference.data_store.download_file(key))
+                    files += [
+                        (reference.data_store, shard_key)
+                        for shard_key in select_shards(manifest)
+                    ]
+        return files
+
+    def prefetch(self, max_workers: int = 4) -> List[str]:
+        """
+        Downloads the files of the selected objects in parallel, without loading them.
+
+        For models, the datasets they were trained on are downloaded too, and for sharded
+        datasets, all their shards.
+
+        Parameters
+        ----------
+        max_workers
+            Number of files downloaded in parallel
+
+        Returns
+        -------
+        The paths of the downloaded files.
+        """
+        files = self._files_to_fetch()
+        with instrumentation.span(
+            "reference.prefetch", obj_type=self._obj_type, n_files=len(files)
+        ):
+            with ThreadPoolExecutor(
+                max_workers=max(min(len(files), max_workers), 1)
+            ) as executor:
+                return list(executor.map(lambda f: f[0].download_file(f[1]), files))
+
+    def load(self, max_workers: int = 4, **kwargs) -> Dict[str, Any]:
+        """
+        Loads the selected objects, after prefetching their files in parallel.
+
+        Parameters
+        ----------
+        max_workers
+            Number of files downloaded in parallel
+        **kwargs
+            Keyword arguments of :meth:`~BaseReference.load_model` or
+            :meth:`~BaseReference.load_dataset`
+
+        Returns
+        -------
+        The loaded objects, by id.
+        """
+        self.prefetch(max_workers)
+        load: Callable = (
+            self._reference.load_model
+            if self._obj_type == "model"
+            else self._reference.load_dataset
+        )
+        return {key: load(key, **kwargs) for key in self.ids}
@@ -0,0 +1,95 @@
+import pickle
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+from ._model_package import is_model_package, read_model_package_header
+from ._summary import var_names_hash
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+GENES_SUFFIX = ".genes.json"
+
+
+def is_genes_key(key: str) -> bool:
+    """Returns whether the given key is the gene list of a model."""
+    return key.endswith(GENES_SUFFIX)
+
+
+def genes_key(model_id: str) -> str:
+    """Returns the key of the gene list of the given model."""
+    return f"{model_id}{GENES_SUFFIX}"
+
+
+def model_var_names(path: str) -> Optional[List[str]]:
+    """
+    Reads the var names of the model saved at the given path.
+
+    Parameters
+    ----------
+    path
+        Path of a zoo model package, or of a model file saved with
+        :meth:`~scvi.model.base.BaseModelClass.save`
+
+    Returns
+    -------
+    The var names of the model's training data, in order, or None if the file is not a model.
+    """
+    if is_model_package(path):
+        header, _ = read_model_package_header(path)
+        return header["var_names"]
+    import numpy as np
+    import torch
+
+    try:
+        var_names = torch.load(path, map_location="cpu")["var_names"]
+    except (pickle.UnpicklingError, EOFError, RuntimeError, KeyError, TypeError):
+        return None
+    return np.asarray(var_names).astype(str).tolist()
+
+
+def gene_index(var_names: Sequence[str]) -> dict:
+    """Returns the JSON-serializable gene index of a model with the given var names."""
+    return {
+        "n_genes": len(var_names),
+        "var_names_hash": var_names_hash(var_names),
+        "genes": sorted(set(var_names)),
+    }
+
+
+def rank_by_gene_overlap(indices: dict, query_genes: Sequence[str]) -> "pd.DataFrame":
+    """
+    Ranks the models with the given gene indices by their overlap with the query genes.
+
+    Parameters
+    ----------
+    indices
+        Gene index of each model, by model id. Models without a gene index map to None.
+    query_genes
+        The query var names, in order
+
+    Returns
+    -------
+    A dataframe indexed by model id, sorted by decreasing overlap.
+    """
+    import pandas as pd
+
+    columns = ["n_genes", "n_overlap", "overlap", "query_coverage", "exact_match"]
+    query_set = set(query_genes)
+    query_hash = var_names_hash(query_genes)
+    rows = {}
+    for model_id, index in indices.items():
+        if index is None:
+            rows[model_id] = dict.fromkeys(columns)
+            continue
+        n_overlap = len(query_set.intersection(index["genes"]))
+        rows[model_id] = {
+            "n_genes": index["n_genes"],
+            "n_overlap": n_overlap,
+            "overlap": n_overlap / index["n_genes"] if index["n_genes"] else 0.0,
+            "query_coverage": n_overlap / len(query_set) if query_set else 0.0,
+            "exact_match": index["var_names_hash"] == query_hash,
+        }
+    df = pd.DataFrame.from_dict(rows, orient="index", columns=columns)
+    return df.sort_values(
+        ["overlap", "query_coverage"], ascending=False, na_position="last"
+    )
@@ -0,0 +1,349 @@
+import contextlib
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Sequence, Union
+
+from ._zarr import _open_store, is_zarr_dataset, read_zarr
+
+if TYPE_CHECKING:
+    import numpy as np
+    from anndata import AnnData
+    from scipy.sparse import spmatrix
+
+_CHUNK_SIZE = 5000
+# number of cells read to estimate the density of dense matrices converted to sparse
+_DENSITY_SAMPLE_SIZE = 1000
+
+
+@contextlib.contextmanager
+def _open_group(path: str) -> Iterator:
+    """Opens the root group of the h5ad or zarr dataset at the given path."""
+    if is_zarr_dataset(path):
+        import zarr
+
+        store = _open_store(path)
+        try:
+            yield zarr.open_group(store, mode="r")
+        finally:
+            if hasattr(store, "close"):
+                store.close()
+    else:
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            yield f
+
+
+def _is_array(node) -> bool:
+    # h5py datasets and zarr arrays have a shape, groups don't
+    return hasattr(node, "shape")
+
+
+def _is_sparse_group(node) -> bool:
+    return not _is_array(node) and all(
+        part in node for part in ["data", "indices", "indptr"]
+    )
+
+
+def _stored_nbytes(node) -> int:
+    if _is_array(node):
+        return int(node.size) * node.dtype.itemsize
+    return sum(_stored_nbytes(node[k]) for k in node.keys())
+
+
+def _matrix_nbytes(node, sparse: bool, dtype: Optional["np.dtype"]) -> int:
+    """Estimates the in-memory size of the given stored matrix after conversion."""
+    import numpy as np
+
+    if not (_is_array(node) or _is_sparse_group(node)):
+        # e.g. dataframes in obsm
+        return _stored_nbytes(node)
+    if _is_sparse_group(node):
+        data = node["data"]
+        itemsize = (dtype or data.dtype).itemsize
+        return (
+            int(data.size) * itemsize
+            + _stored_nbytes(node["indices"])
+            + _stored_nbytes(node["indptr"])
+        )
+    itemsize = (dtype or node.dtype).itemsize
+    if not sparse or len(node.shape) != 2:
+        return int(node.size) * itemsize
+    n_obs = node.shape[0]
+    sample = np.asarray(node[: min(n_obs, _DENSITY_SAMPLE_SIZE)])
+    density = np.count_nonzero(sample) / sample.size if sample.size else 0.0
+    nnz = int(density * node.size)
+    index_itemsize = 4 if nnz < np.iinfo(np.int32).max else 8
+    return nnz * (itemsize + index_itemsize) + (n_obs + 1) * index_itemsize
+
+
+def _selected(node, keys: Optional[Sequence[str]]) -> list:
+    if node is None:
+        return []
+    available = list(node.keys())
+    if keys is None:
+        return available
+    missing = [k for k in keys if k not in available]
+    if missing:
+        raise ValueError(f"Entries not found: {missing}")
+    return list(keys)
+
+
+def estimate_footprint(
+    path: str,
+    layers: Optional[Sequence[str]] = None,
+    obsm: Optional[Sequence[str]] = None,
+    sparse: bool = False,
+    dtype: Optional[Union[str, "np.dtype"]] = None,
+) -> dict:
+    """
+    Estimates the in-memory size of each element of the dataset at the given path, once loaded.
+
+    Only the metadata of the stored arrays is read, except for dense matrices that are converted
+    to sparse, whose density is estimated from their first cells.
+
+    Parameters
+    ----------
+    path
+        Path of the h5ad or zarr dataset
+    layers, obsm, sparse, dtype
+        See :func:`read_dataset`
+
+    Returns
+    -------
+    The estimated size of each element, in bytes, by element name (e.g. "X", "layers/counts").
+    """
+    import numpy as np
+
+    dtype = np.dtype(dtype) if dtype is not None else None
+    sizes = {}
+    with _open_group(path) as f:
+        for key in f.keys():
+            if key == "X":
+                sizes[key] = _matrix_nbytes(f[key], sparse, dtype)
+            elif key == "layers":
+                for name in _selected(f[key], layers):
+                    sizes[f"layers/{name}"] = _matrix_nbytes(
+                        f[key][name], sparse, dtype
+                    )
+            elif key == "obsm":
+                for name in _selected(f[key], obsm):
+                    sizes[f"obsm/{name}"] = _stored_nbytes(f[key][name])
+            else:
+                sizes[key] = _stored_nbytes(f[key])
+    return sizes
+
+
+def stored_nnz(
+    path: str,
+    layers: Optional[Sequence[str]] = None,
+    obsm: Optional[Sequence[str]] = None,
+) -> Dict[str, int]:
+    """
+    Returns the number of values stored in each sparse matrix of the dataset at the given path.
+
+    Parameters
+    ----------
+    path
+        Path of the h5ad or zarr dataset
+    layers, obsm
+        See :func:`read_dataset`
+
+    Returns
+    -------
+    The number of values of each sparse matrix, by element name (e.g. "X", "layers/counts").
+    """
+    nnz = {}
+    with _open_group(path) as f:
+        elements = {"X": f["X"]} if "X" in f else {}
+        for key, selected in [("layers", layers), ("obsm", obsm)]:
+            if key in f:
+                for name in _selected(f[key], selected):
+                    elements[f"{key}/{name}"] = f[key][name]
+        for name, node in elements.items():
+            if _is_sparse_group(node):
+                nnz[name] = int(node["data"].shape[0])
+    return nnz
+
+
+def _check_integral(matrix: Union["np.ndarray", "spmatrix"], dtype: "np.dtype"):
+    import numpy as np
+    from scipy.sparse import issparse
+
+    if dtype.kind not in "iu":
+        return
+    values = matrix.data if issparse(matrix) else np.asarray(matrix)
+    if not np.all(np.mod(values, 1) == 0):
+        raise ValueError(f"Can not convert non-integer values to {dtype}.")
+
+
+def _convert_matrix(
+    matrix: Union["np.ndarray", "spmatrix"],
+    sparse: bool,
+    dtype: Optional["np.dtype"],
+) -> Union["np.ndarray", "spmatrix"]:
+    from scipy.sparse import csr_matrix, issparse
+
+    if dtype is not None and matrix.dtype != dtype:
+        _check_integral(matrix, dtype)
+        matrix = matrix.astype(dtype)
+    if sparse and not issparse(matrix) and getattr(matrix, "ndim", 0) == 2:
+        matrix = csr_matrix(matrix)
+    elif sparse and issparse(matrix):
+        matrix = matrix.tocsr()
+    return matrix
+
+
+def _read_dense_as_csr(node, dtype: Optional["np.dtype"]) -> "spmatrix":
+    """Reads the given dense matrix as CSR in chunks of cells, to never hold it dense in memory."""
+    import numpy as np
+    from scipy.sparse import vstack
+
+    blocks = [
+        _convert_matrix(np.asarray(node[start : start + _CHUNK_SIZE]), True, dtype)
+        for start in range(0, node.shape[0], _CHUNK_SIZE)
+    ]
+    if not blocks:
+        return _convert_matrix(np.zeros(node.shape, dtype=node.dtype), True, dtype)
+    return vstack(blocks, format="csr")
+
+
+def _read_converted(node, dtype: "np.dtype") -> "np.ndarray":
+    """Reads the given array converted to `dtype` in chunks, to never hold it unconverted."""
+    import numpy as np
+
+    out = np.empty(node.shape, dtype=dtype)
+    if out.size == 0:
+        return out
+    # chunks of as many values as _CHUNK_SIZE cells of 1000 genes
+    step = max(1, _CHUNK_SIZE * 1000 // max(1, out.size // out.shape[0]))
+    for start in range(0, out.shape[0], step):
+        chunk = np.asarray(node[start : start + step])
+        _check_integral(chunk, dtype)
+        out[start : start + step] = chunk
+    return out
+
+
+def _read_sparse_converted(node, dtype: "np.dtype") -> "spmatrix":
+    """Reads the given stored sparse matrix with its values converted to `dtype` in chunks."""
+    import numpy as np
+    from scipy.sparse import csc_matrix, csr_matrix
+
+    attrs = node.attrs
+    if "encoding-type" in attrs:
+        fmt, shape = attrs["encoding-type"][:3], attrs["shape"]
+    else:
+        # written by anndata < 0.8
+        fmt, shape = attrs["h5sparse_format"], attrs["h5sparse_shape"]
+    cls = csr_matrix if fmt == "csr" else csc_matrix
+    return cls(
+        (
+            _read_converted(node["data"], dtype),
+            np.asarray(node["indices"]),
+            np.asarray(node["indptr"]),
+        ),
+        shape=tuple(shape),
+    )
+
+
+def read_dataset(
+    path: str,
+    layers: Optional[Sequence[str]] = None,
+    obsm: Optional[Sequence[str]] = None,
+    sparse: bool = False,
+    dtype: Optional[Union[str, "np.dtype"]] = None,
+) -> "AnnData":
+    """
+    Reads the h5ad or zarr dataset at the given path, converting its matrices while reading.
+
+    X and the layers are converted chunk by chunk while they are read, so that the peak memory
+    is close to the size of the converted dataset, as estimated by :func:`estimate_footprint`.
+    The ``obsm`` entries and the other elements are read as stored, which is also how they are
+    estimated.
+
+    Parameters
+    ----------
+    path
+        Path of the h5ad or zarr dataset
+    layers
+        Names of the layers to read. If None, reads all layers.
+    obsm
+        Names of the ``obsm`` entries to read. If None, reads all entries.
+    sparse
+        Whether to convert X and the layers to CSR matrices. Dense matrices are converted in
+        chunks of cells.
+    dtype
+        dtype to convert X and the layers to, e.g. "float32", or "int32" for integer counts.
+
+    Returns
+    -------
+    The dataset.
+    """
+    import anndata
+    import numpy as np
+    from anndata.experimental import read_dispatched, read_elem
+
+    dtype = np.dtype(dtype) if dtype is not None else None
+
+    def read_matrix(func, elem):
+        if sparse and _is_array(elem) and len(elem.shape) == 2:
+            return _read_dense_as_csr(elem, dtype)
+        if dtype is not None and _is_array(elem) and elem.dtype != dtype:
+            return _read_converted(elem, dtype)
+        if dtype is not None and _is_sparse_group(elem) and elem["data"].dtype != dtype:
+            return _convert_matrix(_read_sparse_converted(elem, dtype), sparse, None)
+        return _convert_matrix(func(elem), sparse, dtype)
+
+    def callback(func, elem_name: str, elem, iospec):
+        if iospec.encoding_type == "anndata" or elem_name.endswith("/"):
+            return anndata.AnnData(
+                **{
+                    k: read_dispatched(elem[k], callback)
+                    for k in elem.keys()
+                    if not k.startswith("raw.")
+                }
+            )
+        if elem_name == "/X":
+            return read_matrix(func, elem)
+        if elem_name == "/layers":
+            return {k: read_matrix(read_elem, elem[k]) for k in _selected(elem, layers)}
+        if elem_name == "/obsm":
+            return {
+                k: read_dispatched(elem[k], callback) for k in _selected(elem, obsm)
+            }
+        return func(elem)
+
+    with _open_group(path) as f:
+        legacy = "raw.X" in f or _is_array(f["obs"])
+    if legacy:
+        # files written by anndata < 0.7, which are read with anndata's compatibility code
+        adata = read_zarr(path) if is_zarr_dataset(path) else anndata.read_h5ad(path)
+        return convert_anndata(adata, layers, obsm, sparse, dtype)
+    with _open_group(path) as f:
+        try:
+            return read_dispatched(f, callback=callback)
+        except OSError as e:
+            # anndata wraps the errors raised while reading an element
+            if isinstance(e.__cause__, ValueError):
+                raise e.__cause__
+            raise
+
+
+def convert_anndata(
+    adata: "AnnData",
+    layers: Optional[Sequence[str]] = None,
+    obsm: Optional[Sequence[str]] = None,
+    sparse: bool = False,
+    dtype: Optional[Union[str, "np.dtype"]] = None,
+) -> "AnnData":
+    """Applies the conversions of :func:`read_dataset` to an AnnData in memory, in place."""
+    import numpy as np
+
+    dtype = np.dtype(dtype) if dtype is not None else None
+    for name in set(adata.layers.keys()) - set(_selected(adata.layers, layers)):
+        del adata.layers[name]
+    for name in set(adata.obsm.keys()) - set(_selected(adata.obsm, obsm)):
+        del adata.obsm[name]
+    if adata.X is not None:
+        adata.X = _convert_matrix(adata.X, sparse, dtype)
+    for name in list(adata.layers.keys()):
+        adata.layers[name] = _convert_matrix(adata.layers[name], sparse, dtype)
+    return adata
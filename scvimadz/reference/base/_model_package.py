@@ -0,0 +1,261 @@
+import json
+import struct
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
+
+from scvimadz._scvi_compat import (
+    initialize_model,
+    load_saved_files,
+    parse_device,
+    validate_anndata,
+    validate_var_names,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+    from anndata import AnnData
+    from scvi.model.base import BaseModelClass
+
+MODEL_PACKAGE_SUFFIX = ".madz"
+
+# File layout:
+#   magic (8 bytes) | header length (little-endian uint64) | JSON header | padding | tensors
+# The tensor data starts at a page boundary and each tensor starts at a page boundary relative
+# to it, so that tensors can be memory-mapped directly from the file.
+_MAGIC = b"SCVIMADZ"
+_FORMAT_VERSION = 1
+_ALIGNMENT = 4096
+_PREAMBLE = struct.Struct("<8sQ")
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def is_model_package(key: str) -> bool:
+    """Returns whether the given key refers to a zoo model package."""
+    return key.endswith(MODEL_PACKAGE_SUFFIX)
+
+
+class _AttrEncoder:
+    """
+    Encodes the attributes of a model into JSON-serializable values.
+
+    Numeric arrays (e.g. train indices) are moved to the tensor section of the package, so that
+    the header stays small. Dataframes (e.g. the training history) and string arrays are
+    stored inline.
+    """
+
+    def __init__(self) -> None:
+        self.arrays: Dict[str, "np.ndarray"] = OrderedDict()
+
+    def encode(self, value: Any, path: str) -> Any:
+        import numpy as np
+        import pandas as pd
+
+        if isinstance(value, dict):
+            return {
+                "__dict__": [
+                    [k, self.encode(v, f"{path}/{k}")] for k, v in value.items()
+                ]
+            }
+        if isinstance(value, (list, tuple)):
+            return [self.encode(v, f"{path}/{i}") for i, v in enumerate(value)]
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind in "biufc":
+                self.arrays[path] = value
+                return {"__tensor__": path}
+            return {"__ndarray__": value.tolist(), "dtype": str(value.dtype)}
+        if isinstance(value, pd.DataFrame):
+            return {
+                "__dataframe__": json.loads(value.to_json(orient="split")),
+                "index_name": value.index.name,
+            }
+        if isinstance(value, np.generic):
+            return value.item()
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        raise ValueError(
+            f"Can not package model attribute {path} of type {type(value).__name__}."
+        )
+
+
+def _decode_attr(value: Any, arrays: Dict[str, "np.ndarray"]) -> Any:
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(value, list):
+        return [_decode_attr(v, arrays) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if "__dict__" in value:
+        return {k: _decode_attr(v, arrays) for k, v in value["__dict__"]}
+    if "__tensor__" in value:
+        # copy, since attributes are small and are expected to be regular, writable arrays
+        return np.array(arrays[value["__tensor__"]])
+    if "__ndarray__" in value:
+        return np.array(value["__ndarray__"], dtype=value["dtype"])
+    if "__dataframe__" in value:
+        split = value["__dataframe__"]
+        df = pd.DataFrame(split["data"], index=split["index"], columns=split["columns"])
+        df.index.name = value["index_name"]
+        return df
+    raise ValueError(f"Unrecognized packaged attribute: {value}")
+
+
+def pack_model(dir_path: str, output_path: str, prefix: Optional[str] = None) -> str:
+    """
+    Packs a model saved with :meth:`~scvi.model.base.BaseModelClass.save` into a zoo model package.
+
+    The package stores the weights uncompressed and page-aligned, and the var names and model
+    attributes (incl. the registry) in a small JSON header, so that loading a model reads the
+    header first and memory-maps the weights.
+
+    Parameters
+    ----------
+    dir_path
+        Directory the model was saved to
+    output_path
+        Path of the package to write
+    prefix
+        Prefix of the saved model file names, if any
+
+    Returns
+    -------
+    The path of the written package.
+    """
+    import numpy as np
+
+    attr_dict, var_names, model_state_dict = load_saved_files(dir_path, prefix)
+    encoder = _AttrEncoder()
+    encoded_attrs = encoder.encode(attr_dict, "attr")
+    arrays = OrderedDict(
+        (f"state/{name}", tensor.detach().cpu().numpy())
+        for name, tensor in model_state_dict.items()
+    )
+    arrays.update(encoder.arrays)
+
+    tensors = OrderedDict()
+    offset = 0
+    for name, array in arrays.items():
+        tensors[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": array.nbytes,
+        }
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(
+        {
+            "format_version": _FORMAT_VERSION,
+            "var_names": np.asarray(var_names).astype(str).tolist(),
+            "attr_dict": encoded_attrs,
+            "tensors": tensors,
+        }
+    ).encode("utf-8")
+
+    data_start = _align(_PREAMBLE.size + len(header))
+    with open(output_path, "wb") as f:
+        f.write(_PREAMBLE.pack(_MAGIC, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        # make sure the file covers the last (page-aligned) tensor
+        f.truncate(data_start + offset)
+    return output_path
+
+
+def read_model_package_header(path: str) -> Tuple[dict, int]:
+    """
+    Reads only the header of the given zoo model package.
+
+    Parameters
+    ----------
+    path
+        Path of the package
+
+    Returns
+    -------
+    The header, and the offset of the tensor data in the file.
+    """
+    with open(path, "rb") as f:
+        magic, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a zoo model package.")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    if header["format_version"] > _FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model package version: {header['format_version']}."
+        )
+    return header, _align(_PREAMBLE.size + header_length)
+
+
+def _map_arrays(path: str, header: dict, data_start: int) -> Dict[str, "np.ndarray"]:
+    import numpy as np
+
+    arrays = {}
+    if not header["tensors"]:
+        return arrays
+    # copy-on-write: pages are shared between processes until (if ever) written to
+    buffer = np.memmap(path, dtype=np.uint8, mode="c", offset=data_start)
+    for name, info in header["tensors"].items():
+        start = info["offset"]
+        raw = buffer[start : start + info["nbytes"]]
+        arrays[name] = raw.view(np.dtype(info["dtype"])).reshape(info["shape"])
+    return arrays
+
+
+def load_model_package(
+    model_cls: "BaseModelClass",
+    path: str,
+    adata: "AnnData",
+    use_gpu: Optional[Union[str, int, bool]] = None,
+    mmap: bool = True,
+) -> "BaseModelClass":
+    """
+    Loads a model from the given zoo model package.
+
+    Mirrors :meth:`~scvi.model.base.BaseModelClass.load`, but reads the attributes from the
+    package header and the weights from memory-mapped tensors.
+
+    Parameters
+    ----------
+    model_cls
+        Class of the model
+    path
+        Path of the package
+    adata
+        AnnData object used to initialize the model
+    use_gpu
+        Load model on default GPU if available (if None or True), or index of GPU to use (if int),
+        or name of GPU (if str), or use CPU (if False).
+    mmap
+        Whether the model parameters should use the memory-mapped tensors directly instead of
+        copies, when the model is on the CPU. This lets processes loading the same model share
+        the weights' pages.
+    """
+    import torch
+
+    header, data_start = read_model_package_header(path)
+    arrays = _map_arrays(path, header, data_start)
+    attr_dict = _decode_attr(header["attr_dict"], arrays)
+    state_dict = OrderedDict(
+        (name[len("state/") :], torch.from_numpy(array))
+        for name, array in arrays.items()
+        if name.startswith("state/")
+    )
+    device = parse_device(use_gpu)
+    validate_var_names(adata, header["var_names"])
+    model = initialize_model(model_cls, adata, attr_dict)
+    model.module.load_state_dict(state_dict)
+    if mmap and str(device) == "cpu":
+        tensors = dict(model.module.named_parameters())
+        tensors.update(model.module.named_buffers())
+        for name, tensor in state_dict.items():
+            if tensors[name].dtype == tensor.dtype:
+                tensors[name].data = tensor
+    model.to_device(device)
+    model.module.eval()
+    validate_anndata(model, adata)
+    return model
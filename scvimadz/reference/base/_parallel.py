@@ -0,0 +1,145 @@
+import copy
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    from anndata import AnnData
+    from scipy.sparse import spmatrix
+    from scvi.model.base import BaseModelClass
+
+    from ._base_reference import BaseReference
+
+_SKELETON_FILE = "skeleton.h5ad"
+
+
+def _dump_matrix(
+    matrix: Union["np.ndarray", "spmatrix"], out_dir: str, name: str
+) -> dict:
+    import numpy as np
+    from scipy.sparse import issparse
+
+    if issparse(matrix):
+        matrix = matrix.tocsr()
+        for part in ["data", "indices", "indptr"]:
+            np.save(os.path.join(out_dir, f"{name}.{part}.npy"), getattr(matrix, part))
+        return {"name": name, "sparse": True, "shape": matrix.shape}
+    np.save(os.path.join(out_dir, f"{name}.npy"), np.asarray(matrix))
+    return {"name": name, "sparse": False}
+
+
+def _map_matrix(spec: dict, out_dir: str) -> Union["np.ndarray", "spmatrix"]:
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    # copy-on-write so that the pages of the file are shared by all workers
+    if not spec["sparse"]:
+        return np.load(os.path.join(out_dir, f"{spec['name']}.npy"), mmap_mode="c")
+    parts = [
+        np.load(os.path.join(out_dir, f"{spec['name']}.{part}.npy"), mmap_mode="c")
+        for part in ["data", "indices", "indptr"]
+    ]
+    return csr_matrix(tuple(parts), shape=spec["shape"], copy=False)
+
+
+def share_anndata(adata: "AnnData", out_dir: str) -> dict:
+    """
+    Writes the given AnnData to `out_dir` so that worker processes can memory-map it.
+
+    X and the layers are written as numpy files, which workers memory-map, and everything else
+    (obs, var, obsm, uns...) as a small h5ad file.
+
+    Parameters
+    ----------
+    adata
+        The AnnData to share
+    out_dir
+        Directory to write the AnnData to
+
+    Returns
+    -------
+    The spec to pass to :func:`init_worker` in the workers.
+    """
+    import anndata
+
+    skeleton = anndata.AnnData(
+        obs=adata.obs,
+        var=adata.var,
+        obsm=dict(adata.obsm),
+        varm=dict(adata.varm),
+        uns=dict(adata.uns),
+    )
+    skeleton.write_h5ad(os.path.join(out_dir, _SKELETON_FILE))
+    return {
+        "dir": out_dir,
+        "X": _dump_matrix(adata.X, out_dir, "X"),
+        "layers": [
+            _dump_matrix(layer, out_dir, f"layer_{i}_{name}")
+            for i, (name, layer) in enumerate(adata.layers.items())
+        ],
+        "layer_names": list(adata.layers.keys()),
+    }
+
+
+class _SharedAnnData:
+    """Memory-mapped view of an AnnData shared with :func:`share_anndata`."""
+
+    def __init__(self, spec: dict) -> None:
+        import anndata
+
+        out_dir = spec["dir"]
+        self._skeleton = anndata.read_h5ad(os.path.join(out_dir, _SKELETON_FILE))
+        self._X = _map_matrix(spec["X"], out_dir)
+        self._layers = {
+            name: _map_matrix(layer_spec, out_dir)
+            for name, layer_spec in zip(spec["layer_names"], spec["layers"])
+        }
+
+    def new_anndata(self) -> "AnnData":
+        """
+        Returns a new AnnData backed by the shared matrices.
+
+        Each call gets its own obs, var and uns, since models register fields in them, while the
+        memory-mapped matrices are never copied.
+        """
+        import anndata
+
+        return anndata.AnnData(
+            X=self._X,
+            obs=self._skeleton.obs.copy(),
+            var=self._skeleton.var.copy(),
+            obsm={k: v.copy() for k, v in self._skeleton.obsm.items()},
+            varm={k: v.copy() for k, v in self._skeleton.varm.items()},
+            uns=copy.deepcopy(dict(self._skeleton.uns)),
+            layers=self._layers,
+        )
+
+
+_worker_state: Dict[str, Any] = {}
+
+
+def init_worker(reference: "BaseReference", spec: dict, n_threads: int) -> None:
+    """Initializes an evaluation worker process."""
+    import torch
+
+    torch.set_num_threads(n_threads)
+    _worker_state["reference"] = reference
+    _worker_state["adata"] = _SharedAnnData(spec)
+
+
+def evaluate_model(
+    model_id: str,
+    fn: Callable[["BaseModelClass", "AnnData"], Any],
+    use_gpu: Optional[Union[str, int, bool]],
+) -> Any:
+    """Loads the given model on the shared AnnData in an evaluation worker and applies `fn` to it."""
+    adata = _worker_state["adata"].new_anndata()
+    model = _worker_state["reference"].load_model(
+        model_id, adata=adata, use_gpu=use_gpu
+    )
+    return fn(model, adata)
+
+
+def latent_representation(model: "BaseModelClass", adata: "AnnData") -> "np.ndarray":
+    """Default evaluation function, which returns the latent representation of the query cells."""
+    return model.get_latent_representation(adata)
@@ -0,0 +1,130 @@
+import sys
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from rich.console import Console
+    from rich.table import Table
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def _format_value(value) -> str:
+    import pandas as pd
+
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return ""
+    return str(value)
+
+
+class CatalogPager:
+    """
+    Renders a catalog dataframe one page of rows at a time.
+
+    Only the rows of the page being rendered are formatted, so listing a large catalog does
+    not render all of it upfront.
+
+    Parameters
+    ----------
+    df
+        The catalog to render
+    page_size
+        Number of rows per page
+    title
+        Title of the tables
+    """
+
+    def __init__(
+        self,
+        df: "pd.DataFrame",
+        page_size: int = DEFAULT_PAGE_SIZE,
+        title: Optional[str] = None,
+    ) -> None:
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1.")
+        self._df = df
+        self._page_size = page_size
+        self._title = title
+
+    @property
+    def n_pages(self) -> int:
+        return max(-(-len(self._df) // self._page_size), 1)
+
+    def render_page(self, page: int) -> "Table":
+        """
+        Returns the table of the given page of rows.
+
+        Parameters
+        ----------
+        page
+            Index of the page, starting at 0
+        """
+        from rich.table import Table
+
+        if not 0 <= page < self.n_pages:
+            raise ValueError(f"Page {page} out of range [0, {self.n_pages}).")
+        start = page * self._page_size
+        rows = self._df.iloc[start : start + self._page_size]
+        table = Table(
+            title=self._title,
+            caption=f"rows {start + 1}-{start + len(rows)} of {len(self._df)}",
+        )
+        table.add_column(self._df.index.name or "", style="bold")
+        for column in self._df.columns:
+            table.add_column(str(column))
+        for row in rows.itertuples(name=None):
+            table.add_row(*(_format_value(value) for value in row))
+        return table
+
+    def pages(self, start: int = 0) -> Iterator["Table"]:
+        """Yields the table of each page from `start` on, rendering each one when it is requested."""
+        for page in range(start, self.n_pages):
+            yield self.render_page(page)
+
+
+def print_catalog(
+    df: "pd.DataFrame",
+    page_size: int = DEFAULT_PAGE_SIZE,
+    title: Optional[str] = None,
+    console: Optional["Console"] = None,
+    interactive: Optional[bool] = None,
+) -> None:
+    """
+    Prints the given catalog one page at a time.
+
+    In an interactive terminal, the next page is only rendered once the user asks for it. Otherwise, the
+    pages are rendered and printed one after the other.
+
+    Parameters
+    ----------
+    df
+        The catalog to print
+    page_size
+        Number of rows per page
+    title
+        Title of the tables
+    console
+        Console to print to. Defaults to a new console on stdout.
+    interactive
+        Whether to wait for the user before printing each page after the first one. Defaults
+        to whether both the console and stdin are terminals.
+    """
+    from rich.console import Console
+
+    if console is None:
+        console = Console()
+    if interactive is None:
+        # never wait on input that can not come, e.g. in scripts with a closed or piped stdin
+        interactive = (
+            console.is_terminal and sys.stdin is not None and sys.stdin.isatty()
+        )
+    pager = CatalogPager(df, page_size, title)
+    for page in range(pager.n_pages):
+        # the page is only rendered once the user asked for it
+        if page > 0 and interactive:
+            answer = console.input(
+                f"[dim]Page {page + 1}/{pager.n_pages}: press Enter to continue, q to quit[/dim] "
+            )
+            if answer.strip().lower() == "q":
+                return
+        console.print(pager.render_page(page))
@@ -0,0 +1,297 @@
+import json
+import os
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from scvimadz.storage.base import FileToUpload
+
+from ._zarr import ZARR_ZIP_SUFFIX, write_zarr_zip
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from anndata import AnnData
+
+SHARD_MANIFEST_SUFFIX = ".shards.json"
+_SHARD_KEY_INFIX = ".shard-"
+
+
+def is_shard_key(key: str) -> bool:
+    """Returns whether the given key is a single shard of a sharded dataset."""
+    return _SHARD_KEY_INFIX in key
+
+
+def is_sharded_dataset(dataset_id: str) -> bool:
+    """Returns whether the given dataset id refers to a sharded dataset."""
+    return dataset_id.endswith(SHARD_MANIFEST_SUFFIX)
+
+
+def write_shards(
+    adata: "AnnData",
+    dataset_name: str,
+    out_dir: str,
+    shard_by: Optional[str] = None,
+    shard_size: Optional[int] = None,
+    file_format: str = "h5ad",
+) -> Tuple[dict, List[FileToUpload]]:
+    """
+    Splits the given AnnData into shards and writes them to `out_dir`.
+
+    Parameters
+    ----------
+    adata
+        The AnnData to split
+    dataset_name
+        Prefix of the shard keys
+    out_dir
+        Directory to write the shards to
+    shard_by
+        Column of ``adata.obs`` to split by, one shard per value. Mutually exclusive with `shard_size`.
+    shard_size
+        Number of cells per shard. Mutually exclusive with `shard_by`.
+    file_format
+        Format of the shards, one of "h5ad" or "zarr".
+
+    Returns
+    -------
+    The shards manifest and the files to upload for the shards.
+    """
+    if (shard_by is None) == (shard_size is None):
+        raise ValueError("Exactly one of shard_by, shard_size must be provided.")
+    if shard_by is not None:
+        if shard_by not in adata.obs:
+            raise ValueError(f"Column {shard_by} not found in adata.obs.")
+        values = adata.obs[shard_by].astype(str)
+        groups = [(value, (values == value).to_numpy()) for value in values.unique()]
+    else:
+        if shard_size <= 0:
+            raise ValueError("shard_size must be positive.")
+        groups = [
+            (None, slice(start, min(start + shard_size, adata.n_obs)))
+            for start in range(0, adata.n_obs, shard_size)
+        ]
+
+    shards = []
+    files = []
+    for i, (value, subset) in enumerate(groups):
+        suffix = ZARR_ZIP_SUFFIX if file_format == "zarr" else ".h5ad"
+        key = f"{dataset_name}{_SHARD_KEY_INFIX}{i}{suffix}"
+        shard = adata[subset]
+        path = os.path.join(out_dir, key)
+        if file_format == "zarr":
+            write_zarr_zip(shard.copy(), path)
+        else:
+            shard.write_h5ad(path)
+        shards.append({"key": key, "value": value, "n_obs": shard.n_obs})
+        files.append(FileToUpload(path, key))
+    manifest = {"shard_by": shard_by, "shard_size": shard_size, "shards": shards}
+    return manifest, files
+
+
+def read_manifest(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def select_shards(
+    manifest: dict, shards: Optional[Sequence[Union[int, str]]] = None
+) -> List[str]:
+    """
+    Returns the keys of the selected shards.
+
+    Parameters
+    ----------
+    manifest
+        The shards manifest
+    shards
+        Values of the ``shard_by`` column to select if the dataset was sharded by a column,
+        else indices of the shards to select. If None, selects all shards.
+    """
+    if shards is None:
+        return [shard["key"] for shard in manifest["shards"]]
+    if manifest["shard_by"] is not None:
+        by_value = {shard["value"]: shard["key"] for shard in manifest["shards"]}
+        missing = [s for s in shards if str(s) not in by_value]
+        if missing:
+            raise ValueError(f"Shards not found: {missing}")
+        return [by_value[str(s)] for s in shards]
+    n_shards = len(manifest["shards"])
+    missing = [s for s in shards if not isinstance(s, int) or not 0 <= s < n_shards]
+    if missing:
+        raise ValueError(f"Shards not found: {missing}")
+    return [manifest["shards"][s]["key"] for s in shards]
+
+
+class _RowStacker:
+    """
+    Stacks the rows of the matrices of consecutive shards into a matrix allocated once.
+
+    Dense arrays are allocated from the total number of cells. Sparse matrices are stacked as
+    CSR, and allocated from the total number of stored values if it is known, else their
+    values are concatenated once all shards are added. Other values (e.g. dataframes) are
+    concatenated once all shards are added.
+    """
+
+    def __init__(self, n_obs: int, nnz: Optional[int] = None) -> None:
+        self._n_obs = n_obs
+        self._nnz = nnz
+        self._row = 0
+        self._pos = 0
+        self._out: Any = None
+        self._blocks: List[Any] = []
+
+    def add(self, value) -> None:
+        import numpy as np
+        from scipy.sparse import issparse
+
+        n_rows = value.shape[0]
+        if issparse(value):
+            value = value.tocsr()
+            if self._out is None:
+                int32_max = np.iinfo(np.int32).max
+                indptr_dtype = (
+                    np.int32
+                    if self._nnz is not None and self._nnz <= int32_max
+                    else np.int64
+                )
+                self._out = {
+                    "data": np.empty(self._nnz or 0, dtype=value.dtype),
+                    "indices": np.empty(
+                        self._nnz or 0,
+                        dtype=np.int32 if value.shape[1] <= int32_max else np.int64,
+                    ),
+                    "indptr": np.zeros(self._n_obs + 1, dtype=indptr_dtype),
+                    "n_vars": value.shape[1],
+                }
+            out = self._out
+            stop = self._pos + value.nnz
+            if self._nnz is not None:
+                if stop > self._nnz:
+                    raise ValueError(
+                        f"The shards hold more than the {self._nnz} values expected."
+                    )
+                out["data"][self._pos : stop] = value.data
+                out["indices"][self._pos : stop] = value.indices
+            else:
+                self._blocks.append((value.data, value.indices))
+            out["indptr"][self._row + 1 : self._row + n_rows + 1] = (
+                value.indptr[1:] + self._pos
+            )
+            self._pos = stop
+        elif isinstance(value, np.ndarray):
+            if self._out is None:
+                self._out = np.empty(
+                    (self._n_obs,) + value.shape[1:], dtype=value.dtype
+                )
+            self._out[self._row : self._row + n_rows] = value
+        else:
+            self._blocks.append(value)
+        self._row += n_rows
+
+    def result(self):
+        import numpy as np
+        import pandas as pd
+        from scipy.sparse import csr_matrix
+
+        if isinstance(self._out, np.ndarray):
+            return self._out
+        if self._out is None:
+            return pd.concat(self._blocks)
+        out = self._out
+        if self._nnz is None:
+            data = np.concatenate([data for data, _ in self._blocks])
+            indices = np.concatenate([indices for _, indices in self._blocks])
+        else:
+            data, indices = out["data"], out["indices"]
+        indptr = out["indptr"]
+        return csr_matrix((data, indices, indptr), shape=(self._n_obs, out["n_vars"]))
+
+
+def _concat_obs(parts: List["pd.DataFrame"]) -> "pd.DataFrame":
+    """Concatenates obs dataframes, joining the categories of categorical columns."""
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    obs = pd.concat(parts)
+    for column in parts[0].columns:
+        values = [part[column] for part in parts if column in part]
+        if len(values) == len(parts) and all(
+            isinstance(v.dtype, pd.CategoricalDtype) for v in values
+        ):
+            obs[column] = pd.Categorical(
+                obs[column],
+                categories=union_categoricals(values, ignore_order=True).categories,
+            )
+    return obs
+
+
+def concat_shards(
+    shards: Iterable["AnnData"], n_obs: int, nnz: Optional[Dict[str, int]] = None
+) -> "AnnData":
+    """
+    Concatenates the given shards of a dataset along the cells, one shard at a time.
+
+    X, the layers and the obsm entries are copied into matrices allocated once for all the
+    shards, and each shard is released once copied, so that the peak memory is the size of the
+    concatenated dataset and one shard, instead of twice the size of the dataset. The shards
+    are written from the same dataset, so var, varm and uns are taken from the first one.
+
+    Parameters
+    ----------
+    shards
+        The shards, e.g. a generator reading them one after the other
+    n_obs
+        Total number of cells of the shards
+    nnz
+        Total number of values stored in each sparse matrix of the shards, by element name
+        (e.g. "X", "layers/counts"), to allocate them at once. The values of the other sparse
+        matrices are concatenated once all shards are read.
+    """
+    import anndata
+
+    nnz = nnz or {}
+    first = None
+    obs = []
+    stackers: Dict[str, _RowStacker] = {}
+    for shard in shards:
+        if first is None:
+            first = {
+                "var": shard.var,
+                "varm": dict(shard.varm),
+                "uns": shard.uns,
+            }
+        obs.append(shard.obs)
+        elements = {"X": shard.X} if shard.X is not None else {}
+        elements.update({f"layers/{k}": v for k, v in shard.layers.items()})
+        elements.update({f"obsm/{k}": v for k, v in shard.obsm.items()})
+        for name, value in elements.items():
+            if name not in stackers:
+                stackers[name] = _RowStacker(n_obs, nnz.get(name))
+            stackers[name].add(value)
+        del shard, elements
+    if first is None:
+        raise ValueError("No shards to concatenate.")
+    stacked = {name: stacker.result() for name, stacker in stackers.items()}
+    return anndata.AnnData(
+        X=stacked.pop("X", None),
+        obs=_concat_obs(obs),
+        var=first["var"],
+        uns=first["uns"],
+        varm=first["varm"],
+        layers={
+            k[len("layers/") :]: v
+            for k, v in stacked.items()
+            if k.startswith("layers/")
+        },
+        obsm={
+            k[len("obsm/") :]: v for k, v in stacked.items() if k.startswith("obsm/")
+        },
+    )
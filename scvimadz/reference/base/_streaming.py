@@ -0,0 +1,263 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Union
+
+from ._zarr import ZarrDataset
+
+if TYPE_CHECKING:
+    import numpy as np
+    from scipy.sparse import spmatrix
+    from torch.utils.data import IterableDataset
+
+
+class H5adDataset(ZarrDataset):
+    """
+    Chunked reader over an h5ad dataset, with the same interface as :class:`ZarrDataset`.
+
+    Parameters
+    ----------
+    path
+        Path to the ``.h5ad`` file
+    """
+
+    def _open(self):
+        import h5py
+
+        return h5py.File(self._path, "r")
+
+    def _close(self, group) -> None:
+        group.close()
+
+
+def _vstack(
+    blocks: List[Union["np.ndarray", "spmatrix"]]
+) -> Union["np.ndarray", "spmatrix"]:
+    import numpy as np
+    from scipy.sparse import issparse, vstack
+
+    if len(blocks) == 1:
+        return blocks[0]
+    if any(issparse(b) for b in blocks):
+        return vstack(blocks, format="csr")
+    return np.concatenate(blocks)
+
+
+class MinibatchIterator:
+    """
+    Iterates over minibatches of cells streamed from stored datasets.
+
+    Cells are read in contiguous blocks, which are prefetched in a thread pool. When shuffling,
+    the order of the blocks is shuffled, and the cells of a buffer of blocks are shuffled before
+    being split into minibatches. The memory used is thus bounded by the buffer and prefetch
+    sizes, not by the size of the datasets. Each iteration over the iterator is an epoch.
+
+    Parameters
+    ----------
+    datasets
+        Chunked readers over the datasets (or shards) to stream, e.g. :class:`ZarrDataset`
+    batch_size
+        Number of cells per minibatch
+    shuffle
+        Whether to shuffle the cells
+    buffer_size
+        Number of cells to shuffle together. Larger buffers shuffle better and use more memory.
+    block_size
+        Number of contiguous cells read at once
+    layer
+        Layer to read from. If None, reads from X.
+    obs_keys
+        Columns of ``obs`` to include in the minibatches
+    n_workers
+        Number of threads reading blocks
+    prefetch
+        Maximum number of blocks read ahead
+    drop_last
+        Whether to drop the last minibatch if it has less than `batch_size` cells
+    seed
+        Seed of the shuffling
+
+    The datasets are closed by :meth:`close`, or when leaving a ``with`` block.
+    """
+
+    def __init__(
+        self,
+        datasets: Sequence[ZarrDataset],
+        batch_size: int = 128,
+        shuffle: bool = True,
+        buffer_size: int = 16384,
+        block_size: int = 1024,
+        layer: Optional[str] = None,
+        obs_keys: Optional[Sequence[str]] = None,
+        n_workers: int = 2,
+        prefetch: int = 8,
+        drop_last: bool = False,
+        seed: Optional[int] = None,
+    ) -> None:
+        import numpy as np
+
+        if batch_size <= 0 or block_size <= 0:
+            raise ValueError("batch_size and block_size must be positive.")
+        self._datasets = list(datasets)
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._buffer_size = max(buffer_size, batch_size)
+        self._block_size = block_size
+        self._layer = layer
+        self._obs_keys = list(obs_keys or [])
+        self._n_workers = n_workers
+        self._prefetch = max(prefetch, 1)
+        self._drop_last = drop_last
+        self._rng = np.random.default_rng(seed)
+        self._obs: Dict[int, Dict[str, "np.ndarray"]] = {}
+
+    def __enter__(self) -> "MinibatchIterator":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the datasets, which are reopened if the iterator is iterated over again."""
+        for dataset in self._datasets:
+            dataset.close()
+
+    @property
+    def n_obs(self) -> int:
+        """Total number of cells."""
+        return sum(d.n_obs for d in self._datasets)
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def __len__(self) -> int:
+        """Number of minibatches per epoch."""
+        if self._drop_last:
+            return self.n_obs // self._batch_size
+        return -(-self.n_obs // self._batch_size)
+
+    def _obs_columns(self, i: int) -> Dict[str, "np.ndarray"]:
+        if i not in self._obs:
+            import numpy as np
+            from anndata.experimental import read_elem
+
+            obs = self._datasets[i].group["obs"]
+            missing = [k for k in self._obs_keys if k not in obs]
+            if missing:
+                raise ValueError(f"Columns {missing} not found in obs.")
+            self._obs[i] = {k: np.asarray(read_elem(obs[k])) for k in self._obs_keys}
+        return self._obs[i]
+
+    def _read_block(self, i: int, start: int, stop: int) -> dict:
+        block = {"X": self._datasets[i].read_obs_block(start, stop, self._layer)}
+        for key, values in self._obs_columns(i).items():
+            block[key] = values[start:stop]
+        return block
+
+    def _iter_blocks(self) -> Iterator[dict]:
+        blocks = [
+            (i, start, min(start + self._block_size, dataset.n_obs))
+            for i, dataset in enumerate(self._datasets)
+            for start in range(0, dataset.n_obs, self._block_size)
+        ]
+        if self._shuffle:
+            blocks = [blocks[j] for j in self._rng.permutation(len(blocks))]
+        blocks = iter(blocks)
+        with ThreadPoolExecutor(max_workers=self._n_workers) as executor:
+            pending = deque()
+            try:
+                for block in blocks:
+                    pending.append(executor.submit(self._read_block, *block))
+                    if len(pending) >= self._prefetch:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # don't read the remaining blocks if the consumer stopped early
+                for future in pending:
+                    future.cancel()
+
+    def _concat(self, blocks: List[dict]) -> dict:
+        import numpy as np
+
+        return {
+            key: _vstack([b[key] for b in blocks])
+            if key == "X"
+            else np.concatenate([b[key] for b in blocks])
+            for key in blocks[0]
+        }
+
+    @staticmethod
+    def _take(buffer: dict, rows: "np.ndarray") -> dict:
+        return {key: values[rows] for key, values in buffer.items()}
+
+    def __iter__(self) -> Iterator[Dict[str, Union["np.ndarray", "spmatrix"]]]:
+        """
+        Yields minibatches, as dictionaries with the expression of the cells under "X" (in the
+        stored format, sparse or dense) and the values of each of the `obs_keys`.
+        """
+        import numpy as np
+
+        blocks = []
+        n_buffered = 0
+        for block in self._iter_blocks():
+            blocks.append(block)
+            n_buffered += block["X"].shape[0]
+            if n_buffered < self._buffer_size:
+                continue
+            buffer = self._concat(blocks)
+            order = (
+                self._rng.permutation(n_buffered)
+                if self._shuffle
+                else np.arange(n_buffered)
+            )
+            n_full = n_buffered // self._batch_size * self._batch_size
+            for start in range(0, n_full, self._batch_size):
+                yield self._take(buffer, order[start : start + self._batch_size])
+            # carry the remaining cells over to the next buffer
+            blocks = [self._take(buffer, np.sort(order[n_full:]))]
+            n_buffered -= n_full
+        if n_buffered == 0:
+            return
+        buffer = self._concat(blocks)
+        order = (
+            self._rng.permutation(n_buffered)
+            if self._shuffle
+            else np.arange(n_buffered)
+        )
+        for start in range(0, n_buffered, self._batch_size):
+            rows = order[start : start + self._batch_size]
+            if len(rows) < self._batch_size and self._drop_last:
+                return
+            yield self._take(buffer, rows)
+
+    def as_torch_dataset(self) -> "IterableDataset":
+        """
+        Wraps this iterator in a torch ``IterableDataset`` yielding dense float32 tensors.
+
+        Use it with ``DataLoader(dataset, batch_size=None)``, since minibatches are already
+        formed and prefetched. With several DataLoader workers, each worker opens the datasets
+        on its own when it first reads them.
+        """
+        import torch
+        from scipy.sparse import issparse
+        from torch.utils.data import IterableDataset
+
+        iterator = self
+
+        class _MinibatchDataset(IterableDataset):
+            def __iter__(self):
+                for batch in iterator:
+                    x = batch.pop("X")
+                    x = x.toarray() if issparse(x) else x
+                    batch = {
+                        k: torch.as_tensor(v) if v.dtype.kind in "biuf" else v
+                        for k, v in batch.items()
+                    }
+                    batch["X"] = torch.as_tensor(x, dtype=torch.float32)
+                    yield batch
+
+            def __len__(self):
+                return len(iterator)
+
+        return _MinibatchDataset()
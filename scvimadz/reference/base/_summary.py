@@ -0,0 +1,151 @@
+import hashlib
+from typing import TYPE_CHECKING, Optional, Sequence, Union
+
+from ._loading import estimate_footprint
+
+if TYPE_CHECKING:
+    import numpy as np
+    from anndata import AnnData
+    from scipy.sparse import spmatrix
+
+SUMMARY_SUFFIX = ".summary.json"
+# scalar summary fields, which can be shown as columns of the datasets dataframe
+SUMMARY_COLUMNS = [
+    "sparsity",
+    "size_on_disk",
+    "size_in_memory",
+    "var_names_hash",
+    "cell_type_key",
+    "n_cell_types",
+    "batch_keys",
+]
+_SUMMARY_VERSION = 1
+_BLOCK_SIZE = 10000
+# obs columns looked for when the cell type or batch columns are not given explicitly
+_CELL_TYPE_KEYS = ["cell_type", "cell_ontology_class", "celltype", "labels"]
+_BATCH_KEYS = ["batch", "donor", "sample", "method", "assay"]
+
+
+def is_summary_key(key: str) -> bool:
+    """Returns whether the given key is the summary of a dataset."""
+    return key.endswith(SUMMARY_SUFFIX)
+
+
+def summary_key(dataset_id: str) -> str:
+    """Returns the key of the summary of the given dataset."""
+    return f"{dataset_id}{SUMMARY_SUFFIX}"
+
+
+def var_names_hash(var_names: Sequence[str]) -> str:
+    """Returns a hash of the given list of var names, which identifies the feature space."""
+    digest = hashlib.sha256("\n".join(str(v) for v in var_names).encode("utf-8"))
+    return f"sha256:{digest.hexdigest()}"
+
+
+def _nbytes(matrix: Union["np.ndarray", "spmatrix"]) -> int:
+    from scipy.sparse import issparse
+
+    if issparse(matrix):
+        return sum(
+            getattr(matrix, part).nbytes
+            for part in ["data", "indices", "indptr"]
+            if hasattr(matrix, part)
+        )
+    return getattr(matrix, "nbytes", 0)
+
+
+def summarize_dataset(
+    adata: "AnnData",
+    size_on_disk: int,
+    cell_type_key: Optional[str] = None,
+    batch_keys: Optional[Sequence[str]] = None,
+) -> dict:
+    """
+    Computes the summary statistics of the given dataset.
+
+    ``adata.X`` is read in blocks of cells, in a single pass, so that the dataset can also be
+    backed.
+
+    Parameters
+    ----------
+    adata
+        The dataset to summarize
+    size_on_disk
+        Size of the stored dataset, in bytes
+    cell_type_key
+        Column of ``adata.obs`` with the cell types. If None, looks for common cell type columns.
+    batch_keys
+        Columns of ``adata.obs`` with the batches. If None, looks for common batch columns.
+
+    Returns
+    -------
+    The JSON-serializable summary.
+    """
+    import numpy as np
+    from scipy.sparse import issparse
+
+    sums = np.zeros(adata.n_vars, dtype=np.float64)
+    detected = np.zeros(adata.n_vars, dtype=np.int64)
+    for start in range(0, adata.n_obs, _BLOCK_SIZE):
+        block = adata.X[start : start + _BLOCK_SIZE]
+        if issparse(block):
+            block = block.tocsr()
+            sums += np.asarray(block.sum(axis=0)).ravel()
+            detected += np.bincount(
+                block.indices[block.data != 0], minlength=adata.n_vars
+            )
+        else:
+            block = np.asarray(block)
+            sums += block.sum(axis=0)
+            detected += np.count_nonzero(block, axis=0)
+    n_obs = max(adata.n_obs, 1)
+    n_entries = adata.n_obs * adata.n_vars
+
+    if cell_type_key is None:
+        cell_type_key = next((k for k in _CELL_TYPE_KEYS if k in adata.obs), None)
+    elif cell_type_key not in adata.obs:
+        raise ValueError(f"Column {cell_type_key} not found in adata.obs.")
+    cell_type_counts = {}
+    if cell_type_key is not None:
+        counts = adata.obs[cell_type_key].astype(str).value_counts()
+        cell_type_counts = {k: int(v) for k, v in counts.items()}
+    if batch_keys is None:
+        batch_keys = [k for k in _BATCH_KEYS if k in adata.obs]
+    missing = [k for k in batch_keys if k not in adata.obs]
+    if missing:
+        raise ValueError(f"Columns {missing} not found in adata.obs.")
+
+    if adata.isbacked:
+        # only the metadata of the stored matrix is read
+        size_in_memory = estimate_footprint(str(adata.filename)).get("X", 0)
+    else:
+        size_in_memory = _nbytes(adata.X)
+    size_in_memory += sum(_nbytes(layer) for layer in adata.layers.values())
+    size_in_memory += sum(_nbytes(value) for value in adata.obsm.values())
+    size_in_memory += int(adata.obs.memory_usage(deep=True).sum())
+    size_in_memory += int(adata.var.memory_usage(deep=True).sum())
+    return {
+        "summary_version": _SUMMARY_VERSION,
+        "n_obs": adata.n_obs,
+        "n_vars": adata.n_vars,
+        "sparsity": 1 - int(detected.sum()) / n_entries if n_entries else 0.0,
+        "size_on_disk": size_on_disk,
+        "size_in_memory": size_in_memory,
+        "var_names_hash": var_names_hash(adata.var_names),
+        "cell_type_key": cell_type_key,
+        "cell_type_counts": cell_type_counts,
+        "batch_keys": {k: int(adata.obs[k].nunique()) for k in batch_keys},
+        "genes": {
+            "names": adata.var_names.astype(str).to_list(),
+            "mean": (sums / n_obs).tolist(),
+            "detection_rate": (detected / n_obs).tolist(),
+        },
+    }
+
+
+def summary_columns(summary: dict) -> dict:
+    """Returns the scalar fields of the given summary, as shown in the datasets dataframe."""
+    columns = {k: summary[k] for k in SUMMARY_COLUMNS if k in summary}
+    columns["n_cell_types"] = len(summary["cell_type_counts"])
+    columns["batch_keys"] = ",".join(summary["batch_keys"])
+    return columns
@@ -0,0 +1,316 @@
+import collections
+import os
+import tempfile
+import zipfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    from anndata import AnnData
+    from scipy.sparse import spmatrix
+
+ZARR_ZIP_SUFFIX = ".zarr.zip"
+_ZARR_DIR_SUFFIX = ".zarr"
+_DEFAULT_CHUNK_SIZE = 1000
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError(
+            "Zarr datasets require the zarr package. Install it with `pip install zarr`."
+        )
+    return zarr
+
+
+def is_zarr_dataset(key: str) -> bool:
+    """Returns whether the given key refers to a zipped or directory-based zarr dataset."""
+    return key.endswith(ZARR_ZIP_SUFFIX) or key.rstrip("/").endswith(_ZARR_DIR_SUFFIX)
+
+
+def _open_store(path: str):
+    zarr = _import_zarr()
+    if os.path.isdir(path):
+        return zarr.DirectoryStore(path)
+    return zarr.ZipStore(path, mode="r")
+
+
+def write_zarr_zip(adata: "AnnData", path: str, chunk_size: int = _DEFAULT_CHUNK_SIZE):
+    """
+    Writes the given AnnData as a zipped zarr store.
+
+    The store is written to a directory first and then zipped without compression (the zarr
+    chunks are already compressed), so that individual chunks can be read directly from the archive.
+
+    Parameters
+    ----------
+    adata
+        The AnnData to write
+    path
+        Path of the zip file to write
+    chunk_size
+        Number of cells per chunk of the dense arrays
+    """
+    _import_zarr()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = os.path.join(tmp_dir, "store.zarr")
+        chunks = (min(chunk_size, max(adata.n_obs, 1)), max(adata.n_vars, 1))
+        adata.write_zarr(store_dir, chunks=chunks)
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for root, _, files in os.walk(store_dir):
+                for name in files:
+                    file_path = os.path.join(root, name)
+                    zf.write(file_path, os.path.relpath(file_path, store_dir))
+
+
+def read_zarr(path: str) -> "AnnData":
+    """Reads the zipped or directory-based zarr dataset at the given path into memory."""
+    import anndata
+
+    store = _open_store(path)
+    try:
+        return anndata.read_zarr(store)
+    finally:
+        if hasattr(store, "close"):
+            store.close()
+
+
+def _read_sparse_slice(
+    elem, start: int, stop: int, shape: Tuple[int, int], fmt: str
+) -> "spmatrix":
+    """Reads rows (csr) or columns (csc) [start, stop) of a sparse matrix, fetching only the chunks needed."""
+    from scipy.sparse import csc_matrix, csr_matrix
+
+    indptr = elem["indptr"][start : stop + 1]
+    data = elem["data"][indptr[0] : indptr[-1]]
+    indices = elem["indices"][indptr[0] : indptr[-1]]
+    indptr = indptr - indptr[0]
+    if fmt == "csr":
+        return csr_matrix((data, indices, indptr), shape=(stop - start, shape[1]))
+    return csc_matrix((data, indices, indptr), shape=(shape[0], stop - start))
+
+
+def _read_block(
+    dataset: "ZarrDataset", axis: str, start: int, stop: int, layer: Optional[str]
+):
+    # module level so that it can be sent to process pools
+    if axis == "obs":
+        return dataset.read_obs_block(start, stop, layer)
+    return dataset.read_var_block(start, stop, layer)
+
+
+class ZarrDataset:
+    """
+    Chunked reader over a zipped or directory-based zarr dataset.
+
+    Blocks of cells or genes are read without loading the whole matrix, fetching only the chunks
+    they span. Instances can be shared across threads, and sent to worker processes, which then
+    reopen the store on their own. The store is closed by :meth:`close`, when leaving a ``with``
+    block, or when the instance is garbage collected.
+
+    Parameters
+    ----------
+    path
+        Path to the ``.zarr.zip`` file or ``.zarr`` directory
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._group = None
+        self._pid = None
+
+    def __getstate__(self) -> dict:
+        # the zarr store can not be pickled, it is reopened lazily in the new process
+        return {"_path": self._path, "_group": None, "_pid": None}
+
+    def __enter__(self) -> "ZarrDataset":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def group(self):
+        """The root group of the dataset, opened on first access in each process."""
+        if self._group is not None and self._pid != os.getpid():
+            # inherited from the parent process on fork, e.g. by the workers of a DataLoader.
+            # The handle is the parent's to close, this process opens its own.
+            self._group = None
+        if self._group is None:
+            self._group = self._open()
+            self._pid = os.getpid()
+        return self._group
+
+    def _open(self):
+        zarr = _import_zarr()
+        return zarr.open_group(_open_store(self._path), mode="r")
+
+    def _close(self, group) -> None:
+        close = getattr(group.store, "close", None)
+        if close is not None:
+            close()
+
+    def close(self) -> None:
+        """Closes the dataset, which is reopened if it is read again."""
+        group = getattr(self, "_group", None)
+        if group is not None and getattr(self, "_pid", None) == os.getpid():
+            self._close(group)
+        self._group = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        x = self.group["X"]
+        if "shape" in x.attrs:
+            return tuple(x.attrs["shape"])
+        return x.shape
+
+    @property
+    def n_obs(self) -> int:
+        return self.shape[0]
+
+    @property
+    def n_vars(self) -> int:
+        return self.shape[1]
+
+    @property
+    def obs(self) -> "pd.DataFrame":
+        from anndata.experimental import read_elem
+
+        return read_elem(self.group["obs"])
+
+    @property
+    def var(self) -> "pd.DataFrame":
+        from anndata.experimental import read_elem
+
+        return read_elem(self.group["var"])
+
+    def _matrix(self, layer: Optional[str]):
+        return self.group["X"] if layer is None else self.group["layers"][layer]
+
+    def _read_slice(
+        self, axis: int, start: int, stop: int, layer: Optional[str]
+    ) -> Union["np.ndarray", "spmatrix"]:
+        elem = self._matrix(layer)
+        fmt = elem.attrs.get("encoding-type", "array").split("_")[0]
+        if fmt not in ["csr", "csc"]:
+            return elem[start:stop] if axis == 0 else elem[:, start:stop]
+        shape = tuple(elem.attrs["shape"])
+        if (fmt == "csr") == (axis == 0):
+            return _read_sparse_slice(elem, start, stop, shape, fmt)
+        # slicing along the minor axis requires the whole matrix
+        from anndata.experimental import read_elem
+
+        matrix = read_elem(elem)
+        return matrix[start:stop] if axis == 0 else matrix[:, start:stop]
+
+    def read_obs_block(
+        self, start: int, stop: int, layer: Optional[str] = None
+    ) -> Union["np.ndarray", "spmatrix"]:
+        """
+        Reads the expression of cells [start, stop).
+
+        Parameters
+        ----------
+        start
+            Index of the first cell to read
+        stop
+            Index after the last cell to read
+        layer
+            Layer to read from. If None, reads from X.
+        """
+        return self._read_slice(0, start, min(stop, self.n_obs), layer)
+
+    def read_var_block(
+        self, start: int, stop: int, layer: Optional[str] = None
+    ) -> Union["np.ndarray", "spmatrix"]:
+        """
+        Reads the expression of genes [start, stop) across all cells.
+
+        Parameters
+        ----------
+        start
+            Index of the first gene to read
+        stop
+            Index after the last gene to read
+        layer
+            Layer to read from. If None, reads from X.
+        """
+        return self._read_slice(1, start, min(stop, self.n_vars), layer)
+
+    def iter_blocks(
+        self,
+        block_size: int,
+        axis: str = "obs",
+        layer: Optional[str] = None,
+        n_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ) -> Iterator[Tuple[int, int, Union["np.ndarray", "spmatrix"]]]:
+        """
+        Reads the dataset in blocks, in parallel.
+
+        At most ``2 * n_workers`` blocks are read ahead of the consumer, so that a slow
+        consumer does not get the whole dataset read into memory.
+
+        Parameters
+        ----------
+        block_size
+            Number of cells or genes per block
+        axis
+            One of "obs" or "var"
+        layer
+            Layer to read from. If None, reads from X.
+        n_workers
+            Number of threads to read with, if `executor` is not provided, else the number of
+            workers of `executor`. Defaults to the default of
+            :class:`~concurrent.futures.ThreadPoolExecutor`.
+        executor
+            Executor to read with, e.g. a :class:`~concurrent.futures.ProcessPoolExecutor`.
+
+        Yields
+        ------
+        The start and stop indices and content of each block, in order.
+        """
+        if axis not in ["obs", "var"]:
+            raise ValueError(f'Unrecognized axis: {axis}. Must be one of "obs", "var".')
+        n = self.n_obs if axis == "obs" else self.n_vars
+        starts = iter(range(0, n, block_size))
+        if n_workers is None:
+            n_workers = min(32, (os.cpu_count() or 1) + 4)
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+        futures = collections.deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                future = executor.submit(
+                    _read_block, self, axis, start, start + block_size, layer
+                )
+                futures.append((start, future))
+
+        try:
+            for _ in range(2 * n_workers):
+                submit_next()
+            while futures:
+                start, future = futures.popleft()
+                block = future.result()
+                # read the next block while this one is consumed
+                submit_next()
+                yield start, min(start + block_size, n), block
+        finally:
+            # don't read the remaining blocks if the consumer stopped early
+            for _, future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
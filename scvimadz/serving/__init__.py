@@ -0,0 +1,5 @@
+from ._batching import MicroBatcher
+from ._http import make_handler, make_http_server
+from ._server import ModelServer
+
+__all__ = ["ModelServer", "MicroBatcher", "make_handler", "make_http_server"]
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from scvimadz import instrumentation
+
+
+class _Request:
+    def __init__(self, item: Any, size: int) -> None:
+        self.item = item
+        self.size = size
+        self.future = Future()
+
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Merges requests submitted from many threads into batches processed together.
+
+    A worker takes the first pending request and waits up to `batch_window` seconds for more,
+    closing the batch earlier once it holds `max_batch_size` rows. The number of workers bounds
+    the number of batches processed at the same time.
+
+    Parameters
+    ----------
+    fn
+        Function processing a batch, called with the list of items of the batch and returning
+        the list of their results, in order
+    batch_window
+        Maximum time to wait for more requests after the first one of a batch, in seconds
+    max_batch_size
+        Number of rows (e.g. cells) after which a batch is closed
+    max_concurrency
+        Number of batches processed at the same time
+    name
+        Name of the batcher, used in the instrumentation spans
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        batch_window: float = 0.005,
+        max_batch_size: int = 8192,
+        max_concurrency: int = 1,
+        name: Optional[str] = None,
+    ) -> None:
+        self._fn = fn
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self._name = name
+        self._queue = queue.Queue()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(max(max_concurrency, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, item: Any, size: int = 1) -> Future:
+        """
+        Submits an item to be processed in a batch.
+
+        Parameters
+        ----------
+        item
+            The item
+        size
+            Number of rows of the item
+
+        Returns
+        -------
+        A future holding the result of the item.
+        """
+        if self._closed:
+            raise ValueError("The batcher is closed.")
+        request = _Request(item, size)
+        self._queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        """Processes the pending requests, then stops the workers."""
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        batch = [first]
+        n_rows = first.size
+        deadline = time.monotonic() + self._batch_window
+        while n_rows < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # leave it to stop this worker after the batch
+                self._queue.put(_STOP)
+                break
+            batch.append(request)
+            n_rows += request.size
+        return batch
+
+    def _process(self, batch: List[_Request]) -> None:
+        with instrumentation.span(
+            "serving.batch",
+            batcher=self._name,
+            n_requests=len(batch),
+            n_rows=sum(r.size for r in batch),
+        ):
+            results = self._fn([r.item for r in batch])
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+    def _work(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            try:
+                self._process(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].future.set_exception(e)
+                    continue
+                # process the requests one by one, so that only the invalid ones fail
+                for request in batch:
+                    try:
+                        self._process([request])
+                    except Exception as e:
+                        request.future.set_exception(e)
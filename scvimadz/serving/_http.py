@@ -0,0 +1,149 @@
+import json
+import os
+import socketserver
+import stat
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Type
+
+from ._server import ModelServer
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _parse_matrix(payload: dict):
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    X = payload.get("X")
+    if X is None:
+        raise ValueError('The request has no "X".')
+    if isinstance(X, dict):
+        return csr_matrix(
+            (
+                np.asarray(X["data"], dtype=np.float32),
+                np.asarray(X["indices"]),
+                np.asarray(X["indptr"]),
+            ),
+            shape=tuple(X["shape"]),
+        )
+    return np.asarray(X, dtype=np.float32).reshape(len(X), -1)
+
+
+def make_handler(server: ModelServer) -> Type[BaseHTTPRequestHandler]:
+    """
+    Returns the HTTP request handler of the API of the given model server.
+
+    Endpoints:
+
+    - ``GET /models``: the warm models
+    - ``GET /models/<model_id>/genes``: the genes of a model
+    - ``POST /models/<model_id>/latent``: the latent representation of query cells
+    - ``POST /models/<model_id>/annotate``: the latent representation and transferred labels
+
+    Queries are JSON objects with the genes under ``"var_names"``, the expression under
+    ``"X"`` (as a list of rows, or a CSR matrix ``{"data", "indices", "indptr", "shape"}``)
+    and optionally the obs columns under ``"obs"``.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self) -> str:
+            # unix sockets have no client address
+            return str(self.client_address[0]) if self.client_address else "local"
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def _send(self, status: int, body: dict) -> None:
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _route(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if parts[:1] != ["models"]:
+                return None, None
+            return (parts[1] if len(parts) > 1 else None), (
+                parts[2] if len(parts) > 2 else None
+            )
+
+        def do_GET(self) -> None:
+            model_id, action = self._route()
+            try:
+                if self.path.rstrip("/") == "/models":
+                    return self._send(200, {"models": server.get_model_info()})
+                if model_id is not None and action == "genes":
+                    genes = server.get_model_genes(model_id)
+                    return self._send(200, {"genes": genes})
+            except ValueError as e:
+                return self._send(404, {"error": str(e)})
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            model_id, action = self._route()
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if model_id is None or action not in ["latent", "annotate"]:
+                return self._send(404, {"error": f"Unknown path {self.path}"})
+            if model_id not in server.model_ids:
+                return self._send(404, {"error": f"Model {model_id} is not warm."})
+            try:
+                payload = json.loads(body)
+                args = (
+                    model_id,
+                    _parse_matrix(payload),
+                    payload["var_names"],
+                    payload.get("obs"),
+                )
+                if action == "latent":
+                    result = {"latent": server.get_latent_representation(*args)}
+                else:
+                    result = server.annotate(*args)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": str(e)})
+            except Exception as e:
+                return self._send(500, {"error": str(e)})
+            self._send(200, {k: v.tolist() for k, v in result.items()})
+
+    return Handler
+
+
+def make_http_server(
+    server: ModelServer,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: Optional[str] = None,
+) -> socketserver.BaseServer:
+    """
+    Creates an HTTP server exposing the API of the given model server (see :func:`make_handler`).
+
+    Call ``serve_forever`` on the returned server to serve requests, each in its own thread.
+
+    Parameters
+    ----------
+    server
+        The model server
+    host
+        Host to listen on. Defaults to the loopback interface only.
+    port
+        Port to listen on
+    socket_path
+        If provided, listens on this Unix socket instead of `host` and `port`.
+    """
+    handler = make_handler(server)
+    if socket_path is not None:
+        if os.path.lexists(socket_path):
+            # left behind by a previous server, but never remove anything else
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise ValueError(f"{socket_path} exists and is not a socket.")
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    http_server = ThreadingHTTPServer((host, port), handler)
+    http_server.daemon_threads = True
+    return http_server
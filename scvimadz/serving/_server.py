@@ -0,0 +1,324 @@
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Sequence, Union
+
+from scvimadz import instrumentation
+from scvimadz._scvi_compat import release_anndata_manager, validate_anndata
+
+from ._batching import MicroBatcher
+
+if TYPE_CHECKING:
+    import numpy as np
+    from anndata import AnnData
+    from scipy.sparse import spmatrix
+    from scvi.model.base import BaseModelClass
+
+    from scvimadz.reference.base import BaseReference
+
+
+def _query_defaults(model: "BaseModelClass") -> Dict[str, Any]:
+    """Returns the obs columns the model was set up with, with a default value for each."""
+    manager = model.adata_manager
+    defaults = {}
+    for field in manager.data_registry:
+        state = manager.get_state_registry(field)
+        if "original_key" in state and "categorical_mapping" in state:
+            defaults[state["original_key"]] = state["categorical_mapping"][0]
+        elif "field_keys" in state and "mappings" in state:
+            for key in state["field_keys"]:
+                defaults[key] = state["mappings"][key][0]
+        elif "columns" in state:
+            for key in state["columns"]:
+                defaults[key] = 0.0
+    return defaults
+
+
+class _WarmModel:
+    """A loaded model with what is needed to run queries against it."""
+
+    def __init__(
+        self,
+        model_id: str,
+        model: "BaseModelClass",
+        labels_key: Optional[str],
+        n_neighbors: int,
+    ) -> None:
+        import pandas as pd
+
+        self.model_id = model_id
+        self.model = model
+        self.var_names = pd.Index(model.adata.var_names)
+        self.defaults = _query_defaults(model)
+        self.lock = threading.Lock()
+        self.classifier = None
+        if labels_key is not None and labels_key in model.adata.obs:
+            from sklearn.neighbors import KNeighborsClassifier
+
+            with instrumentation.span("serving.reference_latent", model_id=model_id):
+                latent = model.get_latent_representation()
+            self.classifier = KNeighborsClassifier(n_neighbors=n_neighbors)
+            self.classifier.fit(latent, model.adata.obs[labels_key].astype(str))
+
+    def align(
+        self, X: Union["np.ndarray", "spmatrix"], var_names: Sequence[str]
+    ) -> "spmatrix":
+        """Reorders the genes of the query to the model's, with zeros for missing genes."""
+        import numpy as np
+        from scipy.sparse import csr_matrix
+
+        target = self.var_names.get_indexer(var_names)
+        found = target >= 0
+        if not found.any():
+            raise ValueError(f"The query shares no genes with model {self.model_id}.")
+        source = np.flatnonzero(found)
+        # (query genes x model genes) selection matrix
+        selection = csr_matrix(
+            (np.ones(len(source), dtype=np.float32), (source, target[found])),
+            shape=(len(var_names), len(self.var_names)),
+        )
+        return csr_matrix(csr_matrix(X, dtype=np.float32) @ selection)
+
+    def make_anndata(self, X: "spmatrix", obs: "Any") -> "AnnData":
+        import anndata
+
+        adata = anndata.AnnData(X=X, obs=obs)
+        adata.var_names = self.var_names
+        x_field = self.model.adata_manager.data_registry["X"]
+        if x_field["attr_name"] == "layers":
+            adata.layers[x_field["attr_key"]] = X
+        return adata
+
+
+class ModelServer:
+    """
+    Keeps a set of zoo models warm in memory and runs queries against them in batches.
+
+    Queries sent at about the same time to the same model are merged into a single batch for
+    the model's encoder. Models are loaded on the CPU.
+
+    Parameters
+    ----------
+    reference
+        The reference to load the models from
+    model_ids
+        ids of the models to keep warm. If None, keeps all models of the reference warm.
+    batch_window
+        Maximum time to wait for more queries to merge into a batch, in seconds
+    max_batch_size
+        Number of cells after which a batch is closed
+    max_concurrency
+        Number of batches run at the same time for each model
+    labels_key
+        Column of the models' training data ``obs`` with the labels to transfer to queries with
+        :meth:`annotate`. The latent representation of the training data is kept warm to do so.
+    n_neighbors
+        Number of reference cells used to transfer labels
+    n_threads
+        Number of threads used by torch. If None, uses the default of torch.
+    """
+
+    def __init__(
+        self,
+        reference: "BaseReference",
+        model_ids: Optional[Sequence[str]] = None,
+        batch_window: float = 0.005,
+        max_batch_size: int = 8192,
+        max_concurrency: int = 1,
+        labels_key: Optional[str] = None,
+        n_neighbors: int = 15,
+        n_threads: Optional[int] = None,
+    ) -> None:
+        if n_threads is not None:
+            import torch
+
+            torch.set_num_threads(n_threads)
+        self._reference = reference
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self._max_concurrency = max_concurrency
+        self._labels_key = labels_key
+        self._n_neighbors = n_neighbors
+        self._models: Dict[str, _WarmModel] = {}
+        self._batchers: Dict[str, MicroBatcher] = {}
+        self._lock = threading.Lock()
+        if model_ids is None:
+            model_ids = reference.get_models_df().index.to_list()
+        for model_id in model_ids:
+            self.add_model(model_id)
+
+    @property
+    def model_ids(self) -> List[str]:
+        """ids of the warm models."""
+        return list(self._models)
+
+    def add_model(self, model_id: str) -> None:
+        """
+        Loads the given model and keeps it warm.
+
+        Parameters
+        ----------
+        model_id
+            id of the model to load
+        """
+        with self._lock:
+            if model_id in self._models:
+                return
+            with instrumentation.span("serving.warm_model", model_id=model_id):
+                model = self._reference.load_model(model_id, use_gpu=False)
+                warm = _WarmModel(model_id, model, self._labels_key, self._n_neighbors)
+            self._models[model_id] = warm
+            self._batchers[model_id] = MicroBatcher(
+                lambda queries: self._run(warm, queries),
+                batch_window=self._batch_window,
+                max_batch_size=self._max_batch_size,
+                max_concurrency=self._max_concurrency,
+                name=model_id,
+            )
+
+    def remove_model(self, model_id: str) -> None:
+        """
+        Stops keeping the given model warm, after running its pending queries.
+
+        Parameters
+        ----------
+        model_id
+            id of the model to remove
+        """
+        with self._lock:
+            batcher = self._batchers.pop(model_id, None)
+            self._models.pop(model_id, None)
+        if batcher is not None:
+            batcher.close()
+
+    def close(self) -> None:
+        """Removes all models, after running their pending queries."""
+        for model_id in self.model_ids:
+            self.remove_model(model_id)
+
+    def get_model_info(self) -> List[dict]:
+        """Returns the id, number of genes and capabilities of each warm model."""
+        return [
+            {
+                "model_id": warm.model_id,
+                "class_name": type(warm.model).__name__,
+                "n_genes": len(warm.var_names),
+                "can_annotate": warm.classifier is not None,
+            }
+            for warm in self._models.values()
+        ]
+
+    def get_model_genes(self, model_id: str) -> List[str]:
+        """Returns the genes of the given warm model, in the order queries are aligned to."""
+        return self._get_warm(model_id).var_names.to_list()
+
+    def _get_warm(self, model_id: str) -> _WarmModel:
+        if model_id not in self._models:
+            raise ValueError(f"Model {model_id} is not warm.")
+        return self._models[model_id]
+
+    def _run(self, warm: _WarmModel, queries: List[dict]) -> List[dict]:
+        import numpy as np
+        import pandas as pd
+        from scipy.sparse import vstack
+
+        X = vstack([q["X"] for q in queries], format="csr")
+        obs = pd.concat([q["obs"] for q in queries], ignore_index=True)
+        obs.index = obs.index.astype(str)
+        adata = warm.make_anndata(X, obs)
+        # the model is not thread-safe while it sets up the query
+        with warm.lock:
+            validate_anndata(warm.model, adata)
+        try:
+            latent = warm.model.get_latent_representation(adata)
+        finally:
+            # the model keeps the manager of each AnnData it saw, which would otherwise grow
+            # by one per batch for the lifetime of the server
+            with warm.lock:
+                release_anndata_manager(warm.model, adata)
+        labels = confidence = None
+        if any(q["annotate"] for q in queries):
+            probabilities = warm.classifier.predict_proba(latent)
+            labels = warm.classifier.classes_[probabilities.argmax(axis=1)]
+            confidence = probabilities.max(axis=1)
+        results = []
+        offsets = np.cumsum([0] + [q["X"].shape[0] for q in queries])
+        for q, start, stop in zip(queries, offsets[:-1], offsets[1:]):
+            result = {"latent": latent[start:stop]}
+            if q["annotate"]:
+                result["labels"] = labels[start:stop]
+                result["confidence"] = confidence[start:stop]
+            results.append(result)
+        return results
+
+    def _query(
+        self,
+        model_id: str,
+        X: Union["np.ndarray", "spmatrix"],
+        var_names: Sequence[str],
+        obs: Optional[Mapping[str, Sequence]],
+        annotate: bool,
+    ) -> dict:
+        import pandas as pd
+
+        warm = self._get_warm(model_id)
+        if annotate and warm.classifier is None:
+            raise ValueError(f"Model {model_id} can not annotate queries.")
+        if X.shape[1] != len(var_names):
+            raise ValueError("The number of genes of X does not match var_names.")
+        X = warm.align(X, var_names)
+        obs = pd.DataFrame(dict(obs or {}), index=range(X.shape[0]))
+        for key, default in warm.defaults.items():
+            if key not in obs:
+                obs[key] = default
+        query = {"X": X, "obs": obs, "annotate": annotate}
+        return self._batchers[model_id].submit(query, X.shape[0]).result()
+
+    def get_latent_representation(
+        self,
+        model_id: str,
+        X: Union["np.ndarray", "spmatrix"],
+        var_names: Sequence[str],
+        obs: Optional[Mapping[str, Sequence]] = None,
+    ) -> "np.ndarray":
+        """
+        Returns the latent representation of the query cells.
+
+        Parameters
+        ----------
+        model_id
+            id of the warm model
+        X
+            Expression of the query cells
+        var_names
+            Genes of the columns of X. Genes unknown to the model are ignored, and genes of the
+            model missing from the query are zero.
+        obs
+            Columns the model was set up with (e.g. batch or covariates), by name. Missing
+            columns default to the first category seen in training (or zero if continuous).
+
+        Returns
+        -------
+        The latent representation of the query cells.
+        """
+        return self._query(model_id, X, var_names, obs, annotate=False)["latent"]
+
+    def annotate(
+        self,
+        model_id: str,
+        X: Union["np.ndarray", "spmatrix"],
+        var_names: Sequence[str],
+        obs: Optional[Mapping[str, Sequence]] = None,
+    ) -> Dict[str, "np.ndarray"]:
+        """
+        Transfers the labels of the reference cells to the query cells by nearest neighbors in the latent space.
+
+        Parameters
+        ----------
+        model_id, X, var_names, obs
+            See :meth:`get_latent_representation`
+
+        Returns
+        -------
+        The latent representation, labels and label confidence (fraction of agreeing neighbors)
+        of the query cells, under "latent", "labels" and "confidence".
+        """
+        return self._query(model_id, X, var_names, obs, annotate=True)
@@ -1,4 +1,23 @@
+from ._content_store import ContentStore
+from ._federated import FederatedStorage
+from ._integrity import IntegrityReport, verify_local_files
+from ._local_cache import cache_size, file_checksum, prune_cache
+from ._manifest import ManifestDiff, RecordManifest
+from ._s3 import S3Storage
 from ._zenodo import ZenodoStorage
 from .base import FileToUpload
 
-__all__ = ["ZenodoStorage", "FileToUpload"]
+__all__ = [
+    "ContentStore",
+    "FederatedStorage",
+    "IntegrityReport",
+    "ManifestDiff",
+    "RecordManifest",
+    "S3Storage",
+    "ZenodoStorage",
+    "FileToUpload",
+    "cache_size",
+    "prune_cache",
+    "file_checksum",
+    "verify_local_files",
+]
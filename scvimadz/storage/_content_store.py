@@ -0,0 +1,259 @@
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import threading
+from typing import List, Optional
+
+from scvimadz import instrumentation
+
+from ._local_cache import file_checksum
+
+_CONTENT_STORE_ENV_VAR = "SCVIMADZ_CONTENT_STORE"
+# ioctl request cloning a whole file, see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str) -> bool:
+    """Makes `dest` a copy-on-write clone of `src`, if the OS and filesystem support it."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            pass
+        else:
+            return True
+    os.remove(dest)
+    return False
+
+
+class ContentStore:
+    """
+    Directory holding a single copy of each downloaded file, keyed by the file's checksum.
+
+    Storages given a content store download each file into it once, then link it into their
+    `data_dir` instead of downloading it again. That way, references with different
+    `data_dir` on the same node share one copy of each artifact on disk.
+
+    Files are linked with a reflink (a copy-on-write clone) where the filesystem supports it,
+    else with a hard link, and they are copied if the content store is on another filesystem.
+    Files in the content store are read-only, so that hard-linked copies can not be modified
+    in place.
+
+    Each link is recorded under ``refs/`` with the inode of the linked file, so that
+    :meth:`collect_garbage` keeps the files that are still linked, whichever way they were
+    linked, and removes the ones whose links were all removed or replaced.
+
+    Parameters
+    ----------
+    root
+        Absolute path to the directory of the content store. It is created if it does not
+        exist.
+    """
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ContentStore"]:
+        """Returns the content store at the path of the ``SCVIMADZ_CONTENT_STORE`` environment variable, if it is set."""
+        root = os.environ.get(_CONTENT_STORE_ENV_VAR)
+        return cls(root) if root else None
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def path(self, checksum: str) -> str:
+        """
+        Returns the path of the file with the given checksum in the content store.
+
+        Parameters
+        ----------
+        checksum
+            Checksum of the file, in the ``"<algorithm>:<digest>"`` format
+        """
+        algorithm, _, digest = checksum.partition(":")
+        digest = digest.strip('"')
+        if not digest or os.sep in digest or os.sep in algorithm:
+            raise ValueError(f"Invalid checksum: {checksum}")
+        return os.path.join(self._root, "objects", algorithm, digest[:2], digest)
+
+    def _refs_dir(self, object_path: str) -> str:
+        """Returns the directory recording the links of the given object."""
+        relpath = os.path.relpath(object_path, os.path.join(self._root, "objects"))
+        return os.path.join(self._root, "refs", relpath)
+
+    def contains(self, checksum: str) -> bool:
+        """Whether the content store holds the file with the given checksum."""
+        return os.path.isfile(self.path(checksum))
+
+    def add(self, path: str, checksum: str, verify: bool = True) -> str:
+        """
+        Moves the given file into the content store.
+
+        Parameters
+        ----------
+        path
+            Path of the file to add. The file is moved, not copied.
+        checksum
+            Checksum of the file, in the ``"<algorithm>:<digest>"`` format
+        verify
+            Whether to check that the file matches the checksum first, if the algorithm is
+            supported by :mod:`hashlib`. If it does not, the file is removed and an error is
+            raised.
+
+        Returns
+        -------
+        The path of the file in the content store.
+        """
+        algorithm = checksum.split(":")[0]
+        if verify and algorithm in hashlib.algorithms_available:
+            if file_checksum(path, algorithm) != checksum:
+                os.remove(path)
+                raise ValueError(f"The file does not match checksum {checksum}.")
+        object_path = self.path(checksum)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # move to a temporary file next to the object first, so that an object is never
+        # partially written, even if the content store is on another filesystem
+        tmp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.move(path, tmp_path)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, object_path)
+        instrumentation.count("content_store.added_files", checksum=checksum)
+        return object_path
+
+    def link(self, checksum: str, dest: str) -> str:
+        """
+        Links the file with the given checksum in the content store to `dest`.
+
+        Parameters
+        ----------
+        checksum
+            Checksum of the file, in the ``"<algorithm>:<digest>"`` format
+        dest
+            Path to link the file to. An existing file at this path is replaced.
+
+        Returns
+        -------
+        How the file was linked, one of "reflink", "hardlink" or "copy".
+        """
+        object_path = self.path(checksum)
+        if not os.path.isfile(object_path):
+            raise ValueError(f"No file with checksum {checksum} in the content store.")
+        tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if _reflink(object_path, tmp_path):
+            method = "reflink"
+        else:
+            try:
+                os.link(object_path, tmp_path)
+                method = "hardlink"
+            except OSError as e:
+                if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+                shutil.copyfile(object_path, tmp_path)
+                method = "copy"
+        os.replace(tmp_path, dest)
+        if os.path.lexists(tmp_path):
+            # rename(2) does nothing when dest is already a hard link to the same object
+            os.remove(tmp_path)
+        self._add_reference(object_path, dest)
+        instrumentation.count("content_store.linked_files", method=method)
+        return method
+
+    def _add_reference(self, object_path: str, dest: str) -> None:
+        """Records that `dest` was linked from the given object."""
+        dest = os.path.abspath(dest)
+        refs_dir = self._refs_dir(object_path)
+        os.makedirs(refs_dir, exist_ok=True)
+        # one file per link, written atomically, so that concurrent links never collide
+        ref_path = os.path.join(refs_dir, hashlib.sha1(dest.encode()).hexdigest())
+        tmp_path = f"{ref_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{os.stat(dest).st_ino}\n{dest}")
+        os.replace(tmp_path, ref_path)
+
+    def references(self, checksum: str) -> List[str]:
+        """
+        Returns the paths that the file with the given checksum is still linked to.
+
+        Links whose path was removed, or replaced by another file, are forgotten.
+
+        Parameters
+        ----------
+        checksum
+            Checksum of the file, in the ``"<algorithm>:<digest>"`` format
+        """
+        return self._references(self.path(checksum))
+
+    def _references(self, object_path: str) -> List[str]:
+        refs_dir = self._refs_dir(object_path)
+        if not os.path.isdir(refs_dir):
+            return []
+        references = []
+        for name in os.listdir(refs_dir):
+            ref_path = os.path.join(refs_dir, name)
+            if name.endswith(".tmp"):
+                continue
+            try:
+                with open(ref_path) as f:
+                    inode, dest = f.read().split("\n", 1)
+                live = os.stat(dest).st_ino == int(inode)
+            except (OSError, ValueError):
+                live = False
+            if live:
+                references.append(dest)
+            else:
+                try:
+                    os.remove(ref_path)
+                except FileNotFoundError:
+                    pass
+        return references
+
+    def discard(self, checksum: str) -> None:
+        """Removes the file with the given checksum from the content store, if it holds it."""
+        object_path = self.path(checksum)
+        if os.path.isfile(object_path):
+            os.remove(object_path)
+        shutil.rmtree(self._refs_dir(object_path), ignore_errors=True)
+
+    def collect_garbage(self, dry_run: bool = False) -> List[str]:
+        """
+        Removes the files that are not linked into any `data_dir` anymore.
+
+        Files are kept while any path they were linked to still holds the linked file, or
+        while they are hard-linked, which also covers files linked before links were
+        recorded.
+
+        Parameters
+        ----------
+        dry_run
+            If True, only returns the files that would be removed.
+
+        Returns
+        -------
+        The paths of the removed files.
+        """
+        removed = []
+        for root, _, files in os.walk(os.path.join(self._root, "objects")):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    # being added by another process
+                    continue
+                if os.stat(path).st_nlink > 1 or self._references(path):
+                    continue
+                if not dry_run:
+                    os.remove(path)
+                    shutil.rmtree(self._refs_dir(path), ignore_errors=True)
+                removed.append(path)
+        instrumentation.count(
+            "content_store.collected_files", len(removed), dry_run=dry_run
+        )
+        return removed
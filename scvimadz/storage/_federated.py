@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from scvimadz import instrumentation
+
+from ._content_store import ContentStore
+from ._zenodo import ZenodoStorage
+from .base import BaseStorage, FileToUpload
+
+
+class FederatedStorage(BaseStorage):
+    """
+    Storage presenting the files of many storages (e.g. one Zenodo record per tissue or lab) as one.
+
+    The storages are listed concurrently, and the resulting routing table from each key to the
+    storage that owns it is cached, so that downloads go straight to the owning storage. Keys
+    of CSV files present in several storages (e.g. the models or datasets metadata) are merged
+    into a single catalog. Other keys present in several storages are served by the first
+    storage that has them.
+
+    Parameters
+    ----------
+    stores
+        The storages to federate, in order of priority
+    data_dir
+        Absolute path to the directory that merged files are written to.
+    write_store
+        Storage that uploads go to. If None, uploading files raises an error.
+    cache_ttl
+        Number of seconds the routing table is cached for before listing the storages again.
+        If None, it is only listed again by :meth:`refresh`.
+    max_workers
+        Number of storages listed, or files downloaded, in parallel
+    """
+
+    def __init__(
+        self,
+        stores: Sequence[BaseStorage],
+        data_dir: str,
+        write_store: Optional[BaseStorage] = None,
+        cache_ttl: Optional[float] = 300.0,
+        max_workers: int = 8,
+    ) -> None:
+        if not stores:
+            raise ValueError("At least one storage must be provided.")
+        if not os.path.isdir(data_dir):
+            raise ValueError(f"Error: {data_dir} is not a valid directory")
+        self._stores = list(stores)
+        self._data_dir = data_dir
+        self._write_store = write_store
+        self._cache_ttl = cache_ttl
+        self._max_workers = max_workers
+        self._routes: Optional[Dict[str, List[int]]] = None
+        self._listed_at = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # the lock can not be pickled, it is recreated in the new process
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_zenodo_records(
+        cls,
+        record_ids: Sequence[str],
+        data_dir: str,
+        write_record_id: Optional[str] = None,
+        offline: Optional[bool] = None,
+        content_store: Optional[ContentStore] = None,
+        **kwargs,
+    ) -> "FederatedStorage":
+        """
+        Federates the given Zenodo records.
+
+        Parameters
+        ----------
+        record_ids
+            Ids of the Zenodo records, in order of priority
+        data_dir
+            Absolute path to the directory that will be used to download data to. The files of
+            each record are downloaded to a subdirectory named after the record id, since
+            records may have files with the same key (e.g. the metadata files).
+        write_record_id
+            Id of the record that uploads go to, if any. It is federated too.
+        offline, content_store
+            See :class:`~scvimadz.storage.ZenodoStorage`
+        **kwargs
+            Keyword arguments of :class:`FederatedStorage`
+        """
+        stores = {}
+        for record_id in list(record_ids) + [write_record_id]:
+            if record_id is None or record_id in stores:
+                continue
+            record_dir = os.path.join(data_dir, record_id)
+            os.makedirs(record_dir, exist_ok=True)
+            stores[record_id] = ZenodoStorage(
+                record_id, record_dir, offline=offline, content_store=content_store
+            )
+        write_store = stores[write_record_id] if write_record_id is not None else None
+        return cls(list(stores.values()), data_dir, write_store=write_store, **kwargs)
+
+    @property
+    def stores(self) -> List[BaseStorage]:
+        return self._stores
+
+    @property
+    def data_dir(self) -> str:
+        return self._data_dir
+
+    @property
+    def etag(self) -> Optional[str]:
+        """ETags of the storages joined, or None if any of them has none."""
+        etags = [getattr(s, "etag", None) for s in self._stores]
+        return None if None in etags else ",".join(etags)
+
+    def refresh(self) -> None:
+        """Lists all the storages again, concurrently, and rebuilds the routing table."""
+        self._refresh_routes()
+
+    def _refresh_routes(self) -> Dict[str, List[int]]:
+        """Rebuilds the routing table and returns it, even if an upload invalidates it meanwhile."""
+        with instrumentation.span("federated.list", n_stores=len(self._stores)):
+            with ThreadPoolExecutor(
+                max_workers=min(len(self._stores), self._max_workers)
+            ) as executor:
+                listings = list(executor.map(lambda s: s.list_keys(), self._stores))
+        routes = {}
+        for i, keys in enumerate(listings):
+            for key in keys:
+                routes.setdefault(key, []).append(i)
+        with self._lock:
+            self._routes = routes
+            self._listed_at = time.monotonic()
+        return routes
+
+    def _get_routes(self) -> Dict[str, List[int]]:
+        with self._lock:
+            routes = self._routes
+            expired = (
+                self._cache_ttl is not None
+                and time.monotonic() - self._listed_at > self._cache_ttl
+            )
+        if routes is None or expired:
+            return self._refresh_routes()
+        instrumentation.count("federated.routes_cache_hits")
+        return routes
+
+    def owners(self, key: str) -> List[BaseStorage]:
+        """
+        Returns the storages that have the given key, in order of priority.
+
+        Parameters
+        ----------
+        key
+            The key to look up
+        """
+        routes = self._get_routes()
+        if key not in routes:
+            # the key may have been added since the storages were listed
+            routes = self._refresh_routes()
+        if key not in routes:
+            raise ValueError(f"Key {key} not found.")
+        return [self._stores[i] for i in routes[key]]
+
+    def list_keys(self) -> List[str]:
+        """Returns all keys in the federated storages."""
+        return list(self._get_routes())
+
+    def _merge_csv_files(self, key: str, stores: List[BaseStorage]) -> str:
+        import pandas as pd
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(stores), self._max_workers)
+        ) as executor:
+            paths = list(executor.map(lambda s: s.download_file(key), stores))
+        df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+        merged_path = os.path.join(self._data_dir, ".scvimadz", "federated", key)
+        os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+        tmp_path = f"{merged_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, merged_path)
+        return merged_path
+
+    def download_file(self, key: str) -> str:
+        """
+        Downloads the file with the given id from the storage that owns it, else raises an error.
+
+        If several storages have the given CSV file, downloads all of them and returns the path
+        to their rows merged into one file, under ``<data_dir>/.scvimadz/federated/``.
+
+        Parameters
+        ----------
+        key
+            key of the file to download
+
+        Returns
+        -------
+        The full path to the downloaded file.
+        """
+        stores = self.owners(key)
+        if len(stores) > 1 and key.endswith(".csv"):
+            return self._merge_csv_files(key, stores)
+        return stores[0].download_file(key)
+
+    def upload_files(
+        self,
+        files: List[FileToUpload],
+        token: Optional[str],
+        ok_to_reversion_datastore: Optional[bool],
+        delete_keys: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Uploads the given files to the write storage.
+
+        Parameters
+        ----------
+        files
+            List of files to upload.
+        token
+            Access token of the write storage, if applicable.
+        ok_to_reversion_datastore
+            Whether it is ok to bump the version of the write storage, if applicable.
+        delete_keys
+            Keys of files to delete from the write storage, once all uploads succeed.
+        """
+        if self._write_store is None:
+            raise ValueError("Uploading files requires a write storage.")
+        self._write_store.upload_files(
+            files, token, ok_to_reversion_datastore, delete_keys=delete_keys
+        )
+        # the keys of the uploaded files are routed after the next listing
+        with self._lock:
+            self._routes = None
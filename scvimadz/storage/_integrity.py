@@ -0,0 +1,218 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+
+from scvimadz import instrumentation
+
+from ._local_cache import file_checksum
+from .base import BaseStorage
+
+_QUARANTINE_DIR = os.path.join(".scvimadz", "quarantine")
+_REPORT_FIELDS = ["verified", "corrupted", "repaired", "failed", "quarantined"]
+
+
+class IntegrityReport:
+    """
+    Outcome of verifying the local copies of the files of a storage.
+
+    Parameters
+    ----------
+    verified
+        Keys whose local copy was checked
+    corrupted
+        Keys whose local copy did not match its checksum, and was quarantined
+    repaired
+        Corrupted keys that were downloaded again and now match their checksum
+    failed
+        Corrupted keys that could not be downloaded again, or still mismatch after it
+    quarantined
+        Paths the corrupted local copies were moved to
+    """
+
+    def __init__(
+        self,
+        verified: List[str],
+        corrupted: List[str],
+        repaired: List[str],
+        failed: List[str],
+        quarantined: Optional[List[str]] = None,
+    ) -> None:
+        self._verified = verified
+        self._corrupted = corrupted
+        self._repaired = repaired
+        self._failed = failed
+        self._quarantined = quarantined if quarantined is not None else []
+
+    @property
+    def verified(self) -> List[str]:
+        return self._verified
+
+    @property
+    def corrupted(self) -> List[str]:
+        return self._corrupted
+
+    @property
+    def repaired(self) -> List[str]:
+        return self._repaired
+
+    @property
+    def failed(self) -> List[str]:
+        return self._failed
+
+    @property
+    def quarantined(self) -> List[str]:
+        return self._quarantined
+
+    @property
+    def ok(self) -> bool:
+        """Whether all the local copies match their checksum, after repairs."""
+        return len(self._corrupted) == len(self._repaired)
+
+    def __repr__(self) -> str:
+        return (
+            f"IntegrityReport(verified={len(self._verified)}, "
+            f"corrupted={self._corrupted}, repaired={self._repaired}, "
+            f"failed={self._failed})"
+        )
+
+
+def find_corrupted_files(
+    files: List[Tuple[str, str, str]], max_workers: int = 4
+) -> List[str]:
+    """
+    Hashes the given files in parallel and returns the keys of those that mismatch their checksum.
+
+    Parameters
+    ----------
+    files
+        (key, path, checksum) of each file, with checksums in the ``"<algorithm>:<hexdigest>"``
+        format
+    max_workers
+        Number of files hashed in parallel
+    """
+
+    def check(item):
+        key, path, checksum = item
+        algorithm = checksum.split(":")[0]
+        with instrumentation.span("integrity.hash_file", key=key):
+            return file_checksum(path, algorithm) == checksum
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        matches = list(executor.map(check, files))
+    return [key for (key, _, _), match in zip(files, matches) if not match]
+
+
+def quarantine_file(data_dir: str, key: str) -> str:
+    """
+    Moves the local copy of the given key out of the way, to ``<data_dir>/.scvimadz/quarantine/``.
+
+    Returns
+    -------
+    The path of the quarantined file.
+    """
+    quarantine_dir = os.path.join(data_dir, _QUARANTINE_DIR)
+    os.makedirs(quarantine_dir, exist_ok=True)
+    path = os.path.join(quarantine_dir, f"{key}.{time.time_ns()}")
+    os.replace(os.path.join(data_dir, key), path)
+    instrumentation.count("integrity.quarantined_files", key=key)
+    return path
+
+
+def verify_local_files(
+    store: BaseStorage,
+    keys: Optional[List[str]] = None,
+    repair: bool = True,
+    max_workers: int = 4,
+) -> IntegrityReport:
+    """
+    Verifies the files already downloaded from the given storage against the checksums of its record.
+
+    Files are hashed in parallel. Corrupted files (e.g. truncated by a killed job) are moved to
+    ``<data_dir>/.scvimadz/quarantine/`` for inspection, and only those are downloaded again.
+    Files that were never downloaded are not checked.
+
+    Parameters
+    ----------
+    store
+        The storage, which must provide checksums (``list_checksums``) and its ``data_dir``.
+        The storages of a :class:`~scvimadz.storage.FederatedStorage` are verified one by one.
+    keys
+        Keys to verify. If None, verifies all the keys of the storage.
+    repair
+        Whether to download the corrupted files again
+    max_workers
+        Number of files hashed or downloaded in parallel
+
+    Returns
+    -------
+    The outcome of the verification.
+    """
+    if hasattr(store, "stores"):
+        # federated storages are verified storage by storage, in their own data_dir
+        reports = [
+            verify_local_files(
+                s,
+                keys=None if keys is None else list(set(keys) & set(s.list_keys())),
+                repair=repair,
+                max_workers=max_workers,
+            )
+            for s in store.stores
+        ]
+        return IntegrityReport(
+            *(sum((getattr(r, field) for r in reports), []) for field in _REPORT_FIELDS)
+        )
+    if not hasattr(store, "list_checksums"):
+        raise ValueError(f"{type(store).__name__} does not provide checksums.")
+    checksums = store.list_checksums()
+    if keys is None:
+        keys = list(checksums)
+    data_dir = store.data_dir
+    to_check = []
+    for key in keys:
+        if key not in checksums:
+            raise ValueError(f"Key {key} not found.")
+        path = os.path.join(data_dir, key)
+        if os.path.isfile(path):
+            to_check.append((key, path, checksums[key]))
+    with instrumentation.span("integrity.verify", n_files=len(to_check)):
+        corrupted = find_corrupted_files(to_check, max_workers)
+    # the content store may hold the corrupted copy the local files were linked from
+    content_store = getattr(store, "content_store", None)
+    quarantined = []
+    for key in corrupted:
+        quarantined.append(quarantine_file(data_dir, key))
+        if content_store is not None:
+            content_store.discard(checksums[key])
+    repaired, failed = [], []
+    if repair and corrupted:
+
+        def fetch(key):
+            try:
+                return store.download_file(key)
+            except (ValueError, OSError, requests.RequestException) as e:
+                print(f"Failed to download {key} again. Error: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            paths = list(executor.map(fetch, corrupted))
+        fetched = [
+            (key, path, checksums[key])
+            for key, path in zip(corrupted, paths)
+            if path is not None
+        ]
+        still_corrupted = find_corrupted_files(fetched, max_workers)
+        for key in still_corrupted:
+            quarantined.append(quarantine_file(data_dir, key))
+        for key, path in zip(corrupted, paths):
+            if path is None or key in still_corrupted:
+                failed.append(key)
+            else:
+                repaired.append(key)
+    elif not repair:
+        failed = list(corrupted)
+    return IntegrityReport(
+        [key for key, _, _ in to_check], corrupted, repaired, failed, quarantined
+    )
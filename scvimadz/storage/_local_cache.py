@@ -0,0 +1,177 @@
+import hashlib
+import mmap
+import os
+import shutil
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from ._content_store import ContentStore
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_checksum(path: str, algorithm: str = "md5") -> str:
+    """
+    Computes the checksum of the given file, in the ``"<algorithm>:<hexdigest>"`` format used by Zenodo.
+
+    Parameters
+    ----------
+    path
+        Path to the file
+    algorithm
+        Name of the hashing algorithm, as understood by :func:`hashlib.new`
+
+    Returns
+    -------
+    The checksum of the file.
+    """
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can not be memory-mapped
+            return f"{algorithm}:{h.hexdigest()}"
+        # hashing the mapped pages directly avoids copying the file into Python buffers,
+        # and hashlib releases the GIL, so that files can be hashed in parallel threads
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, "madvise"):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(m) as view:
+                for start in range(0, len(view), _HASH_CHUNK_SIZE):
+                    h.update(view[start : start + _HASH_CHUNK_SIZE])
+    return f"{algorithm}:{h.hexdigest()}"
+
+
+def _entry_files(path: str) -> Dict[Tuple[int, int], int]:
+    """Returns the size of each distinct file under `path`, keyed by (device, inode)."""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(root, name)
+            for root, _, files in os.walk(path)
+            for name in files
+        ]
+    files = {}
+    for file_path in paths:
+        stat = os.stat(file_path)
+        # hard links to the same file are counted once
+        files[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return files
+
+
+def _entry_last_access(path: str) -> float:
+    stat = os.stat(path)
+    # atime may not be updated on filesystems mounted with noatime, so we also consider mtime
+    return max(stat.st_atime, stat.st_mtime)
+
+
+def _is_data_dir(path: str) -> bool:
+    # the data_dir of each storage of a federated storage has its own snapshots
+    return os.path.isdir(os.path.join(path, ".scvimadz"))
+
+
+def _cache_entries(
+    data_dir: str,
+) -> List[Tuple[str, Dict[Tuple[int, int], int], float]]:
+    """
+    Returns (path, files, last access time) for all top level entries in `data_dir`, ignoring hidden ones.
+
+    `files` holds the size of each distinct file of the entry, see :func:`_entry_files`.
+
+    The data_dirs of the storages of a federated storage are listed entry by entry too, so that
+    their snapshots under ``.scvimadz/`` are never removed. Empty directories are ignored.
+    """
+    entries = []
+    for name in os.listdir(data_dir):
+        if name.startswith("."):
+            continue
+        path = os.path.join(data_dir, name)
+        if _is_data_dir(path):
+            entries += _cache_entries(path)
+        elif not (os.path.isdir(path) and not os.listdir(path)):
+            entries.append((path, _entry_files(path), _entry_last_access(path)))
+    return entries
+
+
+def cache_size(data_dir: str) -> int:
+    """
+    Returns the total size in bytes of the files downloaded to `data_dir`.
+
+    Files hard-linked several times into `data_dir`, e.g. from a
+    :class:`~scvimadz.storage.ContentStore`, are counted once.
+
+    Parameters
+    ----------
+    data_dir
+        The directory that storages download files to
+    """
+    files = {}
+    for _, entry_files, _ in _cache_entries(data_dir):
+        files.update(entry_files)
+    return sum(files.values())
+
+
+def prune_cache(
+    data_dir: str,
+    max_size: Optional[int] = None,
+    max_age: Optional[float] = None,
+    dry_run: bool = False,
+    content_store: Optional["ContentStore"] = None,
+) -> List[str]:
+    """
+    Removes files from `data_dir`, least recently used first.
+
+    Files hard-linked several times into `data_dir` only count towards its size until their
+    last link is removed. The disk space of files linked from a content store is only freed
+    once the content store removes them too, which is why its garbage is collected after
+    pruning when `content_store` is provided.
+
+    Parameters
+    ----------
+    data_dir
+        The directory that storages download files to
+    max_size
+        If provided, least recently used entries are removed until the total size is at most this many bytes.
+    max_age
+        If provided, entries that were not used in the last `max_age` seconds are removed.
+    dry_run
+        If True, only returns the entries that would be removed.
+    content_store
+        If provided, the content store that files were linked from. The files that are not
+        linked into any `data_dir` anymore after pruning are removed from it. With
+        `dry_run`, the entries that would be removed still hold their links, so only the
+        files of the content store that are already unlinked are returned.
+
+    Returns
+    -------
+    The paths of the removed entries, followed by those of the files removed from the
+    content store.
+    """
+    if max_size is None and max_age is None:
+        raise ValueError("At least one of max_size, max_age must be provided.")
+    entries = sorted(_cache_entries(data_dir), key=lambda e: e[2])
+    # number of entries holding a link to each file, and its size
+    n_links = Counter(key for _, files, _ in entries for key in files)
+    sizes = {key: size for _, files, _ in entries for key, size in files.items()}
+    total_size = sum(sizes.values())
+    now = time.time()
+    removed = []
+    for path, files, last_access in entries:
+        too_old = max_age is not None and now - last_access > max_age
+        too_big = max_size is not None and total_size > max_size
+        if not (too_old or too_big):
+            continue
+        if not dry_run:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        for key, size in files.items():
+            n_links[key] -= 1
+            if n_links[key] == 0:
+                total_size -= size
+        removed.append(path)
+    if content_store is not None:
+        removed += content_store.collect_garbage(dry_run=dry_run)
+    return removed
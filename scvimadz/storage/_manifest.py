@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class ManifestDiff:
+    """
+    Changes between two snapshots of a storage record.
+
+    Parameters
+    ----------
+    added
+        Keys only in the new snapshot
+    removed
+        Keys only in the old snapshot
+    changed
+        Keys in both snapshots, whose checksum changed
+    """
+
+    def __init__(
+        self, added: List[str], removed: List[str], changed: List[str]
+    ) -> None:
+        self._added = added
+        self._removed = removed
+        self._changed = changed
+
+    @property
+    def added(self) -> List[str]:
+        return self._added
+
+    @property
+    def removed(self) -> List[str]:
+        return self._removed
+
+    @property
+    def changed(self) -> List[str]:
+        return self._changed
+
+    def __bool__(self) -> bool:
+        return bool(self._added or self._removed or self._changed)
+
+    def __repr__(self) -> str:
+        return (
+            f"ManifestDiff(added={self._added}, removed={self._removed}, "
+            f"changed={self._changed})"
+        )
+
+
+class RecordManifest:
+    """
+    Snapshot of the files of a storage record.
+
+    Parameters
+    ----------
+    record_id
+        Id of the record the snapshot was taken from
+    files
+        Mapping from each key in the record to its ``"size"`` (in bytes) and ``"checksum"``
+    etag
+        ETag of the record the snapshot was taken from, used to check whether it changed
+    concept_id
+        Id shared by all the versions of the record, if any
+    """
+
+    def __init__(
+        self,
+        record_id: str,
+        files: Dict[str, Dict[str, Any]],
+        etag: Optional[str] = None,
+        concept_id: Optional[str] = None,
+    ) -> None:
+        self._record_id = record_id
+        self._files = files
+        self._etag = etag
+        self._concept_id = concept_id
+
+    @classmethod
+    def from_zenodo_files(
+        cls,
+        record_id: str,
+        files: List[dict],
+        etag: Optional[str] = None,
+        concept_id: Optional[str] = None,
+    ) -> "RecordManifest":
+        """Builds a manifest from the ``"files"`` entries of a Zenodo record."""
+        return cls(
+            record_id,
+            {
+                elem["key"]: {"size": elem["size"], "checksum": elem["checksum"]}
+                for elem in files
+            },
+            etag=etag,
+            concept_id=concept_id,
+        )
+
+    @property
+    def record_id(self) -> str:
+        return self._record_id
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self._etag
+
+    @property
+    def concept_id(self) -> Optional[str]:
+        return self._concept_id
+
+    @property
+    def files(self) -> Dict[str, Dict[str, Any]]:
+        return self._files
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._files)
+
+    def size(self, key: str) -> int:
+        return self._files[key]["size"]
+
+    def checksum(self, key: str) -> str:
+        return self._files[key]["checksum"]
+
+    def diff(self, previous: Optional["RecordManifest"]) -> ManifestDiff:
+        """
+        Returns the changes from the given previous snapshot to this one.
+
+        Parameters
+        ----------
+        previous
+            The previous snapshot. If None, all keys are added.
+        """
+        old = previous.files if previous is not None else {}
+        return ManifestDiff(
+            added=[key for key in self._files if key not in old],
+            removed=[key for key in old if key not in self._files],
+            changed=[
+                key
+                for key in self._files
+                if key in old and old[key]["checksum"] != self.checksum(key)
+            ],
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Writes the manifest to the given path.
+
+        The manifest is written to a temporary file first and then moved in place, so that
+        concurrent readers never see a partially written manifest.
+
+        Parameters
+        ----------
+        path
+            Path of the file to write
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "record_id": self._record_id,
+                    "files": self._files,
+                    "etag": self._etag,
+                    "concept_id": self._concept_id,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RecordManifest"]:
+        """
+        Reads the manifest at the given path.
+
+        Parameters
+        ----------
+        path
+            Path of the file to read
+
+        Returns
+        -------
+        The manifest, or None if there is no manifest at the given path.
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            content = json.load(f)
+        return cls(
+            content["record_id"],
+            content["files"],
+            etag=content.get("etag"),
+            concept_id=content.get("concept_id"),
+        )
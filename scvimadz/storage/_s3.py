@@ -0,0 +1,350 @@
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from scvimadz import instrumentation
+
+from ._content_store import ContentStore
+from ._manifest import RecordManifest
+from .base import BaseStorage, FileToUpload
+
+_DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _import_boto3():
+    try:
+        import boto3
+    except ImportError:
+        raise ImportError(
+            "S3 storage requires the boto3 package. Install it with `pip install boto3`."
+        )
+    return boto3
+
+
+def _etag_checksum(etag: str) -> str:
+    """Returns the checksum of an object from its ETag, which is the MD5 of its content unless it was uploaded in parts."""
+    etag = etag.strip('"')
+    return f"etag:{etag}" if "-" in etag else f"md5:{etag}"
+
+
+class S3Storage(BaseStorage):
+    """
+    Storage backed by a bucket of an S3-compatible object store (e.g. AWS S3, MinIO, Ceph).
+
+    Large files are uploaded with parallel multipart uploads and downloaded with parallel ranged
+    GETs. The ETag of each downloaded file is recorded under ``<data_dir>/.scvimadz/``, so that
+    files are only downloaded again if they changed in the bucket.
+
+    Parameters
+    ----------
+    bucket
+        Name of the bucket
+    data_dir
+        Absolute path to the directory that will be used to download data to.
+    prefix
+        Prefix of the keys of this storage in the bucket, e.g. ``"zoo/models/"``
+    endpoint_url
+        Url of the object store, for S3-compatible stores other than AWS S3.
+    client
+        boto3 S3 client to use. If None, a client is created with the default credentials.
+        Clients can not be pickled, so a copy of the storage unpickled in another process
+        creates a client with the default credentials.
+    chunk_size
+        Size of the parts of multipart uploads and ranged downloads, in bytes. Files larger than
+        this are transferred in parts.
+    max_workers
+        Number of parts transferred in parallel
+    content_store
+        Content store shared with other storages, that files are downloaded to once and linked
+        into `data_dir` from, see :class:`~scvimadz.storage.ContentStore`. Defaults to the one at the ``SCVIMADZ_CONTENT_STORE`` environment variable,
+        if set.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        data_dir: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        client=None,
+        chunk_size: int = _DEFAULT_CHUNK_SIZE,
+        max_workers: int = 8,
+        content_store: Optional[ContentStore] = None,
+    ) -> None:
+        if not os.path.isdir(data_dir):
+            raise ValueError(f"Error: {data_dir} is not a valid directory")
+        if client is None:
+            client = _import_boto3().client("s3", endpoint_url=endpoint_url)
+        self._bucket = bucket
+        self._data_dir = data_dir
+        self._prefix = prefix
+        self._endpoint_url = endpoint_url
+        self._client = client
+        self._chunk_size = chunk_size
+        self._max_workers = max_workers
+        if content_store is None:
+            content_store = ContentStore.from_env()
+        self._content_store = content_store
+        self._etags_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # the lock and the client can not be pickled, they are recreated in the new process
+        state = self.__dict__.copy()
+        del state["_etags_lock"]
+        state["_client"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._etags_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The boto3 S3 client, created with the default credentials if there is none."""
+        if self._client is None:
+            self._client = _import_boto3().client("s3", endpoint_url=self._endpoint_url)
+        return self._client
+
+    @property
+    def bucket(self) -> str:
+        return self._bucket
+
+    @property
+    def prefix(self) -> str:
+        return self._prefix
+
+    @property
+    def data_dir(self) -> str:
+        return self._data_dir
+
+    @property
+    def content_store(self) -> Optional[ContentStore]:
+        return self._content_store
+
+    def _etags_path(self) -> str:
+        name = f"{self._bucket}_{self._prefix}".replace("/", "_")
+        return os.path.join(self._data_dir, ".scvimadz", f"s3_{name}.json")
+
+    def _load_etags(self) -> Dict[str, str]:
+        path = self._etags_path()
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_etag(self, key: str, etag: str) -> None:
+        with self._etags_lock:
+            etags = self._load_etags()
+            etags[key] = etag
+            path = self._etags_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(etags, f)
+            os.replace(tmp_path, path)
+
+    def get_manifest(self) -> RecordManifest:
+        """Returns the manifest of the storage, with the ETag of each object as its checksum."""
+        files = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=self._prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self._prefix) :]
+                files[key] = {"size": obj["Size"], "checksum": f"etag:{obj['ETag']}"}
+        instrumentation.count("s3.list_requests", bucket=self._bucket)
+        return RecordManifest(f"s3://{self._bucket}/{self._prefix}", files)
+
+    def list_keys(self) -> List[str]:
+        """Returns all keys in this storage."""
+        return self.get_manifest().keys
+
+    def list_checksums(self) -> Dict[str, str]:
+        """
+        Returns a mapping from each key in this storage to its checksum, e.g. ``"md5:<hexdigest>"``.
+
+        The ETag of an object is the MD5 of its content unless it was uploaded in parts, so
+        objects uploaded with multipart uploads have no checksum and are left out.
+        """
+        manifest = self.get_manifest()
+        checksums = {}
+        for key in manifest.keys:
+            checksum = _etag_checksum(manifest.checksum(key)[len("etag:") :])
+            if checksum.startswith("md5:"):
+                checksums[key] = checksum
+        return checksums
+
+    def read_range(self, key: str, start: int, stop: int) -> bytes:
+        """
+        Reads bytes [start, stop) of the file with the given key, without downloading the file.
+
+        Parameters
+        ----------
+        key
+            key of the file to read
+        start
+            Offset of the first byte to read
+        stop
+            Offset after the last byte to read
+        """
+        response = self.client.get_object(
+            Bucket=self._bucket,
+            Key=self._prefix + key,
+            Range=f"bytes={start}-{stop - 1}",
+        )
+        return response["Body"].read()
+
+    def _download_parts(self, key: str, path: str, size: int, etag: str) -> None:
+        def download_part(start):
+            stop = min(start + self._chunk_size, size)
+            # IfMatch makes the download fail if the object is overwritten meanwhile
+            response = self.client.get_object(
+                Bucket=self._bucket,
+                Key=self._prefix + key,
+                Range=f"bytes={start}-{stop - 1}",
+                IfMatch=etag,
+            )
+            data = response["Body"].read()
+            with open(path, "r+b") as f:
+                f.seek(start)
+                f.write(data)
+            return len(data)
+
+        with open(path, "wb") as f:
+            f.truncate(size)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for n_bytes in executor.map(
+                download_part, range(0, size, self._chunk_size)
+            ):
+                instrumentation.count("s3.bytes_downloaded", n_bytes, key=key)
+
+    def download_file(self, key: str) -> str:
+        """
+        Downloads the file with the given id to the path rooted at the user-provided `data_dir`, else raises an error.
+
+        If the file was already downloaded and its ETag did not change since, returns the path
+        to the local copy instead. If the content store holds the file, links it from there
+        instead.
+
+        Parameters
+        ----------
+        key
+            key of the file to download
+
+        Returns
+        -------
+        The full path to the downloaded file.
+        """
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self._bucket, Key=self._prefix + key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                raise ValueError(f"Key {key} not found.")
+            raise
+        etag, size = head["ETag"], head["ContentLength"]
+        file_path = os.path.join(self._data_dir, key)
+        if os.path.isfile(file_path) and self._load_etags().get(key) == etag:
+            instrumentation.count("s3.cache_hits", key=key)
+            return file_path
+        instrumentation.count("s3.cache_misses", key=key)
+        checksum = _etag_checksum(etag)
+        store = self._content_store
+        if store is not None and store.contains(checksum):
+            store.link(checksum, file_path)
+            self._save_etag(key, etag)
+            return file_path
+        with instrumentation.span("s3.download_file", bucket=self._bucket, key=key):
+            # download to a temporary file first, so that partial downloads are never
+            # mistaken for a local copy of the file
+            tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                self._download_parts(key, tmp_path, size, etag)
+                if store is not None:
+                    store.add(tmp_path, checksum)
+                    store.link(checksum, file_path)
+                else:
+                    os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._save_etag(key, etag)
+        return file_path
+
+    def upload_files(
+        self,
+        files: List[FileToUpload],
+        token: Optional[str],
+        ok_to_reversion_datastore: Optional[bool],
+        delete_keys: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Uploads the given files.
+
+        Files larger than `chunk_size` are uploaded with parallel multipart uploads. Object
+        stores have no transactions: new keys are uploaded first and keys that already exist
+        are overwritten last, and if any upload fails, only the new keys already uploaded by
+        this call are deleted. Existing files are never deleted on failure.
+
+        Parameters
+        ----------
+        files
+            List of files to upload.
+        token
+            Not applicable, the credentials of the client are used. Provide `None`.
+        ok_to_reversion_datastore
+            Not applicable, the bucket is not versioned by this storage. Provide `None`.
+        delete_keys
+            Keys of files to delete, once all uploads succeed.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        config = TransferConfig(
+            multipart_threshold=self._chunk_size,
+            multipart_chunksize=self._chunk_size,
+            max_concurrency=self._max_workers,
+        )
+        existing = set(self.list_keys())
+        # overwrite existing keys last, so that a failed upload leaves them untouched
+        files = sorted(files, key=lambda file: file.upload_as in existing)
+        uploaded = []
+        try:
+            for file in files:
+                key = self._prefix + file.upload_as
+                with instrumentation.span(
+                    "s3.upload_file", bucket=self._bucket, key=file.upload_as
+                ):
+                    if isinstance(file.data, str):
+                        self.client.upload_file(
+                            file.data, self._bucket, key, Config=config
+                        )
+                    else:
+                        body = io.BytesIO(file.data.getvalue().encode("utf-8"))
+                        self.client.upload_fileobj(
+                            body, self._bucket, key, Config=config
+                        )
+                if file.upload_as not in existing:
+                    uploaded.append(key)
+        except Exception as e:
+            print(f"Failed to upload. Error: {e}")
+            if uploaded:
+                print("Deleting the new files uploaded so far.")
+                self.client.delete_objects(
+                    Bucket=self._bucket,
+                    Delete={"Objects": [{"Key": key} for key in uploaded]},
+                )
+            raise
+        delete_keys = [self._prefix + key for key in delete_keys or []]
+        # delete_objects accepts at most 1000 keys per request
+        for start in range(0, len(delete_keys), 1000):
+            self.client.delete_objects(
+                Bucket=self._bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in delete_keys[start : start + 1000]
+                    ]
+                },
+            )
@@ -1,16 +1,71 @@
 import os
-from typing import List, Optional
+import threading
+from typing import Dict, List, Optional, Tuple
 
 import requests
 
+from scvimadz import instrumentation
+
+from ._content_store import ContentStore
+from ._integrity import quarantine_file
+from ._manifest import ManifestDiff, RecordManifest
 from .base import BaseStorage, FileToUpload
 
+_OFFLINE_ENV_VAR = "SCVIMADZ_OFFLINE"
+
 
 class ZenodoStorage(BaseStorage):
-    def __init__(self, record_id: str, data_dir: str, sandbox: bool = False):
+    """
+    Storage backed by a Zenodo record.
+
+    Every time the record is listed, a snapshot of its manifest (keys, sizes, checksums and
+    record id) is persisted under ``<data_dir>/.scvimadz/``. In offline mode, the storage is
+    served entirely from that snapshot and the files already in `data_dir`, without any
+    network calls.
+
+    Online, the record is only re-read from Zenodo if it changed since the snapshot was taken
+    (using its ETag). When it did, or when the record id changes to another version of the
+    record, the new manifest is diffed with the previous snapshot and only the local copies of
+    the files whose checksum changed are invalidated. Files already in `data_dir` that match
+    the manifest are not downloaded again. On the first sync, files already in `data_dir` are
+    only checked against the sizes in the manifest, see
+    :func:`~scvimadz.storage.verify_local_files` to check their checksums.
+
+    Parameters
+    ----------
+    record_id
+        Id of the Zenodo record
+    data_dir
+        Absolute path to the directory that will be used to download data to.
+    sandbox
+        Whether to use the Zenodo sandbox instead of Zenodo.
+    offline
+        Whether to operate from the local snapshot only. Defaults to True if the
+        ``SCVIMADZ_OFFLINE`` environment variable is set to ``1``.
+    content_store
+        Content store shared with other storages, that files are downloaded to once and linked
+        into `data_dir` from, see :class:`~scvimadz.storage.ContentStore`. Defaults to the one
+        at the ``SCVIMADZ_CONTENT_STORE`` environment variable, if set.
+    """
+
+    def __init__(
+        self,
+        record_id: str,
+        data_dir: str,
+        sandbox: bool = False,
+        offline: Optional[bool] = None,
+        content_store: Optional[ContentStore] = None,
+    ):
         self._record_id = record_id
         self._data_dir = data_dir
         self._sandbox = sandbox
+        if offline is None:
+            offline = os.environ.get(_OFFLINE_ENV_VAR, "0") == "1"
+        self._offline = offline
+        if content_store is None:
+            content_store = ContentStore.from_env()
+        self._content_store = content_store
+        self._manifest = None
         if not os.path.isdir(data_dir):
             raise ValueError(f"Error: {data_dir} is not a valid directory")
         # zenodo urls
@@ -26,20 +81,172 @@ class ZenodoStorage(BaseStorage):
             f"{self._zenodo_api_base_url}deposit/depositions/"
         )
 
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends an HTTP request to Zenodo and records it in the instrumentation counters."""
+        response = requests.request(method, url, **kwargs)
+        instrumentation.count(
+            "zenodo.http_requests", method=method, status=response.status_code
+        )
+        return response
+
+    @property
+    def offline(self) -> bool:
+        return self._offline
+
+    @property
+    def data_dir(self) -> str:
+        return self._data_dir
+
+    @property
+    def content_store(self) -> Optional[ContentStore]:
+        return self._content_store
+
+    @property
+    def etag(self) -> Optional[str]:
+        """ETag of the manifest last read, which changes whenever the record does."""
+        return self._manifest.etag if self._manifest is not None else None
+
+    def _manifest_path(self) -> str:
+        return os.path.join(
+            self._data_dir, ".scvimadz", f"zenodo_{self._record_id}.json"
+        )
+
+    def _concept_manifest_path(self, concept_id: str) -> str:
+        # snapshot of the last synced version among all the versions of the record
+        return os.path.join(
+            self._data_dir, ".scvimadz", f"zenodo_concept_{concept_id}.json"
+        )
+
+    def _get_record(
+        self, etag: Optional[str] = None
+    ) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Returns the record, which contains the key, size and checksum of each file, and its ETag.
+
+        If `etag` is provided and the record did not change, returns None instead of the record.
+        """
+        headers = {"If-None-Match": etag} if etag is not None else {}
+        with instrumentation.span("zenodo.get_record", record_id=self._record_id):
+            response = self._request(
+                "GET", self._zenodo_api_records_url + self._record_id, headers=headers
+            )
+            if response.status_code == 304:
+                return None, etag
+            # for the status codes Zenodo uses, see https://developers.zenodo.org/#responses
+            response.raise_for_status()
+        # if the call above didn't throw the response was "ok" (code < 400)
+        return response.json(), response.headers.get("ETag")
+
+    def _invalidate_local_files(
+        self, manifest: RecordManifest, diff: ManifestDiff, check_sizes: bool
+    ) -> None:
+        """
+        Removes the local copies of the files that changed.
+
+        If `check_sizes`, the local copies of another size than in the manifest are moved to
+        ``<data_dir>/.scvimadz/quarantine/`` too. Their checksums are left to
+        :func:`~scvimadz.storage.verify_local_files`, which would hash every local file.
+        """
+        local_keys = [
+            key
+            for key in manifest.keys
+            if os.path.isfile(os.path.join(self._data_dir, key))
+        ]
+        for key in local_keys:
+            file_path = os.path.join(self._data_dir, key)
+            if key in diff.changed:
+                os.remove(file_path)
+            elif check_sizes and os.path.getsize(file_path) != manifest.size(key):
+                quarantine_file(self._data_dir, key)
+            else:
+                continue
+            instrumentation.count("zenodo.invalidated_files", key=key)
+
+    def refresh(self) -> ManifestDiff:
+        """
+        Fetches the manifest of the record if it changed, and syncs the local files with it.
+
+        Returns
+        -------
+        The changes since the previous snapshot of the record (or of another version of it).
+        """
+        if self._offline:
+            raise ValueError("Refreshing the manifest is not possible in offline mode.")
+        snapshot = self._manifest
+        if snapshot is None or snapshot.record_id != self._record_id:
+            snapshot = RecordManifest.load(self._manifest_path())
+        record, etag = self._get_record(snapshot.etag if snapshot is not None else None)
+        if record is None:
+            instrumentation.count("zenodo.manifest_not_modified")
+            self._manifest = snapshot
+            return ManifestDiff([], [], [])
+        concept_id = record.get("conceptrecid")
+        manifest = RecordManifest.from_zenodo_files(
+            self._record_id,
+            record["files"],
+            etag=etag,
+            concept_id=str(concept_id) if concept_id is not None else None,
+        )
+        previous = snapshot
+        if manifest.concept_id is not None:
+            previous = RecordManifest.load(
+                self._concept_manifest_path(manifest.concept_id)
+            )
+        diff = manifest.diff(previous)
+        # without a previous snapshot, the files already in data_dir are of unknown origin
+        self._invalidate_local_files(manifest, diff, check_sizes=previous is None)
+        manifest.save(self._manifest_path())
+        if manifest.concept_id is not None:
+            manifest.save(self._concept_manifest_path(manifest.concept_id))
+        self._manifest = manifest
+        return diff
+
+    def get_manifest(self) -> RecordManifest:
+        """
+        Returns the manifest of the record.
+
+        When online, the manifest is refreshed from Zenodo (see :meth:`refresh`) and the local
+        snapshot is updated. When offline, the local snapshot is returned.
+        """
+        if self._offline:
+            manifest = RecordManifest.load(self._manifest_path())
+            if manifest is None:
+                raise ValueError(
+                    f"No local snapshot of record {self._record_id} in {self._data_dir}. "
+                    "List the storage at least once while online to create it."
+                )
+            self._manifest = manifest
+            return manifest
+        self.refresh()
+        return self._manifest
+
     def list_keys(self) -> List[str]:
         """Returns all keys in this storage."""
-        response = requests.get(self._zenodo_api_records_url + self._record_id)
-        # for the status codes Zenodo uses, see https://developers.zenodo.org/#responses
-        response.raise_for_status()
-        # if the call above didn't throw the response was "ok" (code < 400)
-        response_json = response.json()
-        keys = [elem["key"] for elem in response_json["files"]]
-        return keys
+        return self.get_manifest().keys
+
+    def list_checksums(self) -> Dict[str, str]:
+        """Returns a mapping from each key in this storage to its checksum, e.g. ``"md5:<hexdigest>"``."""
+        manifest = self.get_manifest()
+        return {key: manifest.checksum(key) for key in manifest.keys}
+
+    def _current_manifest(self) -> RecordManifest:
+        """Returns the manifest held in memory, and only reads it if there is none yet."""
+        if self._manifest is None or self._manifest.record_id != self._record_id:
+            return self.get_manifest()
+        return self._manifest
 
     def download_file(self, key: str) -> str:
         """
         Downloads the file with the given id to the path rooted at the user-provided `data_dir`, else raises an error.
 
+        If the file was already downloaded and did not change since, returns the path to the
+        local copy instead. If the content store holds the file, links it from there instead.
+        In offline mode, raises an error if there is no local copy, or if its size does not
+        match the snapshot.
+
+        The manifest the storage was last listed with is used, without reading it again, unless
+        the key is not in it or the downloaded file does not match it.
+
         Parameters
         ----------
         key
@@ -49,22 +256,82 @@ class ZenodoStorage(BaseStorage):
         -------
         The full path to the downloaded file.
         """
-        if key not in self.list_keys():
+        manifest = self._current_manifest()
+        if key not in manifest.keys and not self._offline:
+            # the key may have been added since the manifest was read
+            manifest = self.get_manifest()
+        if key not in manifest.keys:
             raise ValueError(f"Key {key} not found.")
-        file_url = self._zenodo_record_url_template.format(self._record_id, key)
-        response = requests.get(file_url)
-        response.raise_for_status()
-        # save response to file and return its full path
         file_path = os.path.join(self._data_dir, key)
-        with open(file_path, "wb") as f:
-            f.write(response.content)
+        # local copies of files that changed were removed when refreshing the manifest, and
+        # local copies of another size are truncated or partial
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == manifest.size(
+            key
+        ):
+            instrumentation.count("zenodo.cache_hits", key=key)
+            return file_path
+        instrumentation.count("zenodo.cache_misses", key=key)
+        store = self._content_store
+        if store is not None and store.contains(manifest.checksum(key)):
+            store.link(manifest.checksum(key), file_path)
+            return file_path
+        if self._offline:
+            if os.path.isfile(file_path):
+                raise ValueError(
+                    f"The local copy of key {key} has {os.path.getsize(file_path)} bytes "
+                    f"instead of {manifest.size(key)}, and can not be downloaded again "
+                    "offline."
+                )
+            raise ValueError(f"Key {key} is not available offline.")
+        try:
+            self._download(key, file_path, manifest)
+        except (requests.HTTPError, ValueError) as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code != 404:
+                raise
+            # the record may have changed since the manifest was read
+            instrumentation.count("zenodo.stale_manifest", key=key)
+            manifest = self.get_manifest()
+            if key not in manifest.keys:
+                raise ValueError(f"Key {key} not found.")
+            self._download(key, file_path, manifest)
         return file_path
 
+    def _download(self, key: str, file_path: str, manifest: RecordManifest) -> None:
+        """Downloads the given key to `file_path`, and raises an error if it does not match the manifest."""
+        file_url = self._zenodo_record_url_template.format(self._record_id, key)
+        with instrumentation.span(
+            "zenodo.download_file", record_id=self._record_id, key=key
+        ) as span_attrs:
+            response = self._request("GET", file_url)
+            response.raise_for_status()
+            if len(response.content) != manifest.size(key):
+                raise ValueError(
+                    f"Downloaded {len(response.content)} bytes of key {key} instead of "
+                    f"{manifest.size(key)}."
+                )
+            # save response to a temporary file first, so that partial downloads are never
+            # mistaken for a local copy of the file
+            tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(response.content)
+            store = self._content_store
+            if store is not None:
+                # raises an error if the file does not match its checksum
+                store.add(tmp_path, manifest.checksum(key))
+                store.link(manifest.checksum(key), file_path)
+            else:
+                os.replace(tmp_path, file_path)
+            span_attrs["bytes"] = len(response.content)
+            instrumentation.count(
+                "zenodo.bytes_downloaded", len(response.content), key=key
+            )
+
     def upload_files(
         self,
         files: List[FileToUpload],
         token: Optional[str],
         ok_to_reversion_datastore: Optional[bool],
+        delete_keys: Optional[List[str]] = None,
     ) -> None:
         """
         Uploads the given files.
@@ -79,9 +346,13 @@ class ZenodoStorage(BaseStorage):
             Access token to use for the upload. Write and Action scopes are required.
         ok_to_reversion_datastore
             Whether it is ok to bump the store version.
+        delete_keys
+            Keys of files to delete from the new version, once all uploads succeed.
         """
         if self._sandbox is True:
             raise NotImplementedError()
+        if self._offline:
+            raise ValueError("Uploading files is not possible in offline mode.")
         if not ok_to_reversion_datastore:
             raise ValueError(
                 "Uploading new files to a published Zenodo repository requires versioning it."
@@ -89,7 +360,8 @@ class ZenodoStorage(BaseStorage):
         # Create a new version of the deposition corresponding to the current record_id
         # Only a single version can be open at a time, so if one already exists this will return that
         params = {"access_token": token}
-        response = requests.post(
+        response = self._request(
+            "POST",
             f"{self._zenodo_api_depositions_url}{self._record_id}/actions/newversion",
             params=params,
         )
@@ -98,16 +370,19 @@ class ZenodoStorage(BaseStorage):
         draft_reposition_id = None
         try:
             # Get the draft deposition id and the bucket link for the draft deposition
-            response = requests.get(draft_deposition_url, params=params)
+            response = self._request("GET", draft_deposition_url, params=params)
             response.raise_for_status()
             draft_deposition = response.json()
             draft_reposition_id = draft_deposition["id"]
             bucket_url = draft_deposition["links"]["bucket"]
 
             def send_data(data, upload_as):
-                response = requests.put(
-                    f"{bucket_url}/{upload_as}", data=data, params=params
-                )
+                with instrumentation.span(
+                    "zenodo.upload_file", record_id=self._record_id, key=upload_as
+                ):
+                    response = self._request(
+                        "PUT", f"{bucket_url}/{upload_as}", data=data, params=params
+                    )
                 response.raise_for_status()
                 return response
 
@@ -118,8 +393,16 @@ class ZenodoStorage(BaseStorage):
                         response = send_data(f, file.upload_as)
                 else:
                     response = send_data(file.data, file.upload_as)
+            # the new version starts with the files of the previous one
+            for draft_file in draft_deposition.get("files", []):
+                if draft_file["filename"] in (delete_keys or []):
+                    response = self._request(
+                        "DELETE", draft_file["links"]["self"], params=params
+                    )
+                    response.raise_for_status()
             # If all went well, publish the new version
-            response = requests.post(
+            response = self._request(
+                "POST",
                 f"{self._zenodo_api_depositions_url}{draft_reposition_id}/actions/publish",
                 params=params,
             )
@@ -130,7 +413,8 @@ class ZenodoStorage(BaseStorage):
             print(f"Failed to upload. Error: {e}")
             if draft_reposition_id is not None:
                 print("Discarding draft.")
-                response = requests.post(
+                response = self._request(
+                    "POST",
                     f"{self._zenodo_api_depositions_url}{draft_reposition_id}/actions/discard",
                     params=params,
                 )
@@ -64,6 +64,7 @@ class BaseStorage(ABC):
         files: List[FileToUpload],
         token: Optional[str],
         ok_to_reversion_datastore: Optional[bool],
+        delete_keys: Optional[List[str]] = None,
     ) -> None:
         """
         Uploads the given files.
@@ -78,5 +79,7 @@ class BaseStorage(ABC):
             Access token to use for the upload. If not applicable to this backend, pass None.
         ok_to_reversion_datastore
             Whether it is ok to bump the store version. If not applicable to this backend, pass None.
+        delete_keys
+            Keys of files to delete in the same transaction, once all uploads succeed.
         """
         pass
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import time
+
+from scvimadz.cli import main
+from scvimadz.cli._main import _parse_size
+from scvimadz.storage import ContentStore, RecordManifest, ZenodoStorage
+
+
+def _make_file(path, size, age):
+    with open(path, "wb") as f:
+        f.write(b"0" * size)
+    t = time.time() - age
+    os.utime(path, (t, t))
+
+
+def test_parse_size():
+    assert _parse_size("100") == 100
+    assert _parse_size("2K") == 2048
+    assert _parse_size("1.5G") == int(1.5 * (1 << 30))
+
+
+def test_cache_size_and_prune(save_path, capsys):
+    _make_file(os.path.join(save_path, "old.h5ad"), 100, 3600 * 24 * 10)
+    _make_file(os.path.join(save_path, "mid.h5ad"), 100, 3600)
+    _make_file(os.path.join(save_path, "new.zip"), 100, 0)
+
+    assert main(["cache-size", "--data-dir", save_path]) == 0
+    assert "300.0 B" in capsys.readouterr().out
+
+    assert main(["prune", "--data-dir", save_path, "--max-age-days", "1"]) == 0
+    assert sorted(os.listdir(save_path)) == ["mid.h5ad", "new.zip"]
+
+    assert (
+        main(["prune", "--data-dir", save_path, "--max-size", "150", "--dry-run"]) == 0
+    )
+    assert sorted(os.listdir(save_path)) == ["mid.h5ad", "new.zip"]
+
+    assert main(["prune", "--data-dir", save_path, "--max-size", "150"]) == 0
+    assert os.listdir(save_path) == ["new.zip"]
+
+    # the data_dirs of federated records are pruned file by file, keeping their snapshots
+    record_dir = os.path.join(save_path, "1")
+    os.makedirs(os.path.join(record_dir, ".scvimadz"))
+    _make_file(os.path.join(record_dir, ".scvimadz", "zenodo_1.json"), 10, 3600 * 48)
+    _make_file(os.path.join(record_dir, "old.zip"), 100, 3600 * 48)
+    _make_file(os.path.join(record_dir, "new.h5ad"), 100, 0)
+    os.mkdir(os.path.join(save_path, "2"))
+    assert main(["prune", "--data-dir", save_path, "--max-age-days", "1"]) == 0
+    assert sorted(os.listdir(record_dir)) == [".scvimadz", "new.h5ad"]
+    assert os.listdir(os.path.join(record_dir, ".scvimadz")) == ["zenodo_1.json"]
+    assert os.path.isdir(os.path.join(save_path, "2"))
+
+
+def test_prune_content_store(save_path, capsys):
+    data_dir = os.path.join(save_path, "data")
+    os.makedirs(os.path.join(data_dir, "1", ".scvimadz"))
+    os.makedirs(os.path.join(data_dir, "2", ".scvimadz"))
+    content_store = ContentStore(os.path.join(save_path, "content"))
+    checksum = "md5:" + hashlib.md5(b"0" * 100).hexdigest()
+    _make_file(os.path.join(save_path, "download"), 100, 0)
+    content_store.add(os.path.join(save_path, "download"), checksum)
+    # two records of a federated data directory sharing the same file
+    for record_id, age in [("1", 3600 * 48), ("2", 3600)]:
+        path = os.path.join(data_dir, record_id, "model.pt")
+        content_store.link(checksum, path)
+        os.utime(path, (time.time() - age, time.time() - age))
+    _make_file(os.path.join(data_dir, "new.h5ad"), 100, 0)
+
+    assert main(["cache-size", "--data-dir", data_dir]) == 0
+    assert "200.0 B" in capsys.readouterr().out
+
+    # removing the older link frees nothing while the other record links the same file
+    assert (
+        main(
+            ["prune", "--data-dir", data_dir, "--content-store", content_store.root]
+            + ["--max-size", "150"]
+        )
+        == 0
+    )
+    assert not os.path.exists(os.path.join(data_dir, "1", "model.pt"))
+    assert not os.path.exists(os.path.join(data_dir, "2", "model.pt"))
+    assert os.path.isfile(os.path.join(data_dir, "new.h5ad"))
+    assert not content_store.contains(checksum)
+    out = capsys.readouterr().out
+    assert content_store.path(checksum) in out
+    assert "Cache size is now 100.0 B." in out
+
+
+def _publish_offline(data_dir, record_id, contents, missing=()):
+    """Writes the local snapshot of a Zenodo record, and its files except `missing`."""
+    files = {}
+    for key, content in contents.items():
+        files[key] = {
+            "size": len(content),
+            "checksum": "md5:" + hashlib.md5(content).hexdigest(),
+        }
+        if key not in missing:
+            with open(os.path.join(data_dir, key), "wb") as f:
+                f.write(content)
+    store = ZenodoStorage(record_id, data_dir, offline=True)
+    RecordManifest(record_id, files).save(store._manifest_path())
+
+
+def _offline_args(save_path):
+    return [
+        "--data-dir",
+        save_path,
+        "--offline",
+        "--model-record",
+        "1",
+        "--data-record",
+        "2",
+    ]
+
+
+def _make_offline_records(save_path):
+    _publish_offline(
+        save_path,
+        "1",
+        {
+            "models_metadata.csv": b"key,class_name\nlung.zip,scvi.model.SCVI\nblood.zip,scvi.model.SCANVI\n",
+            "lung.zip": b"lung",
+            "blood.zip": b"blood",
+        },
+        missing=["blood.zip"],
+    )
+    _publish_offline(
+        save_path,
+        "2",
+        {"datasets_metadata.csv": b"key,tissue\nlung.h5ad,Lung\n", "lung.h5ad": b"x"},
+    )
+
+
+def test_list(save_path, capsys):
+    _make_offline_records(save_path)
+    assert main(["list", "models"] + _offline_args(save_path)) == 0
+    out = capsys.readouterr().out
+    assert "lung.zip" in out and "scvi.model.SCVI" in out
+    assert main(["list", "datasets"] + _offline_args(save_path)) == 0
+    assert "Lung" in capsys.readouterr().out
+    # the records must be given together
+    assert main(["list", "models", "--data-dir", save_path, "--model-record", "1"]) == 2
+
+
+def test_prefetch(save_path, capsys):
+    _make_offline_records(save_path)
+    assert main(["prefetch", "models", "lung.zip"] + _offline_args(save_path)) == 0
+    assert "Fetched lung.zip" in capsys.readouterr().out
+    # not downloaded yet, and not available offline
+    assert main(["prefetch", "models", "blood.zip"] + _offline_args(save_path)) == 2
+    assert "not available offline" in capsys.readouterr().err
+    assert main(["prefetch", "datasets"] + _offline_args(save_path)) == 2
+    assert main(["prefetch", "datasets", "--all"] + _offline_args(save_path)) == 0
+    assert "Fetched lung.h5ad" in capsys.readouterr().out
+
+
+def test_verify(save_path, capsys):
+    _make_offline_records(save_path)
+    assert main(["verify"] + _offline_args(save_path)) == 0
+    out = capsys.readouterr().out
+    assert "OK\tlung.zip" in out
+    assert "Verified 4 files, 0 mismatched." in out
+
+    with open(os.path.join(save_path, "lung.zip"), "wb") as f:
+        f.write(b"lunk")
+    assert main(["verify"] + _offline_args(save_path)) == 1
+    out = capsys.readouterr().out
+    assert "MISMATCH\tlung.zip" in out
+    assert not os.path.exists(os.path.join(save_path, "lung.zip"))
+    # offline, the quarantined file can not be downloaded again
+    assert main(["verify", "--repair"] + _offline_args(save_path)) == 0
+
+
+def test_verify_federated(save_path, capsys):
+    _make_offline_records(save_path)
+    for record_id, key in [("3", "kidney.zip"), ("4", "liver.zip")]:
+        record_dir = os.path.join(save_path, record_id)
+        os.mkdir(record_dir)
+        _publish_offline(
+            record_dir,
+            record_id,
+            {
+                "models_metadata.csv": f"key,class_name\n{key},scvi.model.SCVI\n".encode(),
+                key: b"weights",
+            },
+        )
+    with open(os.path.join(save_path, "4", "liver.zip"), "wb") as f:
+        f.write(b"weighs")
+    args = _offline_args(save_path)
+    args[args.index("--model-record") + 1] = "3,4"
+    assert main(["verify"] + args) == 1
+    out = capsys.readouterr().out
+    assert "MISMATCH\tliver.zip" in out
+    # reports where the record quarantined the file, not the top level data_dir
+    assert os.path.join(save_path, "4", ".scvimadz", "quarantine") in out
+    assert os.path.join(save_path, ".scvimadz", "quarantine") not in out
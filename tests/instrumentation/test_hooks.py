@@ -0,0 +1,69 @@
+import pytest
+
+from scvimadz import instrumentation
+from scvimadz.reference import GenericReference
+from tests.mock import MockStorage
+
+
+class RecordingCallback(instrumentation.InstrumentationCallback):
+    def __init__(self):
+        self.spans = []
+        self.counters = []
+
+    def on_span(self, name, duration, attributes):
+        self.spans.append((name, duration, dict(attributes)))
+
+    def on_counter(self, name, value, attributes):
+        self.counters.append((name, value, dict(attributes)))
+
+
+@pytest.fixture
+def recorder():
+    callback = RecordingCallback()
+    instrumentation.add_callback(callback)
+    yield callback
+    instrumentation.remove_callback(callback)
+
+
+def test_disabled_is_noop():
+    assert not instrumentation.is_enabled()
+    with instrumentation.span("foo", a=1) as attrs:
+        attrs["b"] = 2
+    instrumentation.count("bar")
+
+
+def test_span_and_counter(recorder):
+    assert instrumentation.is_enabled()
+    with instrumentation.span("foo", a=1) as attrs:
+        attrs["b"] = 2
+    instrumentation.count("bar", 3, c=4)
+    assert len(recorder.spans) == 1
+    name, duration, attributes = recorder.spans[0]
+    assert name == "foo"
+    assert duration >= 0
+    assert attributes == {"a": 1, "b": 2}
+    assert recorder.counters == [("bar", 3, {"c": 4})]
+
+    with pytest.raises(ValueError):
+        with instrumentation.span("failing"):
+            raise ValueError()
+    assert recorder.spans[-1][0] == "failing"
+    assert recorder.spans[-1][2]["error"] == "ValueError"
+
+
+def test_reference_spans(save_path, recorder):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    generic_ref.load_dataset("dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad")
+    generic_ref.get_models_df()
+    span_names = [s[0] for s in recorder.spans]
+    assert "reference.read_dataset" in span_names
+    assert "reference.list_objects" in span_names
+
+
+def test_instrumentation_is_exported():
+    import scvimadz
+
+    assert "instrumentation" in scvimadz.__all__
+    assert scvimadz.instrumentation is instrumentation
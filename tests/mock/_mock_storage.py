@@ -51,6 +51,7 @@ class MockStorage(BaseStorage):
         files: List[FileToUpload],
         token: Optional[str],
         ok_to_reversion_datastore: Optional[bool],
+        delete_keys: Optional[List[str]] = None,
     ) -> None:
         for file in files:
             newfile = os.path.join(self._data_dir, file.upload_as)
@@ -59,3 +60,7 @@ class MockStorage(BaseStorage):
             else:
                 with open(newfile, "w") as f:
                     f.write(file.data.getvalue())
+        for key in delete_keys or []:
+            # e.g. already deleted by a concurrent upload
+            if os.path.exists(os.path.join(self._data_dir, key)):
+                os.remove(os.path.join(self._data_dir, key))
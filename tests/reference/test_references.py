@@ -1,10 +1,28 @@
+import io
 import json
 import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import anndata
 import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
 
-from scvimadz.reference import DatasetMetadata, GenericReference, ModelMetadata
+from scvimadz.reference import (
+    DatasetMetadata,
+    GenericReference,
+    H5adDataset,
+    ModelMetadata,
+    read_model_package_header,
+)
+from scvimadz.reference.base import _loading
+from scvimadz.reference.base._summary import summarize_dataset
+from scvimadz.storage.base import FileToUpload
 from tests.mock import MockStorage
 
 
@@ -62,6 +80,59 @@ def test_reference_load_model(save_path):
     assert model.adata.n_vars == 35
 
 
+def test_reference_fetch_model_own_directory(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    files = []
+    for name in ["a", "b"]:
+        path = os.path.join(save_path, f"{name}.pt")
+        with open(path, "w") as f:
+            f.write(name)
+        files.append(FileToUpload(path, f"{name}.pt"))
+    model_store.upload_files(files, None, None)
+
+    # concurrent fetches of different models never share their files
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(
+                lambda key: generic_ref._fetch_model(key, "scvi.model.SCVI")[1],
+                ["a.pt", "b.pt", "a.pt", "b.pt"],
+            )
+        )
+    assert results[:2] == results[2:]
+    assert len(set(results)) == 2
+    for name, model_dir in zip(["a", "b"], results):
+        assert os.path.basename(model_dir) == name
+        with open(os.path.join(model_dir, "model.pt")) as f:
+            assert f.read() == name
+        # linked rather than copied
+        assert os.path.samefile(os.path.join(model_dir, "model.pt"), f"{model_dir}.pt")
+    # a model updated since it was unpacked replaces its stale directory
+    os.utime(f"{results[0]}.pt", (time.time() + 10, time.time() + 10))
+    stale_file = os.path.join(results[0], "stale")
+    open(stale_file, "w").close()
+    assert generic_ref._fetch_model("a.pt", "scvi.model.SCVI")[1] == results[0]
+    assert os.listdir(results[0]) == ["model.pt"]
+    assert not [
+        name for name in os.listdir(os.path.dirname(results[0])) if "tmp" in name
+    ]
+    # the downloaded files are left in place
+    assert {"a.pt", "b.pt"} <= set(model_store.list_keys())
+
+    legacy_id = "80262d08-4a30-4071-a3c6-96274182646d.zip"
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        paths = list(
+            executor.map(
+                lambda key: generic_ref._fetch_model(key, "scvi.model.SCVI")[1],
+                [legacy_id, legacy_id],
+            )
+        )
+    assert paths[0] == paths[1]
+    assert os.path.basename(paths[0]) == legacy_id[:-4]
+    assert "model_params.pt" in os.listdir(paths[0])
+
+
 def test_reference_save_dataset(save_path):
     model_store = MockStorage("models", save_path)
     dataset_store = MockStorage("datasets", save_path)
@@ -169,3 +240,690 @@ def test_reference_save_model(save_path):
     assert models_df["n_latent"].loc[model_id] == 10.0
     assert bool(models_df["use_observed_lib_size"].loc[model_id]) is False
     assert models_df["init_params"].loc[model_id] == json.dumps(init_params_dict)
+
+
+def test_reference_sharded_dataset(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    dummydir = os.path.join(save_path, "dummyfiles")
+    os.mkdir(dummydir)
+    dummyfile_path = os.path.join(dummydir, "dummy_file.h5ad")
+    adata = anndata.AnnData(np.random.normal(1, 5, size=(30, 10)))
+    adata.obs["tissue"] = ["Lung"] * 10 + ["Liver"] * 15 + ["Heart"] * 5
+    adata.write(dummyfile_path)
+
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(
+        dummyfile_path, None, True, dsm, shard_by="tissue"
+    )
+    datasets_df = generic_ref.get_datasets_df()
+    assert len(datasets_df) == 2
+    assert datasets_df["cell_count"].loc[dataset_id] == 30
+
+    shards_df = generic_ref.get_dataset_shards(dataset_id)
+    assert shards_df["value"].to_list() == ["Lung", "Liver", "Heart"]
+    assert shards_df["n_obs"].to_list() == [10, 15, 5]
+
+    lung = generic_ref.load_dataset(dataset_id, shards=["Lung"])
+    assert lung.n_obs == 10
+    assert (lung.obs["tissue"] == "Lung").all()
+    lung_heart = generic_ref.load_dataset(dataset_id, shards=["Lung", "Heart"])
+    assert lung_heart.n_obs == 15
+    assert lung_heart.n_vars == 10
+    assert generic_ref.load_dataset(dataset_id).n_obs == 30
+
+    blocks_id = generic_ref.save_dataset(dummyfile_path, None, True, dsm, shard_size=8)
+    assert generic_ref.get_dataset_shards(blocks_id)["n_obs"].to_list() == [8, 8, 8, 6]
+    assert generic_ref.load_dataset(blocks_id, shards=[3]).n_obs == 6
+
+
+def test_reference_sharded_dataset_concat(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    counts = sparse.random(40, 12, density=0.3, format="csr", random_state=0)
+    adata = anndata.AnnData(counts)
+    adata.layers["dense"] = counts.toarray()
+    adata.obsm["X_latent"] = np.arange(80, dtype=np.float32).reshape(40, 2)
+    adata.obs["tissue"] = pd.Categorical(["Lung", "Liver"] * 20)
+    adata.obs["cell_type"] = pd.Categorical(["a"] * 10 + ["b"] * 15 + ["c"] * 15)
+    adata.uns["source"] = "test"
+    path = os.path.join(save_path, "sharded.h5ad")
+    adata.write(path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=True, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm, shard_size=15)
+
+    # the same dataset as concatenating the shards with anndata
+    loaded = generic_ref.load_dataset(dataset_id)
+    assert sparse.isspmatrix_csr(loaded.X)
+    np.testing.assert_array_equal(loaded.X.toarray(), counts.toarray())
+    np.testing.assert_array_equal(loaded.layers["dense"], counts.toarray())
+    np.testing.assert_array_equal(loaded.obsm["X_latent"], adata.obsm["X_latent"])
+    pd.testing.assert_frame_equal(loaded.obs, adata.obs, check_categorical=False)
+    assert list(loaded.obs["cell_type"].cat.categories) == ["a", "b", "c"]
+    pd.testing.assert_frame_equal(loaded.var, adata.var)
+    assert loaded.uns["source"] == "test"
+
+    # the values of dense matrices converted to sparse are concatenated at the end
+    loaded = generic_ref.load_dataset(
+        dataset_id, shards=[0, 2], sparse=True, dtype="float32"
+    )
+    assert loaded.n_obs == 25
+    assert sparse.isspmatrix_csr(loaded.layers["dense"])
+    assert loaded.layers["dense"].dtype == np.float32
+    np.testing.assert_allclose(
+        loaded.layers["dense"].toarray(),
+        np.concatenate([counts[:15].toarray(), counts[30:].toarray()]),
+        rtol=1e-6,
+    )
+
+
+def test_reference_zarr_dataset(save_path):
+    pytest.importorskip("zarr")
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    dummydir = os.path.join(save_path, "dummyfiles")
+    os.mkdir(dummydir)
+    dummyfile_path = os.path.join(dummydir, "dummy_file.h5ad")
+    counts = sparse.random(50, 20, density=0.3, format="csr", dtype=np.float32)
+    adata = anndata.AnnData(counts)
+    adata.layers["dense"] = counts.toarray()
+    adata.write(dummyfile_path)
+
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(
+        dummyfile_path, None, True, dsm, file_format="zarr"
+    )
+    assert dataset_id.endswith(".zarr.zip")
+    assert generic_ref.get_datasets_df()["cell_count"].loc[dataset_id] == 50
+
+    loaded = generic_ref.load_dataset(dataset_id)
+    np.testing.assert_array_equal(loaded.X.toarray(), counts.toarray())
+
+    dataset = generic_ref.open_zarr_dataset(dataset_id)
+    assert dataset.shape == (50, 20)
+    blocks = list(dataset.iter_blocks(16, n_workers=2))
+    assert [(start, stop) for start, stop, _ in blocks] == [
+        (0, 16),
+        (16, 32),
+        (32, 48),
+        (48, 50),
+    ]
+    np.testing.assert_array_equal(
+        sparse.vstack([b for _, _, b in blocks]).toarray(), counts.toarray()
+    )
+    # a slow consumer only has a bounded number of blocks read ahead
+    submitted = []
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted.append(args[3])
+            return super().submit(*args, **kwargs)
+
+    with CountingExecutor(max_workers=1) as executor:
+        blocks = dataset.iter_blocks(1, n_workers=1, executor=executor)
+        next(blocks)
+        assert len(submitted) == 3
+        assert sum(1 for _ in blocks) == 49
+    assert len(submitted) == 50
+    var_block = dataset.read_var_block(5, 10, layer="dense")
+    np.testing.assert_array_equal(var_block, counts.toarray()[:, 5:10])
+
+    with pytest.raises(ValueError):
+        generic_ref.open_zarr_dataset("dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad")
+
+
+def test_reference_metadata_log(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    base_metadata_path = dataset_store.download_file("datasets_metadata.csv")
+    with open(base_metadata_path) as f:
+        base_metadata = f.read()
+
+    dummydir = os.path.join(save_path, "dummyfiles")
+    os.mkdir(dummydir)
+    dummyfile_path = os.path.join(dummydir, "dummy_file.h5ad")
+    anndata.AnnData(np.random.normal(1, 5, size=(7, 3))).write(dummyfile_path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+
+    # concurrent publishers only upload their own delta, so neither entry is lost
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ids = list(
+            executor.map(
+                lambda _: generic_ref.save_dataset(dummyfile_path, None, True, dsm),
+                range(2),
+            )
+        )
+    with open(base_metadata_path) as f:
+        assert f.read() == base_metadata
+    datasets_df = generic_ref.get_datasets_df()
+    assert len(datasets_df) == 3
+    assert datasets_df["cell_count"].loc[ids].to_list() == [7, 7]
+    assert "datasets_metadata.csv" not in datasets_df.index
+
+
+def test_reference_metadata_compaction(save_path, monkeypatch):
+    from scvimadz.reference.base import _base_reference
+
+    monkeypatch.setattr(_base_reference, "METADATA_COMPACTION_THRESHOLD", 2)
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    dummydir = os.path.join(save_path, "dummyfiles")
+    os.mkdir(dummydir)
+    dummyfile_path = os.path.join(dummydir, "dummy_file.h5ad")
+    anndata.AnnData(np.random.normal(1, 5, size=(7, 3))).write(dummyfile_path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+
+    def delta_keys():
+        return [k for k in dataset_store.list_keys() if ".delta." in k]
+
+    ids = [generic_ref.save_dataset(dummyfile_path, None, True, dsm) for _ in range(2)]
+    assert len(delta_keys()) == 2
+    # past the threshold, the deltas and the new record are folded into the base file
+    ids.append(generic_ref.save_dataset(dummyfile_path, None, True, dsm))
+    assert delta_keys() == []
+    bases = [k for k in dataset_store.list_keys() if ".base." in k]
+    assert len(bases) == 1
+    assert "datasets_metadata.csv" not in dataset_store.list_keys()
+    base = pd.read_csv(dataset_store.download_file(bases[0]))
+    assert set(ids) <= set(base["key"])
+    datasets_df = generic_ref.get_datasets_df()
+    assert len(datasets_df) == 4
+    assert datasets_df["cell_count"].loc[ids].to_list() == [7, 7, 7]
+
+    # concurrent compactions from the same listing, while another record is published
+    fn = _base_reference._Metadata_File.DATASETS_METADATA_FILE
+    for _ in range(2):
+        ids.append(generic_ref.save_dataset(dummyfile_path, None, True, dsm))
+    compactions = []
+    for dataset_id in ["a.h5ad", "b.h5ad"]:
+        new = {"key": [dataset_id], "cell_count": [1], "tissue": ["Misc"]}
+        compactions.append(generic_ref._metadata_files(dataset_store, fn, new))
+    published = generic_ref._metadata_delta(
+        fn, {"key": ["c.h5ad"], "cell_count": [2], "tissue": ["Misc"]}
+    )
+    dataset_store.upload_files([published], None, None)
+    for files, deleted in compactions:
+        assert published.upload_as not in deleted
+        dataset_store.upload_files(files, None, None, delete_keys=deleted)
+    datasets_df = generic_ref._read_metadata(
+        dataset_store, dataset_store.list_keys(), fn
+    )
+    assert set(ids + ["a.h5ad", "b.h5ad", "c.h5ad"]) <= set(datasets_df.index)
+    assert delta_keys() == [published.upload_as]
+
+    # the merged metadata is cached until the ETag of the store changes
+    downloads = []
+    download_file = dataset_store.download_file
+    monkeypatch.setattr(
+        dataset_store,
+        "download_file",
+        lambda key: downloads.append(key) or download_file(key),
+    )
+    dataset_store.etag = "v1"
+    datasets_df = generic_ref.get_datasets_df()
+    generic_ref.get_datasets_df()
+    assert downloads.count(published.upload_as) == 1
+    dataset_store.etag = "v2"
+    pd.testing.assert_frame_equal(generic_ref.get_datasets_df(), datasets_df)
+    assert downloads.count(published.upload_as) == 2
+
+
+def test_reference_save_to_storage_without_delete_keys(save_path):
+    class LegacyStorage(MockStorage):
+        def upload_files(self, files, token, ok_to_reversion_datastore):
+            super().upload_files(files, token, ok_to_reversion_datastore)
+
+    generic_ref = GenericReference(
+        model_store=MockStorage("models", save_path),
+        data_store=LegacyStorage("datasets", save_path),
+    )
+    path = os.path.join(save_path, "dummy_file.h5ad")
+    anndata.AnnData(np.ones((3, 2))).write(path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+    assert dataset_id in generic_ref.get_datasets_df().index
+
+
+def test_reference_model_package(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    legacy_id = "80262d08-4a30-4071-a3c6-96274182646d.zip"
+    legacy_model = generic_ref.load_model(legacy_id)
+    # move the unpacked model out of the mock store, whose keys are its directory entries
+    legacy_dir = os.path.join(save_path, "legacy_model")
+    shutil.move(
+        os.path.join(
+            os.path.dirname(model_store.download_file(legacy_id)), legacy_id[:-4]
+        ),
+        legacy_dir,
+    )
+
+    mm = ModelMetadata(
+        cls_name="scvi.model.SCVI",
+        train_dataset="dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad",
+        n_hidden=128,
+        n_layers=1,
+        n_latent=10,
+        use_observed_lib_size=True,
+        init_params="",
+    )
+    model_id = generic_ref.save_model(legacy_dir, None, True, mm)
+    assert model_id.endswith(".madz")
+
+    header, _ = read_model_package_header(model_store.download_file(model_id))
+    assert header["var_names"] == legacy_model.adata.var_names.to_list()
+
+    model = generic_ref.load_model(model_id, use_gpu=False)
+    assert model.is_trained
+    assert model.adata.n_vars == 35
+    legacy_state = legacy_model.module.state_dict()
+    for name, tensor in model.module.state_dict().items():
+        np.testing.assert_array_equal(tensor.numpy(), legacy_state[name].numpy())
+    pd.testing.assert_frame_equal(
+        model.history["elbo_train"],
+        legacy_model.history["elbo_train"],
+        check_dtype=False,
+    )
+    np.testing.assert_array_equal(model.train_indices, legacy_model.train_indices)
+
+
+def test_reference_evaluate_models(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    adata = generic_ref.load_dataset("dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad")
+
+    results = generic_ref.evaluate_models(adata, n_jobs=1, tmp_dir=save_path)
+    assert list(results) == ["80262d08-4a30-4071-a3c6-96274182646d.zip"]
+    assert results["80262d08-4a30-4071-a3c6-96274182646d.zip"].shape == (100, 10)
+
+
+def test_reference_dataset_summary(save_path, monkeypatch):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    counts = sparse.random(30, 5, density=0.4, format="csr", random_state=0)
+    adata = anndata.AnnData(counts)
+    adata.obs["cell_type"] = ["T cell"] * 20 + ["B cell"] * 10
+    adata.obs["donor"] = ["d1", "d2", "d3"] * 10
+    path = os.path.join(save_path, "summarized.h5ad")
+    adata.write(path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=True
+    )
+    # the dataset is uploaded as is, so it is summarized without loading its matrix
+    read_h5ad = anndata.read_h5ad
+    backed = []
+    monkeypatch.setattr(
+        anndata,
+        "read_h5ad",
+        lambda *args, **kwargs: backed.append(kwargs.get("backed"))
+        or read_h5ad(*args, **kwargs),
+    )
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+    monkeypatch.undo()
+    assert backed == ["r"]
+
+    summary = generic_ref.get_dataset_summary(dataset_id)
+    assert (
+        summary["size_in_memory"]
+        == summarize_dataset(anndata.read_h5ad(path), 0)["size_in_memory"]
+    )
+    assert summary["cell_type_key"] == "cell_type"
+    assert summary["cell_type_counts"] == {"T cell": 20, "B cell": 10}
+    assert summary["batch_keys"] == {"donor": 3}
+    assert summary["size_on_disk"] == os.path.getsize(path)
+    assert summary["sparsity"] == pytest.approx(1 - counts.nnz / (30 * 5))
+    np.testing.assert_allclose(
+        summary["genes"]["mean"], np.asarray(counts.mean(axis=0)).ravel()
+    )
+    np.testing.assert_allclose(
+        summary["genes"]["detection_rate"], (counts != 0).mean(axis=0).A1
+    )
+
+    datasets_df = generic_ref.get_datasets_df()
+    assert dataset_id + ".summary.json" not in datasets_df.index
+    datasets_df = generic_ref.get_datasets_df(include_summary=True)
+    assert datasets_df.loc[dataset_id, "n_cell_types"] == 2
+    assert datasets_df.loc[dataset_id, "batch_keys"] == "donor"
+    assert pd.isna(
+        datasets_df.loc["dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad", "sparsity"]
+    )
+    with pytest.raises(ValueError):
+        generic_ref.get_dataset_summary("dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad")
+
+
+def test_reference_rank_models_by_gene_overlap(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    legacy_id = "80262d08-4a30-4071-a3c6-96274182646d.zip"
+    legacy_model = generic_ref.load_model(legacy_id)
+    legacy_dir = os.path.join(save_path, "legacy_model")
+    shutil.move(
+        os.path.join(
+            os.path.dirname(model_store.download_file(legacy_id)), legacy_id[:-4]
+        ),
+        legacy_dir,
+    )
+    mm = ModelMetadata(
+        cls_name="scvi.model.SCVI",
+        train_dataset="dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad",
+        n_hidden=128,
+        n_layers=1,
+        n_latent=10,
+        use_observed_lib_size=True,
+        init_params="",
+    )
+    model_id = generic_ref.save_model(legacy_dir, None, True, mm)
+    assert model_id + ".genes.json" not in generic_ref.get_models_df().index
+
+    genes = legacy_model.adata.var_names.to_list()
+    ranking = generic_ref.rank_models_by_gene_overlap(legacy_model.adata)
+    assert ranking.index.to_list() == [model_id, legacy_id]
+    assert ranking.loc[model_id, "n_overlap"] == 35
+    assert ranking.loc[model_id, "overlap"] == 1.0
+    assert bool(ranking.loc[model_id, "exact_match"]) is True
+    assert pd.isna(ranking.loc[legacy_id, "overlap"])
+
+    ranking = generic_ref.rank_models_by_gene_overlap(genes[:7] + ["foo"], [model_id])
+    assert ranking.loc[model_id, "n_overlap"] == 7
+    assert ranking.loc[model_id, "overlap"] == pytest.approx(7 / 35)
+    assert ranking.loc[model_id, "query_coverage"] == pytest.approx(7 / 8)
+    assert bool(ranking.loc[model_id, "exact_match"]) is False
+
+
+def test_reference_load_dataset_memory_budget(save_path, monkeypatch):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    counts = np.random.default_rng(0).poisson(0.3, size=(200, 50)).astype(np.float64)
+    adata = anndata.AnnData(counts)
+    adata.layers["dense_counts"] = counts.copy()
+    adata.obsm["embedding"] = np.ones((200, 5))
+    path = os.path.join(save_path, "dense.h5ad")
+    adata.write(path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=True, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+
+    dense = generic_ref.estimate_dataset_memory(dataset_id)
+    assert dense["X"] == counts.nbytes
+    assert dense["layers/dense_counts"] == counts.nbytes
+    small = generic_ref.estimate_dataset_memory(
+        dataset_id, layers=[], obsm=[], sparse=True, dtype="int32"
+    )
+    assert "layers/dense_counts" not in small.index
+    assert small["X"] < counts.nbytes / 2
+
+    with pytest.raises(ValueError):
+        generic_ref.load_dataset(dataset_id, memory_budget=2 * counts.nbytes)
+    loaded = generic_ref.load_dataset(
+        dataset_id,
+        memory_budget=2 * counts.nbytes,
+        layers=[],
+        obsm=[],
+        sparse=True,
+        dtype="int32",
+    )
+    assert sparse.isspmatrix_csr(loaded.X)
+    assert loaded.X.dtype == np.int32
+    assert list(loaded.layers.keys()) == []
+    assert list(loaded.obsm.keys()) == []
+    np.testing.assert_array_equal(loaded.X.toarray(), counts)
+
+    # matrices are converted chunk by chunk, whether they are stored dense or sparse
+    monkeypatch.setattr(_loading, "_CHUNK_SIZE", 1)
+    adata.layers["sparse_counts"] = sparse.csc_matrix(counts)
+    adata.write(path)
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+    estimate = generic_ref.estimate_dataset_memory(dataset_id, dtype="int32")
+    assert estimate["X"] == estimate["layers/dense_counts"] == counts.nbytes // 2
+    loaded = generic_ref.load_dataset(
+        dataset_id, memory_budget=int(estimate.sum()), dtype="int32"
+    )
+    assert loaded.X.dtype == loaded.layers["dense_counts"].dtype == np.int32
+    assert sparse.isspmatrix_csc(loaded.layers["sparse_counts"])
+    assert loaded.layers["sparse_counts"].dtype == np.int32
+    np.testing.assert_array_equal(loaded.layers["sparse_counts"].toarray(), counts)
+    np.testing.assert_array_equal(loaded.layers["dense_counts"], counts)
+    loaded = generic_ref.load_dataset(dataset_id, sparse=True, dtype="float32")
+    assert sparse.isspmatrix_csr(loaded.layers["sparse_counts"])
+    adata.layers["sparse_counts"].data[0] = 0.5
+    adata.write(path)
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+    with pytest.raises(ValueError):
+        generic_ref.load_dataset(dataset_id, layers=["sparse_counts"], dtype="int32")
+
+    loaded = generic_ref.load_dataset(
+        "dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad", dtype="float32"
+    )
+    assert loaded.layers["counts"].dtype == np.float32
+
+
+def test_reference_iter_minibatches(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+
+    counts = sparse.random(250, 20, density=0.3, format="csr", random_state=0)
+    adata = anndata.AnnData(counts)
+    adata.obs["cell_id"] = np.arange(250)
+    adata.obs["batch"] = pd.Categorical(["a", "b"] * 125)
+    path = os.path.join(save_path, "stream.h5ad")
+    adata.write(path)
+    dsm = DatasetMetadata(
+        tissue="Misc", is_cite=False, has_latent_embedding=False, is_annotated=False
+    )
+    dataset_id = generic_ref.save_dataset(path, None, True, dsm)
+    sharded_id = generic_ref.save_dataset(path, None, True, dsm, shard_size=60)
+
+    for key in [dataset_id, sharded_id]:
+        batches = generic_ref.iter_minibatches(
+            key, batch_size=32, obs_keys=["cell_id", "batch"], buffer_size=64, seed=0
+        )
+        assert len(batches) == 8
+        seen = []
+        for batch in batches:
+            assert batch["X"].shape[0] == len(batch["cell_id"]) <= 32
+            np.testing.assert_array_equal(
+                batch["X"].toarray(), counts[batch["cell_id"]].toarray()
+            )
+            np.testing.assert_array_equal(
+                batch["batch"], np.where(batch["cell_id"] % 2 == 0, "a", "b")
+            )
+            seen.extend(batch["cell_id"])
+        assert sorted(seen) == list(range(250))
+        assert seen != list(range(250))
+
+    batches = generic_ref.iter_minibatches(
+        dataset_id, batch_size=100, shuffle=False, obs_keys=["cell_id"], drop_last=True
+    )
+    with batches:
+        cell_ids = [batch["cell_id"].tolist() for batch in batches]
+    assert cell_ids == [list(range(100)), list(range(100, 200))]
+    assert all(dataset._group is None for dataset in batches._datasets)
+
+
+def test_h5ad_dataset_reopened_per_process(save_path, monkeypatch):
+    path = os.path.join(save_path, "stream.h5ad")
+    anndata.AnnData(np.ones((10, 5), dtype=np.float32)).write(path)
+    dataset = H5adDataset(path)
+    parent_file = dataset.group
+    assert dataset.read_obs_block(0, 4).shape == (4, 5)
+
+    # e.g. a forked DataLoader worker, which must not share the handle of its parent
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    child_file = dataset.group
+    assert child_file is not parent_file
+    assert dataset.read_obs_block(4, 10).shape == (6, 5)
+    dataset.close()
+    assert not child_file.id.valid
+    assert parent_file.id.valid
+    monkeypatch.undo()
+    parent_file.close()
+
+    with H5adDataset(path) as dataset:
+        h5_file = dataset.group
+    assert not h5_file.id.valid
+
+
+def test_reference_load_model_overlaps_dataset_fetch(save_path):
+    model_fetched = threading.Event()
+    dataset_waited = []
+
+    class ModelStore(MockStorage):
+        def download_file(self, key):
+            if not key.endswith(".csv"):
+                model_fetched.set()
+            return super().download_file(key)
+
+    class DatasetStore(MockStorage):
+        def download_file(self, key):
+            if key.endswith(".h5ad"):
+                # only returns early if the model is fetched while the dataset is
+                dataset_waited.append(model_fetched.wait(timeout=10))
+            return super().download_file(key)
+
+    generic_ref = GenericReference(
+        model_store=ModelStore("models", save_path),
+        data_store=DatasetStore("datasets", save_path),
+    )
+    model = generic_ref.load_model("80262d08-4a30-4071-a3c6-96274182646d.zip")
+    assert dataset_waited == [True]
+    assert model.adata.n_obs == 100
+
+
+def test_reference_load_model_fails_without_waiting_for_dataset(save_path):
+    release_dataset = threading.Event()
+    dataset_fetched = []
+
+    class ModelStore(MockStorage):
+        def download_file(self, key):
+            if not key.endswith(".csv"):
+                raise ValueError(f"Key {key} not found.")
+            return super().download_file(key)
+
+    class DatasetStore(MockStorage):
+        def download_file(self, key):
+            if key.endswith(".h5ad"):
+                # a slow download, that only finishes once the model fetch failed
+                release_dataset.wait(timeout=10)
+                dataset_fetched.append(key)
+            return super().download_file(key)
+
+    generic_ref = GenericReference(
+        model_store=ModelStore("models", save_path),
+        data_store=DatasetStore("datasets", save_path),
+    )
+    try:
+        with pytest.raises(ValueError):
+            generic_ref.load_model("80262d08-4a30-4071-a3c6-96274182646d.zip")
+        assert dataset_fetched == []
+    finally:
+        release_dataset.set()
+
+
+def test_select(save_path):
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    model_id = "80262d08-4a30-4071-a3c6-96274182646d.zip"
+    dataset_id = "dcfaad7a-70a4-4669-87d2-7bb241673097.h5ad"
+
+    models = generic_ref.select_models(class_name="scvi.model.SCVI", n_latent=(5, 20))
+    assert models.ids == [model_id]
+    assert models.df["n_latent"].dtype == "Int64"
+    assert models.df["use_observed_lib_size"].dtype == "boolean"
+    assert len(generic_ref.select_models(n_latent=(11, None))) == 0
+    assert len(generic_ref.select_models(n_hidden=lambda n: n % 2 == 0)) == 1
+
+    datasets = generic_ref.select_datasets(
+        tissue=["Bone Marrow", "Lung"],
+        is_annotated=True,
+        has_cite=False,
+        cell_count=(50, None),
+    )
+    assert list(datasets) == [dataset_id]
+    assert len(generic_ref.select_datasets(has_cite=True)) == 0
+    with pytest.raises(ValueError):
+        generic_ref.select_datasets(foo=1)
+
+    # the training dataset of the models is prefetched with them
+    paths = models.prefetch()
+    assert sorted(os.path.basename(p) for p in paths) == [model_id, dataset_id]
+    loaded = models.load(use_gpu=False)
+    assert loaded[model_id].adata.n_obs == 100
+    assert datasets.load()[dataset_id].n_obs == 100
+
+
+def test_pretty_print_pages(save_path, monkeypatch):
+    from rich.console import Console
+
+    from scvimadz.reference.base._pretty import CatalogPager, print_catalog
+
+    df = pd.DataFrame(
+        {"tissue": [f"tissue_{i}" for i in range(25)], "cell_count": range(25)},
+        index=pd.Index([f"dataset_{i}" for i in range(25)], name="key"),
+    )
+    pager = CatalogPager(df, page_size=10)
+    assert pager.n_pages == 3
+    assert pager.render_page(2).row_count == 5
+
+    # pages are only rendered when requested
+    rendered = []
+    render_page = CatalogPager.render_page
+    monkeypatch.setattr(
+        CatalogPager,
+        "render_page",
+        lambda self, page: rendered.append(page) or render_page(self, page),
+    )
+    console = Console(file=io.StringIO(), width=200)
+    monkeypatch.setattr(console, "input", lambda prompt: "q")
+    print_catalog(df, page_size=10, console=console, interactive=True)
+    assert rendered == [0]
+    out = console.file.getvalue()
+    assert "dataset_9" in out and "dataset_10" not in out
+
+    rendered.clear()
+    console = Console(file=io.StringIO(), width=200)
+    print_catalog(df, page_size=10, console=console, interactive=False)
+    assert rendered == [0, 1, 2]
+    assert "dataset_24" in console.file.getvalue()
+
+    # a terminal console does not wait for input without a terminal stdin
+    rendered.clear()
+    console = Console(file=io.StringIO(), width=200, force_terminal=True)
+    monkeypatch.setattr(console, "input", lambda prompt: pytest.fail("waited"))
+    monkeypatch.setattr(sys, "stdin", io.StringIO())
+    print_catalog(df, page_size=10, console=console)
+    assert rendered == [0, 1, 2]
+
+    model_store = MockStorage("models", save_path)
+    dataset_store = MockStorage("datasets", save_path)
+    generic_ref = GenericReference(model_store=model_store, data_store=dataset_store)
+    assert len(generic_ref.get_datasets_df(pretty_print=True, page_size=1)) == 1
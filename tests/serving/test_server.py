@@ -0,0 +1,174 @@
+import json
+import os
+import socket
+import stat
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from scvimadz._scvi_compat import check_scvi_version
+from scvimadz.reference import GenericReference
+from scvimadz.serving import MicroBatcher, ModelServer, make_http_server
+from tests.mock import MockStorage
+
+_MODEL_ID = "80262d08-4a30-4071-a3c6-96274182646d.zip"
+
+
+def test_micro_batcher_merges_requests():
+    batches = []
+
+    def fn(items):
+        batches.append(list(items))
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(fn, batch_window=0.2, max_batch_size=100)
+    futures = [batcher.submit(i, size=1) for i in range(5)]
+    assert [f.result() for f in futures] == [0, 2, 4, 6, 8]
+    assert batches[0] == [0, 1, 2, 3, 4]
+
+    # a failing item only fails its own request
+    futures = [batcher.submit(i, size=1) for i in [1, "bad", 3]]
+    assert futures[0].result() == 2
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert futures[2].result() == 6
+
+    # batches are closed once they reach max_batch_size rows
+    batches.clear()
+    start = time.monotonic()
+    assert batcher.submit(7, size=100).result() == 14
+    assert time.monotonic() - start < 0.2
+    batcher.close()
+    with pytest.raises(ValueError):
+        batcher.submit(1)
+
+
+@pytest.fixture
+def model_server(save_path):
+    reference = GenericReference(
+        model_store=MockStorage("models", save_path),
+        data_store=MockStorage("datasets", save_path),
+    )
+    server = ModelServer(
+        reference, [_MODEL_ID], batch_window=0.05, labels_key="cell_type"
+    )
+    yield server
+    server.close()
+
+
+def test_model_server(model_server):
+    assert model_server.model_ids == [_MODEL_ID]
+    genes = model_server.get_model_genes(_MODEL_ID)
+    rng = np.random.default_rng(0)
+    # genes in another order, with an unknown gene and a missing one
+    var_names = genes[::-1][:-1] + ["UNKNOWN"]
+    X = rng.poisson(1.0, size=(8, len(var_names))).astype(np.float32)
+
+    latent = model_server.get_latent_representation(_MODEL_ID, X, var_names)
+    assert latent.shape == (8, 10)
+    results = [None] * 4
+
+    def query(i):
+        results[i] = model_server.get_latent_representation(
+            _MODEL_ID, X[2 * i : 2 * i + 2], var_names
+        )
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    np.testing.assert_allclose(np.concatenate(results), latent, rtol=1e-4, atol=1e-5)
+
+    annotation = model_server.annotate(_MODEL_ID, X, var_names)
+    assert len(annotation["labels"]) == 8
+    assert ((annotation["confidence"] > 0) & (annotation["confidence"] <= 1)).all()
+
+    with pytest.raises(ValueError):
+        model_server.get_latent_representation(_MODEL_ID, X, ["A"] * len(var_names))
+    with pytest.raises(ValueError):
+        model_server.get_latent_representation("foo", X, var_names)
+
+
+def test_model_server_releases_queries(model_server):
+    genes = model_server.get_model_genes(_MODEL_ID)
+    X = np.ones((2, len(genes)), dtype=np.float32)
+    model = model_server._get_warm(_MODEL_ID).model
+    managers = model._per_instance_manager_store[model.id]
+    n_managers = len(managers)
+    for _ in range(5):
+        model_server.get_latent_representation(_MODEL_ID, X, genes)
+        model_server.annotate(_MODEL_ID, X, genes)
+    assert len(managers) == n_managers
+
+
+def test_model_server_http(model_server):
+    http_server = make_http_server(model_server, port=0)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://{}:{}".format(*http_server.server_address)
+    try:
+        with urllib.request.urlopen(f"{url}/models") as response:
+            models = json.load(response)["models"]
+        assert models[0]["model_id"] == _MODEL_ID
+        assert models[0]["can_annotate"]
+
+        genes = model_server.get_model_genes(_MODEL_ID)
+        payload = {"var_names": genes, "X": np.ones((3, len(genes))).tolist()}
+        request = urllib.request.Request(
+            f"{url}/models/{_MODEL_ID}/annotate",
+            data=json.dumps(payload).encode("utf-8"),
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            result = json.load(response)
+        assert np.array(result["latent"]).shape == (3, 10)
+        assert len(result["labels"]) == 3
+
+        request = urllib.request.Request(
+            f"{url}/models/{_MODEL_ID}/latent", data=b"{}", method="POST"
+        )
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 400
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def test_model_server_unix_socket(model_server, save_path):
+    socket_path = os.path.join(save_path, "server.sock")
+    # anything but a socket left behind by a previous server is never removed
+    with open(socket_path, "w") as f:
+        f.write("data")
+    with pytest.raises(ValueError):
+        make_http_server(model_server, socket_path=socket_path)
+    with open(socket_path) as f:
+        assert f.read() == "data"
+    os.remove(socket_path)
+
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    http_server = make_http_server(model_server, socket_path=socket_path)
+    http_server.server_close()
+    assert stat.S_ISSOCK(os.stat(socket_path).st_mode)
+
+
+def test_scvi_version_check(monkeypatch):
+    import scvi
+
+    assert check_scvi_version() == scvi.__version__
+    check_scvi_version.cache_clear()
+    monkeypatch.setattr(scvi, "__version__", "1.0.0")
+    try:
+        with pytest.raises(ValueError):
+            check_scvi_version()
+    finally:
+        check_scvi_version.cache_clear()
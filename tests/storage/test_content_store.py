@@ -0,0 +1,78 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scvimadz.storage import ContentStore
+
+
+def _write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_content_store(save_path):
+    content_store = ContentStore(os.path.join(save_path, "content"))
+    checksum = "md5:" + hashlib.md5(b"weights").hexdigest()
+    assert not content_store.contains(checksum)
+
+    path = os.path.join(save_path, "model.pt")
+    _write(path, b"weights")
+    object_path = content_store.add(path, checksum)
+    assert not os.path.exists(path)
+    assert content_store.contains(checksum)
+
+    links = []
+    for name in ["team_a", "team_b"]:
+        dest = os.path.join(save_path, f"{name}.pt")
+        assert content_store.link(checksum, dest) in ["reflink", "hardlink", "copy"]
+        with open(dest, "rb") as f:
+            assert f.read() == b"weights"
+        links.append(dest)
+    # hard-linked files can not be modified in place
+    if os.stat(object_path).st_nlink > 1:
+        assert not os.stat(links[0]).st_mode & 0o222
+    # files are kept while they are linked, however they were linked
+    assert content_store.collect_garbage() == []
+    assert sorted(content_store.references(checksum)) == sorted(links)
+    # a link replaced by another file does not count anymore
+    os.remove(links[0])
+    _write(links[0], b"other")
+    assert content_store.references(checksum) == [links[1]]
+    assert content_store.collect_garbage() == []
+    os.remove(links[1])
+    assert content_store.collect_garbage(dry_run=True) == [object_path]
+    assert content_store.contains(checksum)
+    assert content_store.collect_garbage() == [object_path]
+    assert not content_store.contains(checksum)
+    assert not os.listdir(
+        os.path.join(save_path, "content", "refs", "md5", checksum[4:6])
+    )
+
+    # corrupted files are never added
+    _write(path, b"weight")
+    with pytest.raises(ValueError):
+        content_store.add(path, "md5:" + hashlib.md5(b"other").hexdigest())
+    assert not os.path.exists(path)
+
+
+def test_content_store_concurrent_links(save_path):
+    content_store = ContentStore(os.path.join(save_path, "content"))
+    checksum = "md5:" + hashlib.md5(b"weights").hexdigest()
+    sources = []
+    for i in range(8):
+        sources.append(os.path.join(save_path, f"download_{i}"))
+        _write(sources[-1], b"weights")
+    dest = os.path.join(save_path, "model.pt")
+
+    # threads of the same process adding and linking the same file do not collide
+    def add_and_link(source):
+        content_store.add(source, checksum)
+        return content_store.link(checksum, dest)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_and_link, sources))
+    with open(dest, "rb") as f:
+        assert f.read() == b"weights"
+    assert not [name for name in os.listdir(save_path) if name.endswith(".tmp")]
@@ -0,0 +1,143 @@
+import io
+import os
+import pickle
+
+import pytest
+
+from scvimadz.storage import ContentStore, FileToUpload, S3Storage
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+_BUCKET = "zoo"
+_CHUNK_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def s3_client():
+    with moto.mock_aws():
+        client = boto3.client(
+            "s3",
+            region_name="us-east-1",
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+        client.create_bucket(Bucket=_BUCKET)
+        yield client
+
+
+def test_s3_storage(save_path, s3_client):
+    data_dir = os.path.join(save_path, "data")
+    os.mkdir(data_dir)
+    store = S3Storage(
+        _BUCKET, data_dir, prefix="models/", client=s3_client, chunk_size=_CHUNK_SIZE
+    )
+    assert store.list_keys() == []
+
+    # larger than a part, so it is uploaded and downloaded in parts
+    content = os.urandom(2 * _CHUNK_SIZE + 123)
+    path = os.path.join(save_path, "model.pt")
+    with open(path, "wb") as f:
+        f.write(content)
+    store.upload_files(
+        [
+            FileToUpload(path, "model.pt"),
+            FileToUpload(io.StringIO("key,a\n1,2\n"), "models_metadata.csv"),
+        ],
+        None,
+        None,
+    )
+    assert sorted(store.list_keys()) == ["model.pt", "models_metadata.csv"]
+    head = s3_client.head_object(Bucket=_BUCKET, Key="models/model.pt")
+    assert head["ETag"].endswith('-3"')  # multipart upload
+    assert store.get_manifest().size("model.pt") == len(content)
+
+    downloaded = store.download_file("model.pt")
+    with open(downloaded, "rb") as f:
+        assert f.read() == content
+    assert store.read_range("model.pt", 10, 20) == content[10:20]
+    with open(store.download_file("models_metadata.csv")) as f:
+        assert f.read() == "key,a\n1,2\n"
+    with pytest.raises(ValueError):
+        store.download_file("foo")
+
+    # unchanged: the local copy is used
+    with open(downloaded, "ab") as f:
+        f.write(b"local")
+    assert os.path.getsize(store.download_file("model.pt")) == len(content) + 5
+    # changed in the bucket: the file is downloaded again
+    s3_client.put_object(Bucket=_BUCKET, Key="models/model.pt", Body=b"new")
+    with open(store.download_file("model.pt"), "rb") as f:
+        assert f.read() == b"new"
+
+
+def test_s3_storage_failed_upload(save_path, s3_client):
+    store = S3Storage(_BUCKET, save_path, client=s3_client)
+    path = os.path.join(save_path, "dataset.h5ad")
+    with open(path, "w") as f:
+        f.write("data")
+    with pytest.raises(Exception):
+        store.upload_files(
+            [
+                FileToUpload(path, "dataset.h5ad"),
+                FileToUpload(os.path.join(save_path, "missing"), "missing.h5ad"),
+            ],
+            None,
+            None,
+        )
+    assert store.list_keys() == []
+
+
+def test_s3_storage_content_store(save_path, s3_client):
+    content_store = ContentStore(os.path.join(save_path, "content"))
+    s3_client.put_object(Bucket=_BUCKET, Key="model.pt", Body=b"weights")
+    paths = []
+    for name in ["team_a", "team_b"]:
+        data_dir = os.path.join(save_path, name)
+        os.mkdir(data_dir)
+        store = S3Storage(
+            _BUCKET, data_dir, client=s3_client, content_store=content_store
+        )
+        paths.append(store.download_file("model.pt"))
+    with open(paths[1], "rb") as f:
+        assert f.read() == b"weights"
+    assert content_store.contains(store.list_checksums()["model.pt"])
+
+
+def test_s3_storage_pickle(save_path, s3_client, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    store = S3Storage(_BUCKET, save_path, client=s3_client)
+    store.upload_files([FileToUpload(io.StringIO("a"), "a.csv")], None, None)
+
+    # e.g. sent to the workers of evaluate_models
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.client is not s3_client
+    assert copy.list_keys() == ["a.csv"]
+    with open(copy.download_file("a.csv")) as f:
+        assert f.read() == "a"
+
+
+def test_s3_storage_failed_upload_keeps_existing_files(save_path, s3_client):
+    store = S3Storage(_BUCKET, save_path, client=s3_client)
+    store.upload_files(
+        [FileToUpload(io.StringIO("key\na\n"), "datasets_metadata.csv")], None, None
+    )
+    path = os.path.join(save_path, "dataset.h5ad")
+    with open(path, "w") as f:
+        f.write("data")
+    # e.g. a compacted metadata file, uploaded along with a file that fails
+    with pytest.raises(Exception):
+        store.upload_files(
+            [
+                FileToUpload(io.StringIO("key\na\nb\n"), "datasets_metadata.csv"),
+                FileToUpload(path, "dataset.h5ad"),
+                FileToUpload(os.path.join(save_path, "missing"), "missing.h5ad"),
+            ],
+            None,
+            None,
+        )
+    assert store.list_keys() == ["datasets_metadata.csv"]
+    body = s3_client.get_object(Bucket=_BUCKET, Key="datasets_metadata.csv")["Body"]
+    assert body.read() == b"key\na\n"
@@ -1,9 +1,19 @@
+import hashlib
 import os
+import pickle
+import threading
 
 import pytest
 import requests
 
-from scvimadz.storage import ZenodoStorage
+from scvimadz.reference import GenericReference
+from scvimadz.storage import (
+    ContentStore,
+    FederatedStorage,
+    RecordManifest,
+    ZenodoStorage,
+    verify_local_files,
+)
 
 _TEST_ZENODO_RECORD = "5805615"
 
@@ -51,3 +61,343 @@ def test_upload_file_invalid_token(save_path):
         assert e.response.status_code == 401
         exception_raised = True
     assert exception_raised
+
+
+def test_offline_mode(save_path, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("network call in offline mode")
+
+    monkeypatch.setattr(requests, "request", no_network)
+    store = ZenodoStorage(_TEST_ZENODO_RECORD, save_path, offline=True)
+    # no snapshot yet
+    with pytest.raises(ValueError):
+        store.list_keys()
+
+    RecordManifest(
+        _TEST_ZENODO_RECORD,
+        {
+            "datasets_metadata.csv": {"size": 5, "checksum": "md5:foo"},
+            "missing.h5ad": {"size": 5, "checksum": "md5:bar"},
+        },
+    ).save(store._manifest_path())
+    with open(os.path.join(save_path, "datasets_metadata.csv"), "w") as f:
+        f.write("hello")
+
+    assert store.list_keys() == ["datasets_metadata.csv", "missing.h5ad"]
+    assert store.list_checksums()["missing.h5ad"] == "md5:bar"
+    file_path = store.download_file("datasets_metadata.csv")
+    assert file_path == os.path.join(save_path, "datasets_metadata.csv")
+    with pytest.raises(ValueError):
+        store.download_file("missing.h5ad")
+    # truncated local copies are never served
+    with open(os.path.join(save_path, "datasets_metadata.csv"), "w") as f:
+        f.write("hel")
+    with pytest.raises(ValueError, match="3 bytes instead of 5"):
+        store.download_file("datasets_metadata.csv")
+    with pytest.raises(ValueError):
+        store.download_file("foo")
+    with pytest.raises(ValueError):
+        store.upload_files(files=[], token="foo", ok_to_reversion_datastore=True)
+
+
+class _FakeResponse:
+    def __init__(self, status_code=200, json=None, content=b"", headers=None):
+        self.status_code = status_code
+        self._json = json
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+
+class _FakeZenodo:
+    """Serves the versions of a Zenodo record from memory."""
+
+    def __init__(self):
+        self.records = {}
+        self.requests = []
+
+    def publish(self, record_id, contents):
+        files = [
+            {
+                "key": key,
+                "size": len(content),
+                "checksum": "md5:" + hashlib.md5(content).hexdigest(),
+            }
+            for key, content in contents.items()
+        ]
+        etag = f'"{record_id}-{len(self.records)}"'
+        self.records[record_id] = (files, contents, etag)
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append(url)
+        record_id = url.split("/")[-1] if "/api/records/" in url else url.split("/")[-3]
+        files, contents, etag = self.records[record_id]
+        if "/api/records/" in url:
+            if (headers or {}).get("If-None-Match") == etag:
+                return _FakeResponse(304)
+            record = {"conceptrecid": 1, "files": files}
+            return _FakeResponse(json=record, headers={"ETag": etag})
+        if url.split("/")[-1] not in contents:
+            return _FakeResponse(404)
+        return _FakeResponse(content=contents[url.split("/")[-1]])
+
+
+def test_manifest_diff():
+    old = RecordManifest(
+        "1",
+        {
+            "a.csv": {"size": 1, "checksum": "md5:a"},
+            "b.h5ad": {"size": 1, "checksum": "md5:b"},
+        },
+    )
+    new = RecordManifest(
+        "2",
+        {
+            "a.csv": {"size": 2, "checksum": "md5:a2"},
+            "c.h5ad": {"size": 1, "checksum": "md5:c"},
+        },
+    )
+    diff = new.diff(old)
+    assert diff.added == ["c.h5ad"]
+    assert diff.removed == ["b.h5ad"]
+    assert diff.changed == ["a.csv"]
+    assert not new.diff(new)
+    assert new.diff(None).added == ["a.csv", "c.h5ad"]
+
+
+def test_incremental_sync(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    zenodo.publish("1", {"metadata.csv": b"v1", "model.pt": b"weights"})
+    store = ZenodoStorage("1", save_path)
+
+    assert store.refresh().added == ["metadata.csv", "model.pt"]
+    store.download_file("metadata.csv")
+    store.download_file("model.pt")
+    n_requests = len(zenodo.requests)
+    # unchanged record: conditional request only, and no download
+    assert not store.refresh()
+    with open(store.download_file("model.pt"), "rb") as f:
+        assert f.read() == b"weights"
+    assert len(zenodo.requests) == n_requests + 1
+    assert not any("/files/" in url for url in zenodo.requests[n_requests:])
+
+    # new version of the record: only the changed file is downloaded again
+    zenodo.publish("2", {"metadata.csv": b"v2", "model.pt": b"weights"})
+    store = ZenodoStorage("2", save_path)
+    diff = store.refresh()
+    assert diff.changed == ["metadata.csv"]
+    assert diff.added == diff.removed == []
+    assert not os.path.exists(os.path.join(save_path, "metadata.csv"))
+    n_requests = len(zenodo.requests)
+    with open(store.download_file("metadata.csv"), "rb") as f:
+        assert f.read() == b"v2"
+    store.download_file("model.pt")
+    downloads = [url for url in zenodo.requests[n_requests:] if "/files/" in url]
+    assert downloads == ["https://zenodo.org/record/2/files/metadata.csv"]
+
+
+def test_download_uses_listed_manifest(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    zenodo.publish("1", {"metadata.csv": b"v1", "a.pt": b"a", "b.pt": b"b"})
+    store = ZenodoStorage("1", save_path)
+
+    # the record is read once when listing it, not again for each download
+    store.list_keys()
+    n_requests = len(zenodo.requests)
+    for key in ["metadata.csv", "a.pt", "b.pt", "a.pt"]:
+        store.download_file(key)
+    assert len(zenodo.requests) == n_requests + 3
+    assert all("/files/" in url for url in zenodo.requests[n_requests:])
+
+    # the record changed since it was listed: the manifest is read again on a mismatch
+    zenodo.publish("1", {"metadata.csv": b"v2-longer", "c.pt": b"c"})
+    os.remove(os.path.join(save_path, "metadata.csv"))
+    with open(store.download_file("metadata.csv"), "rb") as f:
+        assert f.read() == b"v2-longer"
+    with open(store.download_file("c.pt"), "rb") as f:
+        assert f.read() == b"c"
+    with pytest.raises(ValueError):
+        store.download_file("foo")
+
+
+def test_sync_checks_sizes_of_unknown_local_files(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    zenodo.publish(
+        "1", {"good.csv": b"good", "bad.csv": b"fresh", "short.csv": b"complete"}
+    )
+    for key, content in [
+        ("good.csv", b"good"),
+        ("bad.csv", b"stale"),
+        ("short.csv", b"partial"),
+    ]:
+        with open(os.path.join(save_path, key), "wb") as f:
+            f.write(content)
+
+    store = ZenodoStorage("1", save_path)
+    store.refresh()
+    # files are not hashed on the first sync, only those of another size are set aside
+    assert not any("/files/" in url for url in zenodo.requests)
+    assert os.path.exists(os.path.join(save_path, "good.csv"))
+    assert os.path.exists(os.path.join(save_path, "bad.csv"))
+    assert not os.path.exists(os.path.join(save_path, "short.csv"))
+    quarantine_dir = os.path.join(save_path, ".scvimadz", "quarantine")
+    assert [name.split(".")[0] for name in os.listdir(quarantine_dir)] == ["short"]
+    with open(store.download_file("short.csv"), "rb") as f:
+        assert f.read() == b"complete"
+    # checksums are left to verify_local_files
+    assert verify_local_files(store).corrupted == ["bad.csv"]
+
+
+def test_verify_local_files(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    zenodo.publish("1", {"metadata.csv": b"v1", "model.pt": b"weights", "empty": b""})
+    store = ZenodoStorage("1", save_path)
+    for key in ["metadata.csv", "model.pt", "empty"]:
+        store.download_file(key)
+    # truncated by a killed job, and corrupted in place
+    with open(os.path.join(save_path, "model.pt"), "wb") as f:
+        f.write(b"wei")
+    with open(os.path.join(save_path, "metadata.csv"), "wb") as f:
+        f.write(b"v0")
+
+    reference = GenericReference(
+        model_store=store, data_store=store, verify_integrity=True
+    )
+    report = reference.verify_local_files()["models"]
+    assert report.ok and not report.corrupted
+
+    quarantine_dir = os.path.join(save_path, ".scvimadz", "quarantine")
+    assert sorted(f.split(".")[0] for f in os.listdir(quarantine_dir)) == [
+        "metadata",
+        "model",
+    ]
+    with open(os.path.join(save_path, "model.pt"), "rb") as f:
+        assert f.read() == b"weights"
+    n_requests = len(zenodo.requests)
+
+    # offline, corrupted files can only be quarantined
+    with open(os.path.join(save_path, "model.pt"), "wb") as f:
+        f.write(b"wei")
+    offline_store = ZenodoStorage("1", save_path, offline=True)
+    report = verify_local_files(offline_store)
+    assert sorted(report.verified) == ["empty", "metadata.csv", "model.pt"]
+    assert report.corrupted == report.failed == ["model.pt"]
+    assert not report.ok
+    assert not os.path.exists(os.path.join(save_path, "model.pt"))
+    assert len(zenodo.requests) == n_requests
+
+    # network errors while downloading again fail the file, not the verification
+    store.download_file("model.pt")
+    with open(os.path.join(save_path, "model.pt"), "wb") as f:
+        f.write(b"wei")
+
+    def no_connection(method, url, **kwargs):
+        if "/files/" in url:
+            raise requests.ConnectionError("connection reset")
+        return zenodo.request(method, url, **kwargs)
+
+    monkeypatch.setattr(requests, "request", no_connection)
+    report = verify_local_files(store)
+    assert report.corrupted == report.failed == ["model.pt"]
+    assert not report.ok
+
+
+def test_shared_content_store(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    zenodo.publish("1", {"model.pt": b"weights"})
+    content_store = ContentStore(os.path.join(save_path, "content"))
+    paths = []
+    for name in ["team_a", "team_b"]:
+        data_dir = os.path.join(save_path, name)
+        os.mkdir(data_dir)
+        store = ZenodoStorage("1", data_dir, content_store=content_store)
+        paths.append(store.download_file("model.pt"))
+    # downloaded once, and linked into both data directories
+    assert len([url for url in zenodo.requests if "/files/" in url]) == 1
+    for path in paths:
+        with open(path, "rb") as f:
+            assert f.read() == b"weights"
+
+    # corrupted local copies are not linked again from the content store
+    os.remove(paths[1])
+    with open(paths[1], "wb") as f:
+        f.write(b"weighs")
+    assert verify_local_files(store).ok
+    assert len([url for url in zenodo.requests if "/files/" in url]) == 2
+
+
+def test_federated_storage(save_path, monkeypatch):
+    zenodo = _FakeZenodo()
+    monkeypatch.setattr(requests, "request", zenodo.request)
+    header = b"key,class_name,train_dataset,n_hidden,n_layers,n_latent,use_observed_lib_size,init_params\n"
+    zenodo.publish(
+        "1",
+        {
+            "models_metadata.csv": header
+            + b"lung.zip,scvi.model.SCVI,,128,1,10,True,\n",
+            "lung.zip": b"lung",
+        },
+    )
+    zenodo.publish(
+        "2",
+        {
+            "models_metadata.csv": header
+            + b"blood.zip,scvi.model.SCVI,,128,2,30,True,\n",
+            "blood.zip": b"blood",
+        },
+    )
+    store = FederatedStorage.from_zenodo_records(["1", "2"], save_path)
+    assert sorted(store.list_keys()) == ["blood.zip", "lung.zip", "models_metadata.csv"]
+    n_requests = len(zenodo.requests)
+
+    # keys are routed to their record from the cached listing
+    with open(store.download_file("blood.zip"), "rb") as f:
+        assert f.read() == b"blood"
+    assert zenodo.requests[n_requests:] == [
+        "https://zenodo.org/record/2/files/blood.zip"
+    ]
+    with pytest.raises(ValueError):
+        store.download_file("foo")
+
+    # the metadata of all records is merged into one catalog
+    reference = GenericReference(model_store=store, data_store=store)
+    assert reference.select_models(n_latent=(20, None)).ids == ["blood.zip"]
+    assert sorted(reference.get_models_df().index) == ["blood.zip", "lung.zip"]
+    report = verify_local_files(store)
+    assert report.ok and "blood.zip" in report.verified
+
+    # e.g. sent to the workers of evaluate_models
+    copy = pickle.loads(pickle.dumps(store))
+    with open(copy.download_file("lung.zip"), "rb") as f:
+        assert f.read() == b"lung"
+
+    with pytest.raises(ValueError):
+        store.upload_files([], None, None)
+
+    # an upload invalidating the routing table right after it is rebuilt
+    class InvalidatingLock:
+        def __init__(self):
+            self._lock = threading.Lock()
+
+        def __enter__(self):
+            self._lock.__enter__()
+
+        def __exit__(self, *args):
+            self._lock.__exit__(*args)
+            store._routes = None
+
+    store._lock = InvalidatingLock()
+    store._routes = {}
+    assert store.owners("lung.zip") == [store.stores[0]]
+    assert store.owners("blood.zip") == [store.stores[1]]
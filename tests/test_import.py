@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+# budget (in seconds) for importing the reference and storage APIs, which must not pull in
+# the heavy scientific stack
+_IMPORT_TIME_BUDGET = 1.0
+_HEAVY_MODULES = ["anndata", "pandas", "rich.table", "scvi", "torch"]
+
+_IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import scvimadz
+from scvimadz.reference import GenericReference, TabulaSapiensReference
+from scvimadz.storage import ZenodoStorage
+print(time.perf_counter() - start)
+print(",".join(m for m in {heavy} if m in sys.modules))
+"""
+
+
+def test_import_is_lazy():
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT.format(heavy=_HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    import_time, heavy_imported = float(out[0]), out[1]
+    assert heavy_imported == ""
+    assert import_time < _IMPORT_TIME_BUDGET
@@ -0,0 +1,15 @@
+import os
+import re
+
+from scvimadz._scvi_compat import _SUPPORTED_VERSIONS, check_scvi_version
+
+_PYPROJECT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "pyproject.toml")
+
+
+def test_supported_scvi_versions_are_pinned():
+    with open(_PYPROJECT) as f:
+        pinned = re.search(r'^scvi-tools = "(.*)"$', f.read(), re.MULTILINE).group(1)
+    low, high = (".".join(map(str, version)) for version in _SUPPORTED_VERSIONS)
+    assert pinned == f">={low}.0,<{high}.0"
+    # the tests run against a supported version
+    check_scvi_version()